@@ -2,16 +2,31 @@ import os
 import json
 import logging
 import datetime
-import base64
-import shutil
-from io import BytesIO
-from PIL import Image
-from werkzeug.security import check_password_hash, generate_password_hash
-from werkzeug.utils import secure_filename
+import tempfile
+import threading
+import click
+from werkzeug.datastructures import FileStorage
 from flask import (
     Flask, render_template, request, redirect, 
     url_for, session, flash, jsonify, send_from_directory
 )
+from storage import create_repository, parse_audited, BACKEND_FILES, BACKEND_SEGMENTS
+from catalog import CatalogCache
+from indexes import SetupIndexes, MATCH_CONTAINS, MATCH_PREFIX
+from search import SearchIndex, search_setups
+from facets import FacetIndex, facet_counts
+from stats import StatsIndex, setup_stats
+from changeovers import ChangeoverIndex, changeover_stats, GROUP_BY as CHANGEOVER_GROUP_BY
+from setup_ids import new_setup_id, is_setup_id
+from photos import PhotoEncoder, photo_list, decode_photo, encode_photo, save_photos, spool_photo, images_ratio
+from image_policy import ImagePolicies, ImagePolicy
+from photo_queue import PhotoQueue, async_photos_enabled, STATUS_FAILED as PHOTO_JOB_FAILED
+from uploads import UploadStaging, UploadNotFound, UploadIncomplete, UploadOffsetMismatch
+from auth import (
+    UserDirectory, login_required, role_required,
+    remember_user, forget_user, current_profile
+)
+from passwords import PasswordVerifier, LoginBusy, hash_password, needs_rehash
 
 
 # Configure logging
@@ -19,7 +34,10 @@ logging.basicConfig(level=logging.DEBUG)
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "setup_tracking_secret_key")
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB
+# Fotos enviadas como arquivos (multipart/form-data): limite da requisição inteira
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get("MAX_UPLOAD_MB", 64)) * 1024 * 1024
+# Campos de texto do formulário, incluindo o base64 das fotos dos clientes antigos
+app.config['MAX_FORM_MEMORY_SIZE'] = 16 * 1024 * 1024  # 16MB
 app.debug = True
 
 # Configurar Jinja2 para tratar corretamente comparações booleanas
@@ -46,96 +64,170 @@ def ensure_dir(directory):
     if not os.path.exists(directory):
         os.makedirs(directory)
 
+def remove_empty_dir(directory):
+    """Remove directory if it exists and is empty (undoes ensure_dir)."""
+    try:
+        os.rmdir(directory)
+    except OSError:
+        pass
+
 # Root data directory
 DATA_DIR = "dados_setup"
-ensure_dir(DATA_DIR)
-
-# Initialize users.json and qrcodes.json if they don't exist
-def init_data_files():
-    """Initialize data files if they don't exist."""
-    users_file = os.path.join(DATA_DIR, "users.json")
-    qrcodes_file = os.path.join(DATA_DIR, "qrcodes.json")
-    
-    # Create users.json with a default admin user if it doesn't exist
-    if not os.path.exists(users_file):
-        with open(users_file, 'w') as f:
-            # Alterado para hash mais simples para fins de demonstração
-            json.dump([{
-                "username": "admin",
-                "password": generate_password_hash("admin123")
-            }], f)
-    else:
-        # Tentar reconstruir o arquivo users.json para garantir que a senha funcione
+
+# Repositório, cadastro de QR codes e de usuários: criados por create_app(),
+# para que importar este módulo não grave nada em disco nem calcule hashes
+repository = None
+catalog = None
+directory = None
+password_verifier = None
+setup_indexes = None
+photo_queue = None
+photo_encoder = None
+upload_staging = None
+image_policies = None
+
+# Situação das fotos no registro do setup (campo photo_status)
+PHOTO_PROCESSING = "processing"
+PHOTO_COMPLETE = "complete"
+PHOTO_FAILED = "failed"
+
+
+def create_app(backend=None):
+    """Configura e devolve a aplicação (usada por main.py e pelo gunicorn).
+
+    Não grava arquivos nem calcula hashes de senha: os arquivos de dados e o
+    usuário admin são criados uma única vez com `flask --app main bootstrap`.
+
+    Args:
+        backend: (Opcional) Backend de armazenamento; por padrão, usa
+            SETUP_STORAGE_BACKEND
+
+    Returns:
+        Flask: A aplicação configurada
+    """
+    global repository, catalog, directory, password_verifier, setup_indexes, photo_queue, photo_encoder, upload_staging, image_policies
+    
+    if repository is not None and backend is None:
+        return app
+    
+    # Repositório dos registros de setup (backend definido por SETUP_STORAGE_BACKEND)
+    repository = create_repository(DATA_DIR, backend)
+    
+    # Cache do cadastro de QR codes (células, produtos e itens)
+    catalog = CatalogCache(repository)
+    
+    # Cadastro de usuários em cache (usado pelos decorators de autenticação)
+    directory = UserDirectory(repository)
+    
+    # Verificação de senhas num pool de processos limitado (ver passwords.py)
+    password_verifier = PasswordVerifier(app.secret_key)
+    
+    # Índices em memória dos filtros e da busca da auditoria (carregados ao iniciar o worker, ver warm_up_worker)
+    setup_indexes = SetupIndexes(repository)
+    setup_indexes.register("search", SearchIndex())
+    setup_indexes.register("facets", FacetIndex())
+    setup_indexes.register("stats", StatsIndex())
+    setup_indexes.register("changeovers", ChangeoverIndex())
+    
+    # Conversão das fotos em paralelo, com limite por worker (ver photos.py)
+    photo_encoder = PhotoEncoder()
+    
+    # Formato, dimensões e tamanho das imagens por célula e tipo de setup (ver image_policy.py)
+    image_policies = ImagePolicies(DATA_DIR)
+    
+    # Fila das fotos recebidas no POST /setup (threads criadas ao iniciar o worker ou no
+    # primeiro registro com fotos, ver warm_up_worker e photo_queue.py)
+    photo_queue = PhotoQueue(
+        DATA_DIR, process_photo_job, on_failure=photo_job_failed, is_registered=photo_job_registered
+    )
+    
+    # Fotos enviadas em partes antes do formulário (ver uploads.py)
+    upload_staging = UploadStaging(DATA_DIR, max_size=app.config['MAX_CONTENT_LENGTH'])
+    
+    app.extensions['setup_repository'] = repository
+    app.extensions['setup_indexes'] = setup_indexes
+    app.extensions['user_directory'] = directory
+    app.extensions['photo_queue'] = photo_queue
+    return app
+
+def warm_up_worker():
+    """Prepara um worker recém-criado do gunicorn (chamada por gunicorn.conf.py).
+
+    Inicia as threads da fila de fotos, que retomam as tarefas pendentes
+    após um reinício (sem isso, só o próximo registro com fotos as
+    iniciaria), e carrega os índices da auditoria a partir do diário numa
+    thread, em vez de na primeira consulta de um auditor (uma consulta que
+    chegue antes espera a carga terminar). A thread evita que uma carga
+    demorada segure o worker além do timeout do gunicorn.
+
+    Nada é feito antes do bootstrap (sem a pasta de dados).
+    """
+    if not os.path.isdir(DATA_DIR):
+        return
+    if photo_queue is not None:
+        photo_queue.start()
+    if setup_indexes is None or not setup_indexes.enabled:
+        return
+
+    def load():
         try:
-            logging.debug("Tentando recriar o usuário admin")
-            with open(users_file, 'r') as f:
-                users = json.load(f)
-            
-            # Atualizar a senha do admin, se existir
-            for user in users:
-                if user['username'] == 'admin':
-                    user['password'] = generate_password_hash("admin123")
-                    logging.debug("Senha do admin atualizada")
-                    break
-            
-            # Se não houver admin, criar um
-            if not any(user['username'] == 'admin' for user in users):
-                users.append({
-                    "username": "admin",
-                    "password": generate_password_hash("admin123")
-                })
-                logging.debug("Novo usuário admin criado")
-            
-            # Salvar arquivo atualizado
-            with open(users_file, 'w') as f:
-                json.dump(users, f)
+            setup_indexes.refresh()
         except Exception as e:
-            logging.error(f"Erro ao atualizar users.json: {e}")
+            logging.error(f"Erro ao carregar os índices da auditoria: {e}")
+
+    threading.Thread(target=load, name="setup-indexes-warm-up", daemon=True).start()
+
+# Criar os arquivos de dados e o usuário admin (executado pelo comando bootstrap)
+def init_data_files(admin_password, reset_admin=False, echo=logging.info):
+    """Initialize data files if they don't exist.
+    
+    Args:
+        admin_password: Senha do usuário admin, usada somente quando ele é criado
+            (ou quando reset_admin=True)
+        reset_admin: Redefinir a senha do admin mesmo que ele já exista
+        echo: Função usada para reportar o que foi feito
+    """
+    ensure_dir(DATA_DIR)
+    
+    try:
+        users = repository.load_users()
+    except FileNotFoundError:
+        users = []
+    
+    admin = next((user for user in users if user.get('username') == 'admin'), None)
+    if admin is None:
+        users.append({
+            "username": "admin",
+            "password": hash_password(admin_password)
+        })
+        repository.save_users(users)
+        echo("Usuário admin criado")
+    elif reset_admin:
+        admin['password'] = hash_password(admin_password)
+        repository.save_users(users)
+        echo("Senha do admin redefinida")
+    else:
+        echo("Usuário admin já existe")
     
     # Create qrcodes.json if it doesn't exist
-    if not os.path.exists(qrcodes_file):
-        with open(qrcodes_file, 'w') as f:
-            json.dump({}, f)
-
-init_data_files()
+    try:
+        repository.load_qrcodes()
+    except FileNotFoundError:
+        repository.save_qrcodes({})
+        echo("Cadastro de QR codes criado")
+    
+    # Converter QR codes do formato antigo (somente o nome da célula)
+    if update_qrcodes_format():
+        echo("Formato dos QR codes atualizado")
 
-# Nota: A atualização do formato dos QR codes será chamada após todas as funções estarem definidas
 
 def get_users():
-    """Get all users from users.json."""
-    try:
-        with open(os.path.join(DATA_DIR, "users.json"), 'r') as f:
-            users_list = json.load(f)
-            # Converter lista para dicionário para facilitar a manipulação
-            users_dict = {}
-            for user in users_list:
-                username = user.get('username')
-                if username:
-                    users_dict[username] = {
-                        'password': user.get('password'),
-                        'last_updated': user.get('last_updated', ''),
-                        'profile': user.get('profile', 'auditor')  # Por padrão, usuários existentes serão auditores
-                    }
-            return users_dict
-    except (FileNotFoundError, json.JSONDecodeError) as e:
-        logging.error(f"Error loading users: {e}")
-        return {}
+    """Get a copy of all users as a dictionary keyed by username."""
+    return {username: dict(data) for username, data in directory.users().items()}
         
 def save_users(users_dict):
     """Save users dictionary to users.json in list format."""
-    users_list = []
-    for username, data in users_dict.items():
-        user_entry = {
-            'username': username,
-            'password': data.get('password'),
-            'profile': data.get('profile', 'auditor')
-        }
-        if 'last_updated' in data:
-            user_entry['last_updated'] = data['last_updated']
-        users_list.append(user_entry)
-    
-    with open(os.path.join(DATA_DIR, "users.json"), 'w') as f:
-        json.dump(users_list, f)
+    directory.save(users_dict)
         
 def add_user(username, password, profile='auditor'):
     """Add a new user or update existing user.
@@ -158,7 +250,7 @@ def add_user(username, password, profile='auditor'):
     
     # Adicionar novo usuário ou atualizar existente
     users[username] = {
-        'password': generate_password_hash(password),
+        'password': hash_password(password),
         'last_updated': timestamp,
         'profile': profile
     }
@@ -184,21 +276,35 @@ def delete_user(username):
     return False
     
 def authenticate_user(username, password):
-    """Authenticate a user with username and password."""
-    users = get_users()
-    if username in users:
-        stored_hash = users[username]['password']
-        return check_password_hash(stored_hash, password)
-    return False
+    """Authenticate a user with username and password.
+    
+    Raises:
+        LoginBusy: Se há verificações de senha demais em andamento
+    """
+    user = directory.get(username)
+    if not user or not user.get('password') or not password:
+        return False
+    
+    device = f"{request.remote_addr}|{request.user_agent.string}"
+    if not password_verifier.verify(username, user['password'], password, device):
+        return False
+    
+    # Refazer o hash gravado com os parâmetros configurados atualmente
+    if needs_rehash(user['password']):
+        try:
+            directory.set_password_hash(username, password_verifier.hash(password))
+            logging.info(f"Hash da senha atualizado para o usuário {username}")
+        except Exception as e:
+            logging.error(f"Erro ao atualizar o hash da senha de {username}: {e}")
+    return True
 
 def get_qrcodes():
-    """Get all QR codes from qrcodes.json."""
-    try:
-        with open(os.path.join(DATA_DIR, "qrcodes.json"), 'r') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError) as e:
-        logging.error(f"Error loading QR codes: {e}")
-        return {}
+    """Get a copy of all QR codes (safe to modify and pass to save_qrcodes)."""
+    return catalog.copy_qrcodes()
+
+def save_qrcodes(qrcodes):
+    """Save the QR codes dictionary and refresh the catalog cache."""
+    catalog.save_qrcodes(qrcodes)
 
 def save_qrcode(qrcode_value, cell_name):
     """Save a new QR code and cell name mapping."""
@@ -210,8 +316,7 @@ def save_qrcode(qrcode_value, cell_name):
         "products": []
     }
     
-    with open(os.path.join(DATA_DIR, "qrcodes.json"), 'w') as f:
-        json.dump(qrcodes, f)
+    save_qrcodes(qrcodes)
         
 def update_qrcode(qrcode_value, new_cell_name):
     """Atualizar um QR code existente.
@@ -235,8 +340,7 @@ def update_qrcode(qrcode_value, new_cell_name):
                 "products": []
             }
         
-        with open(os.path.join(DATA_DIR, "qrcodes.json"), 'w') as f:
-            json.dump(qrcodes, f)
+        save_qrcodes(qrcodes)
         return True
     
     return False
@@ -254,8 +358,7 @@ def delete_qrcode(qrcode_value):
     
     if qrcode_value in qrcodes:
         del qrcodes[qrcode_value]
-        with open(os.path.join(DATA_DIR, "qrcodes.json"), 'w') as f:
-            json.dump(qrcodes, f)
+        save_qrcodes(qrcodes)
         return True
     
     return False
@@ -280,8 +383,7 @@ def update_qrcodes_format():
     
     # Salvar se houve alguma atualização
     if updated:
-        with open(os.path.join(DATA_DIR, "qrcodes.json"), 'w') as f:
-            json.dump(qrcodes, f)
+        save_qrcodes(qrcodes)
     
     return updated
 
@@ -300,38 +402,37 @@ def add_product_to_cell(cell_name, product_code, product_name):
     qrcodes = get_qrcodes()
     found = False
     
-    # Encontrar a célula pelo nome
-    for qrcode, data in qrcodes.items():
-        if isinstance(data, dict) and data.get("cell_name") == cell_name:
-            # Garantir que há uma lista de produtos
-            if "products" not in data:
-                data["products"] = []
-                
-            # Verificar se o produto já existe
-            product_exists = False
-            for product in data["products"]:
-                if product.get("code") == product_code:
-                    # Atualizar nome se necessário
-                    if product.get("name") != product_name:
-                        product["name"] = product_name
-                    product_exists = True
-                    break
-                    
-            # Adicionar novo produto se não existir
-            if not product_exists:
-                data["products"].append({
-                    "code": product_code,
-                    "name": product_name,
-                    "items": []  # Lista vazia de itens
-                })
+    # Encontrar a célula pelo nome (índice do cadastro em cache)
+    qrcode = catalog.cell_names().get(str(cell_name))
+    data = qrcodes.get(qrcode) if qrcode is not None else None
+    if isinstance(data, dict):
+        # Garantir que há uma lista de produtos
+        if "products" not in data:
+            data["products"] = []
+            
+        # Verificar se o produto já existe
+        product_exists = False
+        for product in data["products"]:
+            if product.get("code") == product_code:
+                # Atualizar nome se necessário
+                if product.get("name") != product_name:
+                    product["name"] = product_name
+                product_exists = True
+                break
                 
-            found = True
-            break
+        # Adicionar novo produto se não existir
+        if not product_exists:
+            data["products"].append({
+                "code": product_code,
+                "name": product_name,
+                "items": []  # Lista vazia de itens
+            })
+            
+        found = True
     
     # Salvar mudanças se encontrou a célula
     if found:
-        with open(os.path.join(DATA_DIR, "qrcodes.json"), 'w') as f:
-            json.dump(qrcodes, f)
+        save_qrcodes(qrcodes)
         return True
         
     return False
@@ -352,42 +453,41 @@ def add_item_to_product(cell_name, product_code, item_code, item_name):
     qrcodes = get_qrcodes()
     found = False
     
-    # Encontrar a célula pelo nome
-    for qrcode, data in qrcodes.items():
-        if isinstance(data, dict) and data.get("cell_name") == cell_name:
-            # Encontrar o produto pelo código
-            for product in data.get("products", []):
-                if product.get("code") == product_code:
-                    # Garantir que há uma lista de itens
-                    if "items" not in product:
-                        product["items"] = []
-                        
-                    # Verificar se o item já existe
-                    item_exists = False
-                    for item in product["items"]:
-                        if item.get("code") == item_code:
-                            # Atualizar nome se necessário
-                            if item.get("name") != item_name:
-                                item["name"] = item_name
-                            item_exists = True
-                            break
-                            
-                    # Adicionar novo item se não existir
-                    if not item_exists:
-                        product["items"].append({
-                            "code": item_code,
-                            "name": item_name
-                        })
+    # Encontrar a célula pelo nome (índice do cadastro em cache)
+    qrcode = catalog.cell_names().get(str(cell_name))
+    data = qrcodes.get(qrcode) if qrcode is not None else None
+    if isinstance(data, dict):
+        # Encontrar o produto pelo código
+        for product in data.get("products", []):
+            if product.get("code") == product_code:
+                # Garantir que há uma lista de itens
+                if "items" not in product:
+                    product["items"] = []
+                    
+                # Verificar se o item já existe
+                item_exists = False
+                for item in product["items"]:
+                    if item.get("code") == item_code:
+                        # Atualizar nome se necessário
+                        if item.get("name") != item_name:
+                            item["name"] = item_name
+                        item_exists = True
+                        break
                         
-                    found = True
-                    break
+                # Adicionar novo item se não existir
+                if not item_exists:
+                    product["items"].append({
+                        "code": item_code,
+                        "name": item_name
+                    })
                     
-            break
+                found = True
+                break
+                
     
     # Salvar mudanças se encontrou a célula e o produto
     if found:
-        with open(os.path.join(DATA_DIR, "qrcodes.json"), 'w') as f:
-            json.dump(qrcodes, f)
+        save_qrcodes(qrcodes)
         return True
         
     return False
@@ -406,50 +506,17 @@ def get_cell_products(cell_name):
         logging.warning("Nome da célula está vazio, retornando lista vazia")
         return []
         
-    qrcodes = get_qrcodes()
-    
-    # Log para diagnóstico extensivo
     logging.info(f"Buscando produtos para célula: {cell_name}")
     
-    # Verificação de segurança para o arquivo qrcodes.json
-    if not qrcodes:
-        logging.warning("Arquivo qrcodes.json está vazio ou não existe")
-        return []
-    
-    try:
-        logging.debug(f"Estrutura de qrcodes.json: {json.dumps(qrcodes, indent=2)[:200]}...")
-        logging.debug(f"Chaves disponíveis no primeiro nível: {list(qrcodes.keys())}")
-    except Exception as e:
-        logging.error(f"Erro ao analisar qrcodes.json: {str(e)}")
-    
-    # Busca direta pela chave exata no dicionário
-    if cell_name in qrcodes:
-        cell_data = qrcodes[cell_name]
-        logging.debug(f"Dados encontrados para célula {cell_name} diretamente: {json.dumps(cell_data, indent=2)}")
-        
-        if isinstance(cell_data, dict):
-            products = cell_data.get("products", [])
-            logging.debug(f"Produtos encontrados diretamente: {json.dumps(products, indent=2)}")
-            if products:
-                logging.debug(f"Produtos encontrados diretamente para célula {cell_name}: {len(products)}")
-                return products
-    
-    # Busca por correspondência entre cell_name e data.cell_name (pode ser que a chave seja o código QR diferente do nome da célula)
-    logging.debug(f"Buscando por correspondência entre cell_name={cell_name} e data.cell_name em todos os QR codes")
-    for qrcode, data in qrcodes.items():
-        if isinstance(data, dict):
-            data_cell_name = str(data.get("cell_name", ""))
-            logging.debug(f"Verificando QR {qrcode} com cell_name={data_cell_name}")
-            if data_cell_name and data_cell_name == str(cell_name):
-                products = data.get("products", [])
-                logging.debug(f"Produtos encontrados via QR {qrcode}: {json.dumps(products, indent=2)}")
-                if products:
-                    logging.debug(f"Produtos encontrados para célula {cell_name} via QR code {qrcode}: {len(products)}")
-                    return products
+    # Busca exata pela chave ou pelo nome da célula
+    products = catalog.cell_products(cell_name)
+    if products:
+        logging.debug(f"Produtos encontrados para célula {cell_name}: {len(products)}")
+        return products
     
     # Busca por correspondência parcial como último recurso
     logging.debug(f"Tentando busca por correspondência parcial para {cell_name}")
-    for qrcode, data in qrcodes.items():
+    for qrcode, data in catalog.qrcodes().items():
         if isinstance(data, dict):
             data_cell_name = str(data.get("cell_name", ""))
             if data_cell_name and (str(cell_name) in data_cell_name or data_cell_name in str(cell_name)):
@@ -476,43 +543,24 @@ def get_product_items(cell_name, product_code):
         logging.debug("Nome da célula ou código do produto está vazio, retornando lista vazia")
         return []
         
-    qrcodes = get_qrcodes()
     logging.debug(f"Buscando itens para célula: {cell_name}, produto: {product_code}")
     
-    # Primeiro tentamos encontrar a célula
-    cell_data = None
-    
-    # Busca direta pela chave exata no dicionário
-    if cell_name in qrcodes:
-        cell_data = qrcodes[cell_name]
-        logging.debug(f"Dados encontrados para célula {cell_name} diretamente")
-    else:
-        # Busca por correspondência entre cell_name e data.cell_name
-        for qrcode, data in qrcodes.items():
-            if isinstance(data, dict):
-                data_cell_name = str(data.get("cell_name", ""))
-                if data_cell_name and data_cell_name == str(cell_name):
-                    cell_data = data
-                    logging.debug(f"Dados encontrados para célula {cell_name} via QR code {qrcode}")
-                    break
-        
-        # Busca por correspondência parcial como último recurso
-        if not cell_data:
-            for qrcode, data in qrcodes.items():
-                if isinstance(data, dict):
-                    data_cell_name = str(data.get("cell_name", ""))
-                    if data_cell_name and (str(cell_name) in data_cell_name or data_cell_name in str(cell_name)):
-                        cell_data = data
-                        logging.debug(f"Dados encontrados para célula {cell_name} por correspondência parcial")
-                        break
+    # Busca exata pela chave ou pelo nome da célula
+    items = catalog.product_items(cell_name, product_code)
+    if items is not None:
+        logging.debug(f"Itens encontrados para produto {product_code}: {len(items)}")
+        return items
     
-    # Se encontramos a célula, procuramos o produto
-    if cell_data and isinstance(cell_data, dict):
-        for product in cell_data.get("products", []):
-            if str(product.get("code")) == str(product_code):
-                items = product.get("items", [])
-                logging.debug(f"Itens encontrados para produto {product_code}: {len(items)}")
-                return items
+    # Busca por correspondência parcial como último recurso
+    for qrcode, data in catalog.qrcodes().items():
+        if isinstance(data, dict):
+            data_cell_name = str(data.get("cell_name", ""))
+            if data_cell_name and (str(cell_name) in data_cell_name or data_cell_name in str(cell_name)):
+                logging.debug(f"Dados encontrados para célula {cell_name} por correspondência parcial")
+                for product in data.get("products", []):
+                    if str(product.get("code")) == str(product_code):
+                        return product.get("items", [])
+                break
     
     logging.debug(f"Nenhum item encontrado para o produto {product_code} na célula {cell_name}")
     return []
@@ -524,10 +572,9 @@ def get_all_cells():
     Returns:
         list: Lista com informações de todas as células
     """
-    qrcodes = get_qrcodes()
     cells = []
     
-    for qrcode, data in qrcodes.items():
+    for qrcode, data in catalog.qrcodes().items():
         if isinstance(data, dict):
             cell_info = {
                 "qrcode": qrcode,
@@ -560,19 +607,18 @@ def remove_product_from_cell(cell_name, product_code):
     qrcodes = get_qrcodes()
     found = False
     
-    # Encontrar a célula pelo nome
-    for qrcode, data in qrcodes.items():
-        if isinstance(data, dict) and data.get("cell_name") == cell_name:
-            # Filtrar produtos para remover o produto específico
-            if "products" in data:
-                data["products"] = [p for p in data["products"] if p.get("code") != product_code]
-                found = True
-            break
+    # Encontrar a célula pelo nome (índice do cadastro em cache)
+    qrcode = catalog.cell_names().get(str(cell_name))
+    data = qrcodes.get(qrcode) if qrcode is not None else None
+    if isinstance(data, dict):
+        # Filtrar produtos para remover o produto específico
+        if "products" in data:
+            data["products"] = [p for p in data["products"] if p.get("code") != product_code]
+            found = True
     
     # Salvar mudanças se encontrou a célula
     if found:
-        with open(os.path.join(DATA_DIR, "qrcodes.json"), 'w') as f:
-            json.dump(qrcodes, f)
+        save_qrcodes(qrcodes)
         return True
         
     return False
@@ -592,23 +638,22 @@ def remove_item_from_product(cell_name, product_code, item_code):
     qrcodes = get_qrcodes()
     found = False
     
-    # Encontrar a célula pelo nome
-    for qrcode, data in qrcodes.items():
-        if isinstance(data, dict) and data.get("cell_name") == cell_name:
-            # Encontrar o produto pelo código
-            for product in data.get("products", []):
-                if product.get("code") == product_code:
-                    # Filtrar itens para remover o item específico
-                    if "items" in product:
-                        product["items"] = [i for i in product["items"] if i.get("code") != item_code]
-                        found = True
-                    break
-            break
+    # Encontrar a célula pelo nome (índice do cadastro em cache)
+    qrcode = catalog.cell_names().get(str(cell_name))
+    data = qrcodes.get(qrcode) if qrcode is not None else None
+    if isinstance(data, dict):
+        # Encontrar o produto pelo código
+        for product in data.get("products", []):
+            if product.get("code") == product_code:
+                # Filtrar itens para remover o item específico
+                if "items" in product:
+                    product["items"] = [i for i in product["items"] if i.get("code") != item_code]
+                    found = True
+                break
     
     # Salvar mudanças se encontrou a célula e o produto
     if found:
-        with open(os.path.join(DATA_DIR, "qrcodes.json"), 'w') as f:
-            json.dump(qrcodes, f)
+        save_qrcodes(qrcodes)
         return True
         
     return False
@@ -620,28 +665,14 @@ def get_cell_name(qrcode_value):
         return None
         
     logging.info(f"get_cell_name: Buscando célula para QR code {qrcode_value}")
-    qrcodes = get_qrcodes()
-    
-    # Verificar se qrcodes é um dicionário válido
-    if not isinstance(qrcodes, dict):
-        logging.error(f"get_cell_name: QR codes data is not a dictionary: {type(qrcodes)}")
-        return None
-        
-    # Log para diagnóstico
-    try:
-        qrcode_keys = list(qrcodes.keys())
-        logging.debug(f"get_cell_name: QR codes disponíveis: {qrcode_keys[:5]}...")
-        logging.debug(f"get_cell_name: Total de QR codes: {len(qrcode_keys)}")
-    except Exception as e:
-        logging.error(f"get_cell_name: Erro ao listar QR codes: {str(e)}")
     
     # Verificar se o QR code existe - tentativa com valor exato
-    cell_data = qrcodes.get(qrcode_value)
+    cell_data = catalog.lookup_qrcode(qrcode_value)
     
     # Se não encontrou com valor exato, tentar com string
     if cell_data is None and str(qrcode_value) != qrcode_value:
         logging.debug(f"get_cell_name: Tentando com valor string: {str(qrcode_value)}")
-        cell_data = qrcodes.get(str(qrcode_value))
+        cell_data = catalog.lookup_qrcode(str(qrcode_value))
         
     # Se ainda não encontrou, tentar outras opções de formatação
     if cell_data is None:
@@ -649,8 +680,9 @@ def get_cell_name(qrcode_value):
         try:
             qrcode_int = int(qrcode_value)
             qrcode_no_leading_zeros = str(qrcode_int)
-            logging.debug(f"get_cell_name: Tentando sem zeros à esquerda: {qrcode_no_leading_zeros}")
-            cell_data = qrcodes.get(qrcode_no_leading_zeros)
+            if qrcode_no_leading_zeros != qrcode_value:
+                logging.debug(f"get_cell_name: Tentando sem zeros à esquerda: {qrcode_no_leading_zeros}")
+                cell_data = catalog.lookup_qrcode(qrcode_no_leading_zeros)
         except (ValueError, TypeError):
             pass
     
@@ -676,7 +708,7 @@ def get_cell_name(qrcode_value):
         logging.error(f"get_cell_name: Unknown cell format for QR code {qrcode_value}: {type(cell_data)}")
         return None
 
-def save_setup(cell_name, order_number, supplier_name, photo_data, observation, verification_check, product_code=None, product_name=None, selected_items=None, setup_type="supply"):
+def save_setup(cell_name, order_number, supplier_name, photo_data, observation, verification_check, product_code=None, product_name=None, selected_items=None, setup_type="supply", photo_files=None):
     """Save setup data to a text file and the photo as an image file.
     
     Args:
@@ -691,6 +723,9 @@ def save_setup(cell_name, order_number, supplier_name, photo_data, observation,
         product_po: (Removido) Não é mais utilizado
         selected_items: (Opcional) Lista de itens selecionados com seus POs de fornecedor (apenas para abastecimento)
         setup_type: Tipo de setup ('removal' para retirada, 'supply' para abastecimento)
+        photo_files: (Opcional) Fotos enviadas como arquivos (multipart/form-data)
+            ou caminhos das fotos já recebidas pela área de envios; quando
+            informadas, photo_data é ignorado
     """
     if not cell_name or not order_number or not supplier_name:
         logging.error("Missing required setup data")
@@ -708,6 +743,7 @@ def save_setup(cell_name, order_number, supplier_name, photo_data, observation,
     
     # Criar um objeto de dados para salvar
     data = {
+        "setup_id": new_setup_id(),  # ID estável usado pelas APIs (ver setup_ids.py)
         "order_number": order_number,
         "supplier_name": supplier_name,
         "timestamp": timestamp,
@@ -745,56 +781,55 @@ def save_setup(cell_name, order_number, supplier_name, photo_data, observation,
         # Adicionar log para debug do array de itens
         logging.debug(f"Itens selecionados para salvar: {data.get('selected_items', [])}")
     
-    # Caminho completo do arquivo de texto
-    txt_path = os.path.join(cell_dir, f"{file_identifier}.txt")
-    
     # Diretório para as imagens
     images_dir = os.path.join(cell_dir, file_identifier)
     ensure_dir(images_dir)
     
     # Processar dados de fotos
-    if photo_data:
-        # Garantir que photo_data seja uma lista
-        if not isinstance(photo_data, list):
-            photo_data = [photo_data]
-        
-        # Processar cada foto na lista
-        for index, photo_base64 in enumerate(photo_data):
+    staged_photos = None
+    if photo_files:
+        photos = list(photo_files)
+    else:
+        photos = [decode_photo(photo) for photo in photo_list(photo_data)]
+    if photos:
+        # A política de imagens usada fica no registro (a fila a lê de lá)
+        policy = image_policies.resolve(cell_name, setup_type)
+        data["image_policy"] = policy.to_dict()
+        if async_photos_enabled():
+            # As fotos são convertidas pela fila (ver photo_queue.py); o registro
+            # é completado quando a tarefa terminar
+            job_id = photo_queue.new_job_id()
             try:
-                # Extrair apenas os dados da imagem (remover o cabeçalho se estiver presente)
-                if ',' in photo_base64:
-                    photo_base64 = photo_base64.split(',')[1]
-                
-                # Decodificar os dados da imagem
-                photo_bytes = base64.b64decode(photo_base64)
-                
-                # Nome do arquivo da foto
-                photo_filename = f"image_{index+1}.jpg"
-                photo_path = os.path.join(images_dir, photo_filename)
-                
-                # Abrir a imagem a partir dos bytes
-                img = Image.open(BytesIO(photo_bytes))
-                
-                # Converter para RGB se estiver em modo P (palette) ou outros modos
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                # Redimensionar se a imagem for muito grande
-                max_size = (1200, 1200)
-                img.thumbnail(max_size, Image.LANCZOS)
-                
-                # Salvar com qualidade reduzida
-                img.save(photo_path, format='JPEG', optimize=True, quality=85)
-                
-                # Adicionar informação da imagem ao array de imagens
-                data["images"].append({
-                    "filename": photo_filename,
-                    "path": os.path.join(file_identifier, photo_filename)
-                })
-                
-            except Exception as e:
-                logging.error(f"Error saving photo {index+1}: {e}")
-                # Não falhar completamente só por causa da foto
+                staged_photos = photo_queue.stage(job_id, photos)
+            except OSError as e:
+                # Ex.: disco cheio, ou o envio de um token já usado por outra
+                # requisição; as fotos já movidas voltam para a área de envios
+                photo_queue.unstage(job_id, photos)
+                remove_empty_dir(images_dir)
+                logging.error(f"Error staging photos: {e}")
+                return False, f"Erro ao gravar as fotos: {str(e)}"
+            data["photo_status"] = PHOTO_PROCESSING
+            data["photo_job"] = job_id
+        elif photo_files:
+            # Os arquivos do formulário são gravados em disco e convertidos a partir
+            # deles; as fotos da área de envios são convertidas de lá mesmo (os
+            # envios só são apagados depois que o registro é gravado)
+            try:
+                with tempfile.TemporaryDirectory() as spool_dir:
+                    sources = [
+                        spool_photo(photo, os.path.join(spool_dir, f"photo_{index + 1}.raw"))
+                        if isinstance(photo, FileStorage) else photo
+                        for index, photo in enumerate(photos)
+                    ]
+                    data["images"], _ = save_photos(images_dir, file_identifier, sources, photo_encoder, policy)
+            except OSError as e:
+                remove_empty_dir(images_dir)
+                logging.error(f"Error spooling photos: {e}")
+                return False, f"Erro ao gravar as fotos: {str(e)}"
+            data["image_ratio"] = images_ratio(data["images"])
+        else:
+            data["images"], _ = save_photos(images_dir, file_identifier, photos, photo_encoder, policy)
+            data["image_ratio"] = images_ratio(data["images"])
         
         # Definir que tem imagem se pelo menos uma foi salva com sucesso
         data["has_image"] = len(data["images"]) > 0
@@ -812,6 +847,7 @@ def save_setup(cell_name, order_number, supplier_name, photo_data, observation,
                 new_path = os.path.join(images_dir, photo_filename)
                 
                 # Usar PIL para ler e salvar a imagem
+                from PIL import Image
                 img = Image.open(img_path)
                 img.save(new_path, format='JPEG', optimize=True, quality=85)
                 
@@ -829,161 +865,179 @@ def save_setup(cell_name, order_number, supplier_name, photo_data, observation,
             except Exception as e:
                 logging.error(f"Error converting old image format: {e}")
     
-    # Salvar os dados no arquivo de texto
+    # Salvar os dados no repositório; a tarefa das fotos é criada antes (staged)
+    # e só liberada depois da gravação, então nenhuma das duas fica sem a outra
     try:
-        with open(txt_path, 'w') as f:
-            json.dump(data, f)
-        return True, "Setup registrado com sucesso"
+        if staged_photos is not None:
+            photo_queue.reserve(data["photo_job"], cell_name, file_identifier, data["setup_id"], staged_photos)
+        repository.save_setup(cell_name, file_identifier, data)
     except Exception as e:
+        if staged_photos is not None:
+            # Sem registro, a tarefa não existe: as fotos da área de envios
+            # voltam para lá, e os tokens continuam valendo para um novo envio
+            try:
+                photo_queue.discard(data["photo_job"])
+            except Exception as discard_error:
+                logging.error(f"Error discarding photo job {data['photo_job']}: {discard_error}")
+            photo_queue.unstage(data["photo_job"], photos, staged_photos)
+            remove_empty_dir(images_dir)
         logging.error(f"Error saving setup data: {e}")
         return False, f"Erro ao salvar dados do setup: {str(e)}"
+    if staged_photos is not None:
+        try:
+            photo_queue.activate(data["photo_job"])
+        except Exception as e:
+            # O registro já foi gravado: a manutenção da fila libera a tarefa depois
+            logging.error(f"Error activating photo job {data['photo_job']}: {e}")
+    return True, "Setup registrado com sucesso"
+
+def _record_photos(cell_name, file_identifier, photo_status, images=None):
+    # Relê o registro (pode ter sido alterado durante a conversão) antes de gravar as fotos
+    data = repository.get_setup(cell_name, file_identifier)
+    if data is None:
+        return False
+    if images is not None:
+        data["images"] = images
+        data["image_ratio"] = images_ratio(images)
+        data["has_image"] = len(images) > 0
+        if images:
+            data["main_image"] = images[0]["path"]
+    data["photo_status"] = photo_status
+    repository.save_setup(cell_name, file_identifier, data)
+    return True
+
+def process_photo_job(job):
+    """Converte as fotos de uma tarefa da fila e completa o registro do setup.
+    
+    Executada pelas threads da fila (ver photo_queue.py). As fotos convertidas
+    entram no registro mesmo se outra falhar; a exceção faz a tarefa ser
+    tentada de novo.
+    """
+    cell_name, file_identifier = job["cell_name"], job["file_identifier"]
+    setup_data = repository.get_setup(cell_name, file_identifier)
+    if setup_data is None:
+        # Setup excluído enquanto as fotos aguardavam
+        return
+    # Política registrada no envio (a padrão para setups gravados antes das políticas)
+    policy = ImagePolicy.from_dict(setup_data.get("image_policy"))
+    images_dir = os.path.join(DATA_DIR, cell_name, file_identifier)
+    images, errors = save_photos(images_dir, file_identifier, job["photos"], photo_encoder, policy)
+    _record_photos(cell_name, file_identifier, PHOTO_PROCESSING if errors else PHOTO_COMPLETE, images)
+    if errors:
+        raise RuntimeError("; ".join(f"foto {number}: {message}" for number, message in errors))
+
+def photo_job_failed(job, error):
+    """Marca o setup de uma tarefa de fotos que esgotou as tentativas."""
+    _record_photos(job["cell_name"], job["file_identifier"], PHOTO_FAILED)
+
+def photo_job_registered(job):
+    """Indica se o registro do setup aponta para a tarefa de fotos (ver PhotoQueue.recover_staged)."""
+    setup_data = repository.get_setup(job["cell_name"], job["file_identifier"])
+    return setup_data is not None and setup_data.get("photo_job") == job["id"]
+
+def recover_photo_jobs(echo=logging.info):
+    """Resolve os setups com fotos em processamento cuja tarefa não existe mais.
+    
+    Acontece se o worker caiu entre a gravação do registro e a criação da
+    tarefa (versões anteriores) ou se a fila foi apagada. As fotos que ainda
+    estão na área de espera voltam para a fila; sem elas, o setup é marcado
+    com photo_status "failed". As tarefas staged esquecidas também são
+    resolvidas (ver PhotoQueue.recover_staged).
+    
+    Returns:
+        tuple: (setups com as fotos de volta na fila, setups marcados como falha)
+    """
+    photo_queue.recover_staged()
+    requeued = failed = 0
+    for cell_name in repository.list_cells():
+        for setup_data in repository.iter_cell_setups(cell_name):
+            if setup_data.get("photo_status") != PHOTO_PROCESSING:
+                continue
+            job_id = setup_data.get("photo_job")
+            job = photo_queue.get(job_id) if job_id else None
+            if job is not None and job["status"] != PHOTO_JOB_FAILED:
+                continue
+            file_identifier = setup_data["file_identifier"]
+            paths = photo_queue.staged_paths(job_id) if job_id and job is None else []
+            if paths:
+                photo_queue.enqueue(job_id, cell_name, file_identifier, setup_data.get("setup_id"), paths)
+                requeued += 1
+                echo(f"Fotos do setup {cell_name}/{file_identifier} de volta na fila")
+            else:
+                _record_photos(cell_name, file_identifier, PHOTO_FAILED)
+                failed += 1
+                echo(f"Fotos do setup {cell_name}/{file_identifier} marcadas como falha")
+    return requeued, failed
+
+def requeue_failed_photos(echo=logging.info):
+    """Devolve à fila as tarefas de fotos que esgotaram as tentativas (ex.: depois de corrigir a causa).
+    
+    O setup volta para photo_status "processing" antes de a tarefa ser
+    liberada. Tarefas de setups excluídos são ignoradas.
+    
+    Returns:
+        int: Quantidade de tarefas de volta na fila
+    """
+    requeued = 0
+    for job in photo_queue.failed_jobs():
+        cell_name, file_identifier = job["cell_name"], job["file_identifier"]
+        if not _record_photos(cell_name, file_identifier, PHOTO_PROCESSING):
+            continue
+        if photo_queue.retry(job["id"]):
+            requeued += 1
+            echo(f"Fotos do setup {cell_name}/{file_identifier} de volta na fila")
+    return requeued
+
 def get_all_setups():
     """Get all setup data organized by cells."""
-    cells = {}
-    
-    # Iterate through cell directories
-    for item in os.listdir(DATA_DIR):
-        cell_dir = os.path.join(DATA_DIR, item)
-        if os.path.isdir(cell_dir) and item not in ["__pycache__"]:
-            cells[item] = []
-            
-            # Iterate through text files in each cell directory
-            for file in os.listdir(cell_dir):
-                if file.endswith(".txt") and not file.startswith('reset_'):
-                    # O nome do arquivo agora inclui o tipo de setup (order_number_setup_type.txt)
-                    file_basename = file.split(".")[0]
-                    
-                    # Verificar se o arquivo segue o novo formato (com tipo de setup)
-                    if "_" in file_basename:
-                        order_number, setup_type = file_basename.rsplit("_", 1)
-                    else:
-                        # Compatibilidade com arquivos antigos (sem tipo de setup)
-                        order_number = file_basename
-                        setup_type = "supply"  # Assumir que setups antigos são do tipo abastecimento
-                    
-                    txt_path = os.path.join(cell_dir, file)
-                    
-                    # Load setup data from text file
-                    try:
-                        with open(txt_path, 'r') as f:
-                            setup_data = json.load(f)
-                        
-                        # Adicionar tipo de setup se não existir no dado carregado
-                        if "setup_type" not in setup_data:
-                            setup_data["setup_type"] = setup_type
-                            
-                        # Garantir que o campo audited é um booleano
-                        if "audited" in setup_data:
-                            if isinstance(setup_data["audited"], str):
-                                setup_data["audited"] = setup_data["audited"].lower() in ['true', 'yes', '1', 'on']
-                            setup_data["audited"] = bool(setup_data["audited"])
-                        
-                        # Garantir que file_identifier está disponível para referência posterior
-                        setup_data["file_identifier"] = file_basename
-                        
-                        # Verificar imagens no novo formato (múltiplas imagens)
-                        if "images" in setup_data and isinstance(setup_data["images"], list) and len(setup_data["images"]) > 0:
-                            # Novo formato com múltiplas imagens
-                            setup_data["has_image"] = True
-                            # Garantir que a primeira imagem é a principal para compatibilidade
-                            setup_data["main_image"] = setup_data["images"][0]["path"] if setup_data["images"] else ""
-                        else:
-                            # Verificar formato antigo (imagem única)
-                            img_path = os.path.join(cell_dir, f"{file_basename}.jpg")
-                            if os.path.exists(img_path):
-                                setup_data["has_image"] = True
-                                # Converter formato antigo para o novo
-                                setup_data["images"] = [{
-                                    "filename": f"{file_basename}.jpg",
-                                    "path": f"{file_basename}.jpg"
-                                }]
-                                setup_data["main_image"] = f"{file_basename}.jpg"
-                            else:
-                                # Verificar pasta de imagens
-                                images_dir = os.path.join(cell_dir, file_basename)
-                                if os.path.isdir(images_dir):
-                                    # Procurar por imagens na pasta
-                                    image_files = [f for f in os.listdir(images_dir) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-                                    if image_files:
-                                        setup_data["has_image"] = True
-                                        setup_data["images"] = []
-                                        for img_file in image_files:
-                                            setup_data["images"].append({
-                                                "filename": img_file,
-                                                "path": os.path.join(file_basename, img_file)
-                                            })
-                                        setup_data["main_image"] = os.path.join(file_basename, image_files[0])
-                                    else:
-                                        setup_data["has_image"] = False
-                                        setup_data["images"] = []
-                                else:
-                                    setup_data["has_image"] = False
-                                    setup_data["images"] = []
-                        
-                        cells[item].append(setup_data)
-                    except (json.JSONDecodeError, FileNotFoundError) as e:
-                        logging.error(f"Error loading setup data from {txt_path}: {e}")
+    return repository.get_all_setups()
+
+def find_setup_by_id(setup_id):
+    """Obtém um setup pelo ID (ver setup_ids.py), sem percorrer a célula.
     
-    return cells
+    Returns:
+        tuple: (nome da célula, registro completo), ou (None, None) se o ID
+        for inválido ou não existir
+    """
+    if not is_setup_id(setup_id):
+        return None, None
+    location = setup_indexes.locate(setup_id)
+    if location is None:
+        return None, None
+    cell_name, file_identifier = location
+    setup_data = repository.get_setup(cell_name, file_identifier)
+    if setup_data is None:
+        return None, None
+    return cell_name, setup_data
 
-def update_setup(cell_name, order_number, supplier_name, observation, verification_check, audited=None, auditor_name=None, setup_type=None, photo_data=None, timestamp=None, audit_notes=None):
-    """Update an existing setup data file."""
+def update_setup(cell_name, order_number, supplier_name, observation, verification_check, audited=None, auditor_name=None, setup_type=None, photo_data=None, timestamp=None, audit_notes=None, setup_id=None):
+    """Update an existing setup data file.
+    
+    O setup é localizado pelo setup_id, se informado; caso contrário, é usado
+    o registro mais recente da ordem/tipo na célula (formato antigo).
+    """
     # Adicionar log detalhado dos dados recebidos
     logging.debug(f"Atualizando setup: cell_name={cell_name}, order_number={order_number}, supplier_name={supplier_name}, observation={observation}, verification_check={verification_check}, setup_type={setup_type}")
     
     # Normalizar o valor de verification_check para booleano
     if isinstance(verification_check, str):
         verification_check = verification_check.lower() in ['true', 'on', '1', 'yes']
-    # Diretório da célula
-    cell_dir = os.path.join(DATA_DIR, cell_name)
-    
-    if not os.path.isdir(cell_dir):
-        logging.error(f"Diretório da célula não encontrado: {cell_dir}")
-        return False
-    
-    # Procurar por arquivos que correspondam ao padrão
-    text_file_path = None
-    
-    # Se temos um tipo de setup específico, vamos procurar arquivos com esse padrão
-    if setup_type:
-        prefix = f"{order_number}_{setup_type}"
-        matching_files = []
-        
-        for file in os.listdir(cell_dir):
-            if file.endswith(".txt") and file.startswith(prefix):
-                matching_files.append(file)
-        
-        if matching_files:
-            # Ordenar os arquivos por ordem alfabética (o mais recente será o último)
-            matching_files.sort()
-            # Usar o arquivo mais recente
-            text_file_path = os.path.join(cell_dir, matching_files[-1])
-            logging.debug(f"Arquivo encontrado para atualização: {text_file_path}")
-        else:
-            logging.error(f"Nenhum arquivo encontrado com padrão {prefix}*.txt na célula {cell_name}")
+    if setup_id:
+        cell_name, data = find_setup_by_id(setup_id)
+        if data is None:
+            logging.error(f"Nenhum setup encontrado com o ID {setup_id}")
             return False
+        order_number = data.get("order_number", order_number)
     else:
-        # Se não temos o tipo, vamos procurar arquivos com esse order_number
-        matching_files = []
-        
-        for file in os.listdir(cell_dir):
-            if file.endswith(".txt") and file.startswith(f"{order_number}_"):
-                matching_files.append(file)
-        
-        if matching_files:
-            # Ordenar os arquivos por ordem alfabética (o mais recente será o último)
-            matching_files.sort()
-            # Usar o arquivo mais recente
-            text_file_path = os.path.join(cell_dir, matching_files[-1])
-            logging.debug(f"Arquivo encontrado para atualização (sem tipo especificado): {text_file_path}")
-        else:
-            logging.error(f"Nenhum arquivo encontrado para order_number={order_number} na célula {cell_name}")
+        # Usar o registro mais recente da ordem (e do tipo, se informado)
+        data = repository.find_latest_setup(cell_name, order_number, setup_type)
+        if data is None:
+            logging.error(f"Nenhum setup encontrado para order_number={order_number}, setup_type={setup_type} na célula {cell_name}")
             return False
+    setup_identifier = data["file_identifier"]
+    logging.debug(f"Setup encontrado para atualização: {setup_identifier}")
     
     try:
-        with open(text_file_path, 'r') as f:
-            data = json.load(f)
-        
         # Log dos dados atuais antes da atualização
         logging.debug(f"Dados antes da atualização: supplier_name={data.get('supplier_name', '')}, observation={data.get('observation', '')}")
         
@@ -1025,43 +1079,20 @@ def update_setup(cell_name, order_number, supplier_name, observation, verificati
             cell_dir = os.path.join(DATA_DIR, cell_name)
             file_identifier = f"{order_number}_{data.get('setup_type', 'supply')}"
             
-            # Verificar se photo_data é uma string única ou uma lista
-            if isinstance(photo_data, str):
-                photo_data_list = [photo_data]
-            elif isinstance(photo_data, list):
-                photo_data_list = photo_data
+            # Arquivo enviado (multipart/form-data) ou base64; no base64, só a
+            # primeira imagem é processada (formato antigo)
+            if isinstance(photo_data, FileStorage):
+                photo_source = photo_data.stream
             else:
-                photo_data_list = []
+                photo_data_list = photo_list(photo_data)
+                photo_source = decode_photo(photo_data_list[0]) if photo_data_list else None
             
-            # Processar apenas a primeira imagem no formato antigo
-            if photo_data_list:
-                photo_item = photo_data_list[0]
-                # Remove the "data:image/jpeg;base64," part
-                if "base64," in photo_item:
-                    photo_item = photo_item.split("base64,")[1]
-                    
+            if photo_source is not None:
                 try:
-                    # Decode photo data
-                    photo_bytes = base64.b64decode(photo_item)
                     photo_path = os.path.join(cell_dir, f"{file_identifier}.jpg")
                     
                     # Processar imagem para reduzir tamanho
-                    from PIL import Image
-                    from io import BytesIO
-                    
-                    # Abrir a imagem a partir dos bytes
-                    img = Image.open(BytesIO(photo_bytes))
-                    
-                    # Converter para RGB se estiver em modo P (palette) ou outros modos
-                    if img.mode != 'RGB':
-                        img = img.convert('RGB')
-                    
-                    # Redimensionar se a imagem for muito grande
-                    max_size = (1200, 1200)
-                    img.thumbnail(max_size, Image.LANCZOS)
-                    
-                    # Salvar com qualidade reduzida
-                    img.save(photo_path, format='JPEG', optimize=True, quality=85)
+                    encode_photo(photo_source, photo_path)
                     
                     # Marcar que tem imagem
                     data["has_image"] = True
@@ -1073,39 +1104,23 @@ def update_setup(cell_name, order_number, supplier_name, observation, verificati
         # Registrar conteúdo antes de salvar
         logging.debug(f"Dados finais antes de salvar: observation={data.get('observation', '(vazio)')}")
         
-        # Salvar arquivo
-        with open(text_file_path, 'w') as f:
-            json.dump(data, f)
-            
-        # Verificar se o arquivo foi salvo corretamente
-        try:
-            with open(text_file_path, 'r') as f:
-                saved_data = json.load(f)
-                logging.debug(f"Verificação após salvar: observation={saved_data.get('observation', '(não encontrado)')}")
-        except Exception as e:
-            logging.error(f"Erro ao verificar arquivo salvo: {e}")
+        # Salvar registro
+        repository.save_setup(cell_name, setup_identifier, data)
+        
+        # Registrar a mudança no histórico de auditorias
+        if audited is not None:
+            repository.record_audit(cell_name, setup_identifier, data)
             
         return True
-    except (FileNotFoundError, json.JSONDecodeError) as e:
+    except Exception as e:
         logging.error(f"Error updating setup: {e}")
         return False
 
 # Rota para atualizar o formato dos QR codes
 @app.route('/update_qrcodes_format')
+@role_required('auditor', message='Acesso restrito. Apenas auditores podem acessar esta função.')
 def update_qrcodes_format_route():
     """Atualiza o formato dos QR codes para o novo formato com produtos."""
-    if not session.get('logged_in'):
-        return redirect(url_for('login', next=request.path))
-    
-    # Verificar se o usuário tem permissão (apenas auditores)
-    username = session.get('username')
-    users = get_users()
-    user_profile = users.get(username, {}).get('profile', 'supplier')
-    
-    if user_profile != 'auditor':
-        flash('Acesso restrito. Apenas auditores podem acessar esta função.', 'danger')
-        return redirect(url_for('index'))
-    
     try:
         updated = update_qrcodes_format()
         if updated:
@@ -1121,12 +1136,8 @@ def update_qrcodes_format_route():
 @app.route('/')
 def index():
     """Render the home page."""
-    username = session.get('username')
-    user_profile = 'visitor'  # Default perfil para não logados
-    
-    if username:
-        users = get_users()
-        user_profile = users.get(username, {}).get('profile', 'visitor')
+    # Perfil guardado na sessão ('visitor' para não logados)
+    user_profile = current_profile(default='visitor') or 'visitor'
     
     return render_template('index.html', user_profile=user_profile)
 
@@ -1139,10 +1150,16 @@ def login():
         
         logging.debug(f"Login attempt: username={username}")
         
-        if authenticate_user(username, password):
+        try:
+            authenticated = authenticate_user(username, password)
+        except LoginBusy as e:
+            logging.warning(f"Login recusado temporariamente para {username}: {e}")
+            flash('Muitos acessos ao mesmo tempo. Aguarde alguns segundos e tente novamente.', 'warning')
+            return render_template('login.html'), 503, {'Retry-After': '5'}
+        
+        if authenticated:
             logging.debug(f"Login successful for user: {username}")
-            session['logged_in'] = True
-            session['username'] = username
+            remember_user(username, directory.get(username))
             
             # Add debug flash message for successful login
             flash(f'Login bem-sucedido como {username}', 'success')
@@ -1158,20 +1175,10 @@ def login():
     return render_template('login.html')
 
 @app.route('/cadastro_usuarios', methods=['GET', 'POST'])
+@role_required('auditor')
 def cadastro_usuarios():
     """Gerenciar usuários do sistema."""
-    # Verificar se o usuário está logado
-    if not session.get('logged_in'):
-        return redirect(url_for('login', next=request.path))
-    
-    # Verificar se o usuário tem permissão (apenas auditores)
     username = session.get('username')
-    users = get_users()
-    user_profile = users.get(username, {}).get('profile', 'supplier')
-    
-    if user_profile != 'auditor':
-        flash('Acesso restrito. Apenas auditores podem acessar esta página.', 'danger')
-        return redirect(url_for('index'))
     
     if request.method == 'POST':
         action = request.form.get('action')
@@ -1234,21 +1241,17 @@ def cadastro_usuarios():
 @app.route('/logout')
 def logout():
     """Handle user logout."""
-    session.pop('logged_in', None)
-    session.pop('username', None)
+    forget_user()
     flash('You have been logged out', 'success')
     return redirect(url_for('index'))
 
 @app.route('/setup', methods=['GET', 'POST'])
 @app.route('/setup', methods=['GET', 'POST'])
+@login_required
 def setup():
     """Handle setup registration."""
-    if not session.get('logged_in'):
-        return redirect(url_for('login', next=request.path))
-    
     username = session.get('username')
-    users = get_users()
-    user_profile = users.get(username, {}).get('profile', 'supplier')
+    user_profile = current_profile()
     
     if request.method == 'POST':
         # Obter dados do formulário
@@ -1259,6 +1262,16 @@ def setup():
         verification_check = request.form.get('verification_check', '') in ['on', 'true', 'True', '1']
         setup_type = request.form.get('setup_type', 'supply')
         photo_data_json = request.form.get('photo_data', '')
+        # Fotos enviadas como arquivos (clientes atuais); photo_data fica para os antigos
+        photo_files = [upload for upload in request.files.getlist('photos') if upload]
+        # Fotos já enviadas em partes pela área de envios (ver uploads.py)
+        try:
+            photo_tokens = json.loads(request.form.get('photo_tokens') or '[]')
+        except json.JSONDecodeError:
+            photo_tokens = []
+        if not isinstance(photo_tokens, list):
+            photo_tokens = []
+        photo_tokens = list(dict.fromkeys(token for token in photo_tokens if isinstance(token, str)))
         
         # Obter dados específicos de produto e itens (para tipo de setup 'supply')
         product_code = request.form.get('product_code')
@@ -1302,6 +1315,13 @@ def setup():
             product_name = None
             selected_items = []
         
+        if photo_tokens:
+            try:
+                photo_files = upload_staging.claim(photo_tokens, username)
+            except (UploadNotFound, UploadIncomplete):
+                flash('As fotos enviadas expiraram ou não terminaram de chegar. Selecione as fotos novamente.', 'danger')
+                return redirect(url_for('setup', qrcode=cell_qrcode))
+        
         # Converter string JSON para lista de imagens, se for JSON
         try:
             if photo_data_json.startswith('[') and photo_data_json.endswith(']'):
@@ -1324,10 +1344,15 @@ def setup():
             product_code=product_code if setup_type == 'supply' else None,
             product_name=product_name if setup_type == 'supply' else None,
             selected_items=selected_items if setup_type == 'supply' else None,
-            setup_type=setup_type
+            setup_type=setup_type,
+            photo_files=photo_files
         )
         
         if save_result:
+            # As fotos dos envios já foram movidas para o setup
+            for token in photo_tokens:
+                upload_staging.discard(token)
+            
             # Mensagem de sucesso específica para o tipo de setup
             if setup_type == 'removal':
                 flash('Retirada de material registrada com sucesso!', 'success')
@@ -1351,9 +1376,8 @@ def setup():
         
         if cell_name:
             # Vamos tentar uma abordagem diferente para obter produtos diretamente do JSON
-            qrcodes = get_qrcodes()
-            if qrcode in qrcodes:
-                qrcode_data = qrcodes[qrcode]
+            qrcode_data = catalog.lookup_qrcode(qrcode)
+            if qrcode_data is not None:
                 logging.debug(f"Dados encontrados para QR code {qrcode}: {json.dumps(qrcode_data, indent=2)}")
                 
                 if isinstance(qrcode_data, dict) and "products" in qrcode_data:
@@ -1380,6 +1404,8 @@ def setup():
                           user_profile=user_profile, 
                           username=username,
                           cell_products=cell_products)
+
+@app.route('/api/check_setup_status')
 def check_setup_status():
     """API para verificar o status dos setups para uma célula e ordem de produção específica.
     
@@ -1398,27 +1424,10 @@ def check_setup_status():
             "has_supply": False
         }), 400
     
-    # Verificar arquivos para a ordem na célula
-    cell_dir = os.path.join(DATA_DIR, cell_name)
-    has_removal = False
-    has_supply = False
-    
-    # Verificar arquivos de setup específicos para esta ordem
-    if os.path.isdir(cell_dir):
-        for file in os.listdir(cell_dir):
-            if file.endswith(".txt") and file.startswith(f"{order_number}_"):
-                file_path = os.path.join(cell_dir, file)
-                try:
-                    with open(file_path, 'r') as f:
-                        data = json.load(f)
-                    
-                    setup_type = data.get('setup_type', '')
-                    if setup_type == 'removal':
-                        has_removal = True
-                    elif setup_type == 'supply':
-                        has_supply = True
-                except Exception as e:
-                    logging.error(f"Erro ao ler arquivo de setup {file_path}: {e}")
+    # Verificar os setups registrados para esta ordem
+    setup_types = {setup['setup_type'] for setup in repository.find_setup_summaries(cell_name, order_number)}
+    has_removal = 'removal' in setup_types
+    has_supply = 'supply' in setup_types
     
     return jsonify({
         "success": True,
@@ -1428,122 +1437,348 @@ def check_setup_status():
     })
 
 @app.route('/audit')
+@role_required('auditor')
 def audit():
-    """Display the audit page."""
-    if not session.get('logged_in'):
-        return redirect(url_for('login', next=request.path))
+    """Display the audit page.
     
-    # Verificar se o usuário tem permissão (apenas auditores)
-    username = session.get('username')
-    users = get_users()
-    user_profile = users.get(username, {}).get('profile', 'supplier')
+    A página só traz os filtros; os setups são carregados página a página
+    pela API /api/setups.
+    """
+    return render_template('audit.html')
+
+# Tamanho padrão e máximo das páginas da listagem de setups
+SETUPS_PAGE_SIZE = 50
+SETUPS_MAX_PAGE_SIZE = 200
+
+def prepare_setup_for_listing(setup):
+    """Garantir que os dados do setup estão no formato esperado pela auditoria."""
+    # Garantir que o campo audited é um booleano
+    setup['audited'] = parse_audited(setup.get('audited', False))
+    
+    # Garantir que selected_items é uma lista
+    if 'selected_items' not in setup or setup['selected_items'] is None:
+        setup['selected_items'] = []
+    elif isinstance(setup.get('selected_items'), str):
+        try:
+            setup['selected_items'] = json.loads(setup['selected_items'])
+        except json.JSONDecodeError:
+            setup['selected_items'] = []
+    return setup
+
+def setup_filters_from_request():
+    """Lê os filtros da listagem de setups da query string.
     
-    if user_profile != 'auditor':
-        flash('Acesso restrito. Apenas auditores podem acessar esta página.', 'danger')
-        return redirect(url_for('index'))
+    Parâmetros: date_start, date_end (AAAA-MM-DD), cell, order, supplier,
+    auditor, match ('contains', padrão, ou 'prefix' para buscar os textos
+    pelo início) e audited ('sim'/'nao').
     
-    # Obter parâmetros de filtro
-    filter_date_start = request.args.get('filter_date_start', '')
-    filter_date_end = request.args.get('filter_date_end', '')
-    filter_auditor = request.args.get('filter_auditor', '')
-    filter_audited = request.args.get('filter_audited', '')
-    filter_order = request.args.get('filter_order', '')
-    filter_cell = request.args.get('filter_cell', '')
-    filter_supplier = request.args.get('filter_supplier', '')
-    
-    # Obter todos os setups
-    cells = get_all_setups()
-    
-    # Aplicar filtros, mas manter a estrutura original para o template
-    if any([filter_date_start, filter_date_end, filter_auditor, filter_audited, filter_order, filter_cell, filter_supplier]):
-        filtered_cells = {}
-        
-        for cell_name, setups in cells.items():
-            # Filtrar por nome da célula
-            if filter_cell and filter_cell.lower() not in cell_name.lower():
-                continue
-                
-            filtered_setups = []
-            for setup in setups:
-                # Filtrar por período de datas
-                setup_date = setup.get('timestamp', '').split(' ')[0]  # Extrair apenas a parte da data (YYYY-MM-DD)
-                
-                # Se data inicial está especificada e a data do setup é anterior
-                if filter_date_start and setup_date < filter_date_start:
-                    continue
-                    
-                # Se data final está especificada e a data do setup é posterior
-                if filter_date_end and setup_date > filter_date_end:
-                    continue
-                    
-                # Filtrar por auditor
-                if filter_auditor and filter_auditor.lower() not in setup.get('auditor_name', '').lower():
-                    continue
-                    
-                # Filtrar por abastecedor (novo)
-                if filter_supplier and filter_supplier.lower() not in setup.get('supplier_name', '').lower():
-                    continue
-                    
-                # Filtrar por status de auditoria
-                if filter_audited:
-                    is_audited = setup.get('audited', False)
-                    if (filter_audited == 'sim' and not is_audited) or (filter_audited == 'nao' and is_audited):
-                        continue
-                
-                # Filtrar por ordem de produção
-                if filter_order and filter_order.lower() not in setup.get('order_number', '').lower():
-                    continue
-                    
-                filtered_setups.append(setup)
-                
-            if filtered_setups:
-                filtered_cells[cell_name] = filtered_setups
-                
-        cells = filtered_cells
-    
-    # Garantir que todos os dados estão no formato correto
-    for cell_name, setups in cells.items():
-        for setup in setups:
-            # Garantir que o campo audited é um booleano
-            if isinstance(setup.get('audited'), str):
-                setup['audited'] = setup['audited'].lower() in ['true', 'yes', '1', 'on']
-            setup['audited'] = bool(setup.get('audited', False))
-            
-            # Garantir que selected_items é uma lista
-            if 'selected_items' not in setup or setup['selected_items'] is None:
-                setup['selected_items'] = []
-            elif isinstance(setup.get('selected_items'), str):
-                try:
-                    setup['selected_items'] = json.loads(setup['selected_items'])
-                except:
-                    setup['selected_items'] = []
+    Raises:
+        ValueError: Se algum parâmetro for inválido
+    """
+    audited = request.args.get('audited', '').lower()
+    filters = {
+        'date_start': request.args.get('date_start', '').strip(),
+        'date_end': request.args.get('date_end', '').strip(),
+        'cell': request.args.get('cell', '').strip(),
+        'order': request.args.get('order', '').strip(),
+        'supplier': request.args.get('supplier', '').strip(),
+        'auditor': request.args.get('auditor', '').strip(),
+        'audited': True if audited in ['sim', 'true', '1'] else False if audited in ['nao', 'false', '0'] else None,
+        'match': request.args.get('match', MATCH_CONTAINS).lower(),
+    }
+    if filters['match'] not in (MATCH_CONTAINS, MATCH_PREFIX):
+        raise ValueError("Parâmetro match inválido")
+    return filters
+
+def date_range_from_request():
+    """Lê o período (date_start e date_end, AAAA-MM-DD) da query string.
+    
+    Returns:
+        tuple: (date_start, date_end), com None para uma data não informada
+    
+    Raises:
+        ValueError: Se alguma data estiver em outro formato
+    """
+    date_start = request.args.get('date_start', '').strip() or None
+    date_end = request.args.get('date_end', '').strip() or None
+    for value in (date_start, date_end):
+        if value:
+            try:
+                datetime.datetime.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                raise ValueError("Datas devem estar no formato AAAA-MM-DD")
+    return date_start, date_end
+
+@app.route('/api/setups')
+@role_required('auditor')
+def api_list_setups():
+    """API endpoint para listar setups com filtros e paginação por cursor.
+    
+    Parâmetros (query string): os filtros de setup_filters_from_request, sort
+    ('desc' ou 'asc', pela data/hora), limit e cursor (next_cursor da página
+    anterior). Cada setup vem resumido (ver journal.SetupDocument.listing); o
+    registro completo é obtido em /api/setup/<setup_id>.
+    """
+    try:
+        filters = setup_filters_from_request()
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
     
-    # Adicionar logs para depuração dos contadores
-    total_geral = 0
-    auditados_geral = 0
-    for cell_name, setups in cells.items():
-        total_geral += len(setups)
-        auditados_geral += sum(1 for setup in setups if setup.get('audited', False))
+    try:
+        limit = min(max(int(request.args.get('limit', SETUPS_PAGE_SIZE)), 1), SETUPS_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"success": False, "message": "Parâmetro limit inválido"}), 400
     
-    logging.debug(f"Contadores gerais - Total: {total_geral}, Auditados: {auditados_geral}")
+    try:
+        page = setup_indexes.query_setups(
+            filters,
+            cursor=request.args.get('cursor') or None,
+            limit=limit,
+            descending=request.args.get('sort', 'desc').lower() != 'asc'
+        )
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
     
-    return render_template('audit.html', cells=cells)
+    page['success'] = True
+    return jsonify(page)
 
-@app.route('/register_qrcode', methods=['GET', 'POST'])
-def register_qrcode():
-    """Handle QR code registration."""
-    if not session.get('logged_in'):
-        return redirect(url_for('login', next=request.path))
+def setup_image_urls(cell_name, setup_data):
+    """URLs das fotos de um setup (rota /photos), na ordem dos arquivos."""
+    return [
+        url_for('get_photo', cell_name=cell_name, filepath=path)
+        for path in sorted(image['path'] for image in setup_data.get('images', []) if image.get('path'))
+    ]
+
+@app.route('/api/setup/<setup_id>')
+@role_required('auditor')
+def api_setup_details(setup_id):
+    """API endpoint com o registro completo de um setup (detalhes da auditoria).
     
-    # Verificar se o usuário tem permissão (apenas auditores)
-    username = session.get('username')
-    users = get_users()
-    user_profile = users.get(username, {}).get('profile', 'supplier')
+    Args:
+        setup_id: ID do setup (campo setup_id da listagem)
+        
+    Returns:
+        JSON com o setup (incluindo observação, itens, anotações e as URLs das fotos)
+    """
+    cell_name, setup_data = find_setup_by_id(setup_id)
+    if setup_data is None:
+        return jsonify({"success": False, "message": "Setup não encontrado"}), 404
+    
+    setup_data = prepare_setup_for_listing(setup_data)
+    setup_data['cell_name'] = cell_name
+    setup_data['image_urls'] = setup_image_urls(cell_name, setup_data)
+    return jsonify({"success": True, "setup": setup_data})
+
+@app.route('/api/setup/<setup_id>/images')
+def api_setup_images(setup_id):
+    """API para obter as imagens de um setup pelo ID (sem busca pela ordem/tipo).
     
-    if user_profile != 'auditor':
-        flash('Acesso restrito. Apenas auditores podem acessar esta página.', 'danger')
-        return redirect(url_for('index'))
+    Returns:
+        JSON com a lista de URLs das imagens do setup
+    """
+    cell_name, setup_data = find_setup_by_id(setup_id)
+    if setup_data is None:
+        return jsonify({"success": False, "images": [], "message": "Setup não encontrado"}), 404
+    images = setup_image_urls(cell_name, setup_data)
+    return jsonify({"success": bool(images), "images": images})
+
+@app.route('/api/photo_jobs')
+@role_required('auditor')
+def api_photo_jobs():
+    """API com a quantidade de tarefas da fila de fotos por status (ver photo_queue.py)."""
+    return jsonify({"success": True, "counts": photo_queue.counts()})
+
+@app.route('/api/photo_jobs/<job_id>')
+@login_required
+def api_photo_job(job_id):
+    """API com a situação do processamento das fotos de um setup.
+
+    Args:
+        job_id: ID da tarefa (campo photo_job do registro do setup)
+
+    Returns:
+        JSON com o status da tarefa (pending, running, done ou failed), as
+        tentativas feitas e o último erro
+    """
+    job = photo_queue.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Tarefa não encontrada"}), 404
+    return jsonify({"success": True, "job": {
+        key: job[key] for key in (
+            "id", "setup_id", "cell_name", "file_identifier", "status", "attempts", "last_error",
+            "created_at", "updated_at",
+        )
+    }})
+
+@app.route('/api/uploads', methods=['POST'])
+@login_required
+def api_create_upload():
+    """API que abre o envio de uma foto em partes (ver uploads.py).
+
+    Corpo JSON: {"size": tamanho da foto em bytes, "filename": nome (opcional)}
+
+    Returns:
+        JSON com o token do envio, o tamanho sugerido das partes e os bytes já recebidos
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        upload = upload_staging.create(session.get('username'), data.get('size'), data.get('filename', ''))
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    return jsonify({"success": True, "upload": upload}), 201
+
+@app.route('/api/uploads/<token>', methods=['GET'])
+@login_required
+def api_upload_status(token):
+    """API com os bytes já recebidos de um envio (para retomar de onde parou)."""
+    try:
+        upload = upload_staging.status(token, session.get('username'))
+    except UploadNotFound:
+        return jsonify({"success": False, "message": "Envio não encontrado"}), 404
+    return jsonify({"success": True, "upload": upload})
+
+@app.route('/api/uploads/<token>', methods=['PATCH'])
+@login_required
+def api_upload_chunk(token):
+    """API que recebe uma parte da foto.
+
+    O corpo da requisição são os bytes da parte, e o cabeçalho Upload-Offset
+    indica o byte em que ela começa. Se não for o total já recebido, a
+    resposta é 409 com o offset de onde continuar.
+    """
+    offset = request.headers.get('Upload-Offset', type=int)
+    if offset is None or request.content_length is None:
+        return jsonify({"success": False, "message": "Cabeçalhos Upload-Offset e Content-Length obrigatórios"}), 400
+    try:
+        upload = upload_staging.append(token, session.get('username'), offset, request.stream, request.content_length)
+    except UploadNotFound:
+        return jsonify({"success": False, "message": "Envio não encontrado"}), 404
+    except UploadOffsetMismatch as e:
+        return jsonify({"success": False, "message": str(e), "offset": e.offset}), 409
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    return jsonify({"success": True, "upload": upload})
+
+@app.route('/api/uploads/<token>', methods=['DELETE'])
+@login_required
+def api_delete_upload(token):
+    """API que cancela um envio (foto removida antes do registro do setup)."""
+    try:
+        upload_staging.status(token, session.get('username'))
+    except UploadNotFound:
+        return jsonify({"success": False, "message": "Envio não encontrado"}), 404
+    upload_staging.discard(token)
+    return jsonify({"success": True})
+
+# Valores exibidos por faceta (padrão e máximo)
+FACET_SIZE = 10
+FACET_MAX_SIZE = 200
+
+@app.route('/api/facets')
+@role_required('auditor')
+def api_setup_facets():
+    """API endpoint com as contagens por célula, abastecedor, auditor, tipo de
+    setup e status de auditoria dos setups que atendem aos filtros (ver facets.py).
+    
+    Parâmetros (query string): os filtros de setup_filters_from_request e size
+    (valores exibidos por faceta).
+    """
+    try:
+        filters = setup_filters_from_request()
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    
+    try:
+        size = min(max(int(request.args.get('size', FACET_SIZE)), 1), FACET_MAX_SIZE)
+    except ValueError:
+        return jsonify({"success": False, "message": "Parâmetro size inválido"}), 400
+    
+    result = facet_counts(setup_indexes, filters, size)
+    result['success'] = True
+    return jsonify(result)
+
+@app.route('/api/stats')
+@role_required('auditor')
+def api_setup_stats():
+    """API endpoint com as estatísticas da auditoria (ver stats.py).
+    
+    Parâmetros (query string): date_start, date_end (AAAA-MM-DD) e cell
+    (trecho do nome da célula). Devolve os totais do período, o backlog por
+    célula e os acumulados de cada dia.
+    """
+    try:
+        date_start, date_end = date_range_from_request()
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
     
+    result = setup_stats(setup_indexes, date_start, date_end, request.args.get('cell', '').strip() or None)
+    result['success'] = True
+    return jsonify(result)
+
+@app.route('/api/changeovers')
+@role_required('auditor')
+def api_changeover_stats():
+    """API endpoint com os tempos de troca retirada -> abastecimento (ver changeovers.py).
+    
+    Parâmetros (query string): group_by ('cell', 'shift' ou 'week'),
+    date_start, date_end (AAAA-MM-DD, pela semana da retirada), cell (trecho
+    do nome da célula) e shift (turno, ex.: "06:00-14:00"). Devolve a
+    quantidade, a média e os percentis (em minutos) de cada grupo.
+    """
+    group_by = request.args.get('group_by', 'cell').lower()
+    if group_by not in CHANGEOVER_GROUP_BY:
+        return jsonify({"success": False, "message": "Parâmetro group_by inválido"}), 400
+    
+    try:
+        date_start, date_end = date_range_from_request()
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    
+    result = changeover_stats(
+        setup_indexes, group_by, date_start, date_end,
+        cell=request.args.get('cell', '').strip() or None,
+        shift=request.args.get('shift', '').strip() or None
+    )
+    result['success'] = True
+    return jsonify(result)
+
+# Tamanho padrão e máximo das páginas da busca por texto
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+
+@app.route('/api/search')
+@role_required('auditor')
+def api_search_setups():
+    """API endpoint para buscar setups por texto livre (ver search.py).
+    
+    Parâmetros (query string): q (texto da busca, em observação, notas da
+    auditoria, produto e itens), os filtros de setup_filters_from_request,
+    limit e offset. Os resultados vêm ordenados por relevância.
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"success": False, "message": "Informe o texto da busca (parâmetro q)"}), 400
+    
+    try:
+        filters = setup_filters_from_request()
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    
+    try:
+        limit = min(max(int(request.args.get('limit', SEARCH_PAGE_SIZE)), 1), SEARCH_MAX_PAGE_SIZE)
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError:
+        return jsonify({"success": False, "message": "Parâmetros limit/offset inválidos"}), 400
+    
+    result = search_setups(setup_indexes, query, filters, limit=limit, offset=offset)
+    result['success'] = True
+    result['next_offset'] = offset + limit if offset + limit < result['total'] else None
+    return jsonify(result)
+
+@app.route('/register_qrcode', methods=['GET', 'POST'])
+@role_required('auditor')
+def register_qrcode():
+    """Handle QR code registration."""
     # Obter lista de células para exibir na página
     cells = get_all_cells()
     
@@ -1565,19 +1800,9 @@ def register_qrcode():
     return render_template('register_qrcode.html', cells=cells)
 
 @app.route('/edit_qrcode', methods=['POST'])
+@role_required('auditor', message="Acesso restrito", api=True)
 def edit_qrcode():
     """Handle QR code update."""
-    if not session.get('logged_in'):
-        return jsonify({"success": False, "message": "Unauthorized"}), 401
-    
-    # Verificar se o usuário tem permissão (apenas auditores)
-    username = session.get('username')
-    users = get_users()
-    user_profile = users.get(username, {}).get('profile', 'supplier')
-    
-    if user_profile != 'auditor':
-        return jsonify({"success": False, "message": "Acesso restrito"}), 403
-    
     qrcode_value = request.form.get('qrcode_value')
     new_cell_name = request.form.get('new_cell_name')
     
@@ -1590,19 +1815,9 @@ def edit_qrcode():
         return jsonify({"success": False, "message": "QR Code não encontrado"}), 404
 
 @app.route('/delete_qrcode', methods=['POST'])
+@role_required('auditor', message="Acesso restrito", api=True)
 def delete_qrcode_route():
     """Handle QR code deletion."""
-    if not session.get('logged_in'):
-        return jsonify({"success": False, "message": "Unauthorized"}), 401
-    
-    # Verificar se o usuário tem permissão (apenas auditores)
-    username = session.get('username')
-    users = get_users()
-    user_profile = users.get(username, {}).get('profile', 'supplier')
-    
-    if user_profile != 'auditor':
-        return jsonify({"success": False, "message": "Acesso restrito"}), 403
-    
     qrcode_value = request.form.get('qrcode_value')
     
     if not qrcode_value:
@@ -1629,74 +1844,48 @@ def api_get_cell_name(qrcode):
     # Se chegou aqui, temos um nome de célula válido
     logging.debug(f"API: QR code {qrcode} maps to cell: {cell_name}")
     
-    # Verificar status de setup para a célula
+    # Status materializado da célula (ordem mais recente e tipos já registrados),
+    # consultado em tempo constante a cada leitura de QR code
+    status = repository.cell_status(cell_name)
+    most_recent_order = status["most_recent_order"]
     setup_status = {
-        "removal": False,
-        "supply": False
+        "removal": status["removal"],
+        "supply": status["supply"]
     }
     
-    # Obter último número de ordem usado na célula (se houver)
-    most_recent_order = None
-    
-    # Verificar os arquivos na célula para determinar o status
-    cell_dir = os.path.join(DATA_DIR, cell_name)
-    
-    if os.path.isdir(cell_dir):
-        # Procurar o número de ordem mais recente
-        setup_files = []
-        for file in os.listdir(cell_dir):
-            if file.endswith(".txt") and not file.startswith("reset_log_"):
-                file_path = os.path.join(cell_dir, file)
-                try:
-                    with open(file_path, 'r') as f:
-                        setup_data = json.load(f)
-                    
-                    # Extrair informações relevantes
-                    order_number = setup_data.get('order_number')
-                    setup_type = setup_data.get('setup_type')
-                    
-                    # Atualizar most_recent_order se necessário
-                    if order_number and (most_recent_order is None or order_number > most_recent_order):
-                        most_recent_order = order_number
-                    
-                    # Adicionar à lista para análise posterior
-                    setup_files.append({
-                        'order_number': order_number,
-                        'setup_type': setup_type
-                    })
-                    
-                except Exception as e:
-                    logging.error(f"Erro ao ler arquivo de setup {file_path}: {e}")
-        
-        # Filtrar apenas os arquivos da ordem mais recente, se houver
-        if most_recent_order and setup_files:
-            latest_order_files = [f for f in setup_files if f['order_number'] == most_recent_order]
-            
-            # Verificar status de setup para a ordem mais recente
-            for file_info in latest_order_files:
-                setup_type = file_info.get('setup_type')
-                if setup_type == 'removal':
-                    setup_status['removal'] = True
-                elif setup_type == 'supply':
-                    setup_status['supply'] = True
-    
     # Retornar informações completas sobre a célula
     return jsonify({
         "success": True,
         "cell_name": cell_name,
         "setup_status": setup_status,
         "most_recent_order": most_recent_order,
+        "last_setup": {
+            "removal": status["last_removal"],
+            "supply": status["last_supply"]
+        },
+        "last_reset": status["last_reset"],
         "message": "Lembre-se: Qualquer tipo de operação é permitido a qualquer momento."
     })
 
 @app.route('/api/update_setup', methods=['POST'])
+@login_required
 def api_update_setup():
-    """API endpoint to update setup data."""
-    if not session.get('logged_in'):
-        return jsonify({"success": False, "message": "Unauthorized"}), 401
-    
-    data = request.json
-    logging.debug(f"API update_setup: dados recebidos = {json.dumps(data)}")
+    """API endpoint to update setup data.
+
+    Aceita JSON (foto em base64 no campo photo_data) ou multipart/form-data
+    (foto como arquivo no campo photos).
+    """
+    if request.is_json:
+        data = request.json
+        logging.debug(f"API update_setup: dados recebidos = {json.dumps(data)}")
+    else:
+        data = request.form.to_dict()
+        logging.debug(f"API update_setup: dados recebidos = {json.dumps(data)}")
+        if 'audited' in data:
+            data['audited'] = parse_audited(data['audited'])
+        photo_file = request.files.get('photos')
+        if photo_file:
+            data['photo_data'] = photo_file
     
     # Verificar explicitamente o campo observation
     observation = data.get('observation', '')
@@ -1712,7 +1901,8 @@ def api_update_setup():
         data.get('auditor_name'),
         data.get('setup_type'),
         data.get('photo_data'),
-        data.get('timestamp')
+        data.get('timestamp'),
+        setup_id=data.get('setup_id')
     )
     
     if success:
@@ -1720,11 +1910,9 @@ def api_update_setup():
     return jsonify({"success": False, "message": "Erro ao atualizar setup"}), 500
 
 @app.route('/api/mark_as_audited', methods=['POST'])
+@role_required('auditor', message="Somente auditores podem alterar o status de auditoria")
 def api_mark_as_audited():
     """API endpoint to mark or unmark a setup as audited."""
-    if not session.get('logged_in'):
-        return jsonify({"success": False, "message": "Unauthorized"}), 401
-    
     # Aceitar dados tanto via JSON quanto via FormData
     if request.is_json:
         data = request.json
@@ -1741,34 +1929,20 @@ def api_mark_as_audited():
     is_mark_action = audited not in ['false', 'False', False, '0', 0]
     audit_notes = data.get('audit_notes', '')
     
-    # Verificar se o usuário tem perfil de auditor
-    users = get_users()
-    user_profile = users.get(auditor_name, {}).get('profile', 'supplier')
-    
-    if user_profile != 'auditor':
-        return jsonify({"success": False, "message": "Somente auditores podem alterar o status de auditoria"}), 403
-    
     # Buscar os dados existentes antes de qualquer atualização
     cell_name = data.get('cell_name')
     order_number = data.get('order_number')
     setup_type = data.get('setup_type')
-    
-    # Diretório da célula e padrão de arquivo
-    cell_dir = os.path.join(DATA_DIR, cell_name)
-    prefix = f"{order_number}_{setup_type}"
-    
-    # Encontrar o arquivo correspondente
-    text_file_path = None
-    existing_data = {}
-    for file in os.listdir(cell_dir):
-        if file.endswith(".txt") and file.startswith(prefix):
-            text_file_path = os.path.join(cell_dir, file)
-            try:
-                with open(text_file_path, 'r') as f:
-                    existing_data = json.load(f)
-                break
-            except Exception as e:
-                logging.error(f"Erro ao ler arquivo existente: {e}")
+    setup_id = data.get('setup_id') or None
+    
+    # Encontrar o registro correspondente (pelo ID ou, no formato antigo, pela ordem/tipo)
+    if setup_id:
+        cell_name, existing_data = find_setup_by_id(setup_id)
+        if existing_data is None:
+            return jsonify({"success": False, "message": "Setup não encontrado"}), 404
+        order_number, setup_type = existing_data.get('order_number'), existing_data.get('setup_type')
+    else:
+        existing_data = repository.find_latest_setup(cell_name, order_number, setup_type) or {}
     
     # Se não encontrou ou não conseguiu ler os dados existentes, usar valores padrão
     supplier_name = existing_data.get('supplier_name', data.get('supplier_name', ''))
@@ -1788,7 +1962,8 @@ def api_mark_as_audited():
             setup_type,
             None,   # Sem mudança na foto
             None,   # Sem mudança no timestamp
-            ''      # Limpar anotações de auditoria
+            '',     # Limpar anotações de auditoria
+            setup_id=setup_id
         )
         if success:
             return jsonify({"success": True, "audited": False, "auditor_name": "", "audit_notes": ""})
@@ -1805,7 +1980,8 @@ def api_mark_as_audited():
             setup_type,
             None,  # Sem mudança na foto
             None,  # Sem mudança no timestamp
-            audit_notes  # Incluir anotações de auditoria
+            audit_notes,  # Incluir anotações de auditoria
+            setup_id=setup_id
         )
         if success:
             return jsonify({
@@ -1827,8 +2003,6 @@ def log_deletion(cell_name, order_number, setup_type, username, setup_data=None)
         username: Nome do usuário que fez a exclusão
         setup_data: Dados do setup que foi excluído (opcional)
     """
-    deletion_log_file = os.path.join(DATA_DIR, "deletion_history.json")
-    
     # Criar a estrutura do log
     timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     log_entry = {
@@ -1840,103 +2014,44 @@ def log_deletion(cell_name, order_number, setup_type, username, setup_data=None)
         "setup_data": setup_data
     }
     
-    # Carregar histórico existente ou criar novo
-    if os.path.exists(deletion_log_file):
-        try:
-            with open(deletion_log_file, 'r') as f:
-                try:
-                    history = json.load(f)
-                except json.JSONDecodeError:
-                    history = []
-        except Exception as e:
-            logging.error(f"Erro ao ler arquivo de histórico de exclusões: {e}")
-            history = []
-    else:
-        history = []
-    
-    # Adicionar nova entrada e salvar
-    history.append(log_entry)
-    
     try:
-        with open(deletion_log_file, 'w') as f:
-            json.dump(history, f, indent=2)
+        repository.log_deletion(log_entry)
         logging.info(f"Log de exclusão registrado para {cell_name}/{order_number}_{setup_type}")
     except Exception as e:
         logging.error(f"Erro ao salvar histórico de exclusões: {e}")
 
-def delete_setup(cell_name, order_number, setup_type, username=None):
-    """Delete a setup entry and its related image."""
-    cell_dir = os.path.join(DATA_DIR, cell_name)
+def delete_setup(cell_name, order_number, setup_type, username=None, setup_id=None):
+    """Delete a setup entry and its related image.
     
-    if not os.path.isdir(cell_dir):
-        return False
-    
-    # Procurar por arquivos que correspondam ao padrão
-    prefix = f"{order_number}_{setup_type}"
-    success = False
-    files_to_delete = []
+    Com setup_id, exclui só esse setup; caso contrário, todos os registros da
+    ordem/tipo na célula (formato antigo).
+    """
+    if setup_id:
+        location = setup_indexes.locate(setup_id) if is_setup_id(setup_id) else None
+        if location is None:
+            logging.error(f"Nenhum registro encontrado para exclusão com o ID {setup_id}")
+            return False
+        return repository.delete_setup(*location)
     
-    # Carregar dados do setup para o histórico antes de excluir
-    setup_data = None
-    for file in os.listdir(cell_dir):
-        if file.startswith(prefix) and file.endswith(".txt"):
-            try:
-                with open(os.path.join(cell_dir, file), 'r') as f:
-                    setup_data = json.load(f)
-                break
-            except Exception as e:
-                logging.error(f"Erro ao ler dados do setup para histórico: {e}")
+    setups = repository.find_setups(cell_name, order_number, setup_type)
     
-    # Encontrar todos os arquivos TXT e JPG relacionados
-    for file in os.listdir(cell_dir):
-        # Encontrar arquivos de texto com o padrão correto
-        if file.startswith(prefix) and file.endswith(".txt"):
-            files_to_delete.append(os.path.join(cell_dir, file))
-            
-            # Verificar se existe um diretório de imagens com o mesmo nome (sem a extensão)
-            base_name = file[:-4]  # Remover .txt
-            img_dir = os.path.join(cell_dir, base_name)
-            if os.path.isdir(img_dir):
-                for img_file in os.listdir(img_dir):
-                    if img_file.endswith(('.jpg', '.jpeg', '.png')):
-                        files_to_delete.append(os.path.join(img_dir, img_file))
-            
-            # Para compatibilidade, verificar também o arquivo de imagem direto
-            img_file = f"{base_name}.jpg"
-            img_path = os.path.join(cell_dir, img_file)
-            if os.path.exists(img_path):
-                files_to_delete.append(img_path)
-    
-    if not files_to_delete:
-        logging.error(f"Nenhum arquivo encontrado para exclusão: {prefix}")
+    if not setups:
+        logging.error(f"Nenhum registro encontrado para exclusão: {order_number}_{setup_type}")
         return False
     
-    # Excluir todos os arquivos encontrados
-    for file_path in files_to_delete:
-        try:
-            if os.path.isdir(file_path):
-                shutil.rmtree(file_path)
-            else:
-                os.remove(file_path)
+    # Excluir todos os registros da ordem/tipo e suas imagens
+    success = False
+    for setup in setups:
+        if repository.delete_setup(cell_name, setup["file_identifier"]):
             success = True
-        except Exception as e:
-            logging.error(f"Erro ao excluir arquivo: {file_path}, erro: {e}")
     
     return success
 
 @app.route('/api/delete_setup', methods=['POST'])
+@role_required('auditor', message="Somente auditores podem excluir registros")
 def api_delete_setup():
     """API endpoint to delete a setup entry."""
-    if not session.get('logged_in'):
-        return jsonify({"success": False, "message": "Unauthorized"}), 401
-    
-    # Verificar se o usuário tem perfil de auditor
     username = session.get('username')
-    users = get_users()
-    user_profile = users.get(username, {}).get('profile', 'supplier')
-    
-    if user_profile != 'auditor':
-        return jsonify({"success": False, "message": "Somente auditores podem excluir registros"}), 403
     
     # Aceitar dados tanto via JSON quanto via FormData
     if request.is_json:
@@ -1950,27 +2065,21 @@ def api_delete_setup():
     cell_name = data.get('cell_name')
     order_number = data.get('order_number')
     setup_type = data.get('setup_type')
-    
-    if not all([cell_name, order_number, setup_type]):
-        return jsonify({"success": False, "message": "Dados incompletos para exclusão"}), 400
+    setup_id = data.get('setup_id') or None
     
     # Buscar os dados do setup antes de excluir para o histórico
-    cell_dir = os.path.join(DATA_DIR, cell_name)
-    prefix = f"{order_number}_{setup_type}"
-    setup_data = None
-    
-    if os.path.isdir(cell_dir):
-        for file in os.listdir(cell_dir):
-            if file.startswith(prefix) and file.endswith(".txt"):
-                try:
-                    with open(os.path.join(cell_dir, file), 'r') as f:
-                        setup_data = json.load(f)
-                    break
-                except Exception as e:
-                    logging.error(f"Erro ao ler dados do setup para histórico: {e}")
+    if setup_id:
+        cell_name, setup_data = find_setup_by_id(setup_id)
+        if setup_data is None:
+            return jsonify({"success": False, "message": "Setup não encontrado"}), 404
+        order_number, setup_type = setup_data.get('order_number'), setup_data.get('setup_type')
+    elif not all([cell_name, order_number, setup_type]):
+        return jsonify({"success": False, "message": "Dados incompletos para exclusão"}), 400
+    else:
+        setup_data = repository.find_latest_setup(cell_name, order_number, setup_type)
     
     # Executar a exclusão
-    success = delete_setup(cell_name, order_number, setup_type)
+    success = delete_setup(cell_name, order_number, setup_type, setup_id=setup_id)
     
     if success:
         # Registrar no histórico de exclusões
@@ -2011,74 +2120,14 @@ def get_setup_images(cell_name, order_number, setup_type):
     """
     try:
         logging.debug(f"Buscando imagens para cell={cell_name}, order={order_number}, type={setup_type}")
-        cell_dir = os.path.join(DATA_DIR, cell_name)
+        paths = repository.get_setup_images(cell_name, order_number, setup_type)
         
-        if not os.path.isdir(cell_dir):
-            logging.error(f"Diretório da célula não existe: {cell_dir}")
-            return jsonify({"success": False, "images": [], "error": "Diretório da célula não encontrado"})
-        
-        # Lista de possíveis diretórios/arquivos para verificar
-        # Primeiro tentamos encontrar um diretório com o nome completo do setup (formato novo)
-        # Se não encontrarmos, buscamos arquivos diretos (formato antigo)
-        
-        # Listar todos os arquivos no diretório da célula
-        all_files = os.listdir(cell_dir)
-        logging.debug(f"Arquivos encontrados na célula: {all_files}")
-        
-        # As imagens agora usam o timestamp como parte do nome do diretório
-        # Vamos procurar diretórios que tenham ordem e tipo no nome
-        matching_dirs = []
-        for item in all_files:
-            # Verificar se o item tem o padrão {order_number}_{setup_type}
-            item_path = os.path.join(cell_dir, item)
-            if os.path.isdir(item_path) and f"{order_number}_{setup_type}" in item:
-                matching_dirs.append(item)
-        
-        logging.debug(f"Diretórios correspondentes encontrados: {matching_dirs}")
-        
-        # Se encontramos diretórios correspondentes, buscamos imagens dentro deles
-        if matching_dirs:
-            for dir_name in matching_dirs:
-                dir_path = os.path.join(cell_dir, dir_name)
-                images = []
-                
-                if os.path.isdir(dir_path):
-                    # Listar todos os arquivos no diretório
-                    dir_files = os.listdir(dir_path)
-                    logging.debug(f"Arquivos no diretório {dir_name}: {dir_files}")
-                    
-                    for filename in dir_files:
-                        if filename.lower().endswith(('.jpg', '.jpeg', '.png', '.gif')):
-                            # Criar URL completa para a imagem
-                            image_url = url_for('get_photo', cell_name=cell_name, filepath=f"{dir_name}/{filename}")
-                            images.append(image_url)
-                    
-                    # Se encontramos imagens, retornamos
-                    if images:
-                        # Ordenar imagens pelo nome (normalmente image_1.jpg, image_2.jpg, etc)
-                        images.sort()
-                        logging.debug(f"Imagens encontradas: {images}")
-                        return jsonify({
-                            "success": True,
-                            "images": images
-                        })
-        
-        # Se não encontramos em diretórios dedicados, procuramos por arquivos diretos
-        # com o mesmo padrão de nome
-        direct_images = []
-        for file in all_files:
-            file_path = os.path.join(cell_dir, file)
-            # Verificar se é um arquivo de imagem e se contém o nome da ordem
-            if os.path.isfile(file_path) and file.lower().endswith(('.jpg', '.jpeg', '.png', '.gif')):
-                if order_number in file:
-                    image_url = url_for('get_photo', cell_name=cell_name, filepath=file)
-                    direct_images.append(image_url)
-        
-        if direct_images:
-            logging.debug(f"Imagens diretas encontradas: {direct_images}")
+        if paths:
+            images = [url_for('get_photo', cell_name=cell_name, filepath=path) for path in paths]
+            logging.debug(f"Imagens encontradas: {images}")
             return jsonify({
                 "success": True,
-                "images": direct_images
+                "images": images
             })
         
         # Se não encontramos imagens em nenhum lugar
@@ -2165,26 +2214,19 @@ def reset_cell_flow(cell_name, reason):
         with open(history_file, 'w') as f:
             json.dump(history, f)
         
+        # Atualizar o status materializado da célula (usado na leitura do QR code)
+        repository.record_cell_reset(cell_name, reset_data["reset_timestamp"])
+        
         return True, "Evento registrado com sucesso (não há mais restrições de fluxo)"
     except Exception as e:
         logging.error(f"Erro ao registrar evento para célula: {e}")
         return False, f"Erro ao registrar evento: {str(e)}"
         
 @app.route("/api/reset_cell", methods=["POST"])
+@role_required('auditor', message="Somente auditores podem resetar o fluxo da célula")
 def api_reset_cell():
     """API endpoint to reset the flow of a cell."""
     # Verificar se o usuário está logado
-    if not session.get('logged_in'):
-        return jsonify({"success": False, "message": "Unauthorized"}), 401
-    
-    # Verificar se o usuário tem perfil de auditor
-    username = session.get('username')
-    users = get_users()
-    user_profile = users.get(username, {}).get('profile', 'supplier')
-    
-    if user_profile != 'auditor':
-        return jsonify({"success": False, "message": "Somente auditores podem resetar o fluxo da célula"}), 403
-    
     # Aceitar dados tanto via JSON quanto via FormData
     if request.is_json:
         data = request.json
@@ -2213,25 +2255,14 @@ def camera_test():
     return render_template('camera_test.html')
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    create_app().run(host='0.0.0.0', port=5000, debug=True)
 
 
 # Rota para a página de gerenciamento de produtos
 @app.route('/product_management')
+@role_required('auditor')
 def product_management():
     """Página de gerenciamento de produtos e itens para as células."""
-    if not session.get('logged_in'):
-        return redirect(url_for('login', next=request.path))
-    
-    # Verificar se o usuário tem permissão (apenas auditores)
-    username = session.get('username')
-    users = get_users()
-    user_profile = users.get(username, {}).get('profile', 'supplier')
-    
-    if user_profile != 'auditor':
-        flash('Acesso restrito. Apenas auditores podem acessar esta página.', 'danger')
-        return redirect(url_for('index'))
-    
     # Obter todas as células cadastradas
     cells = get_all_cells()
     
@@ -2239,19 +2270,9 @@ def product_management():
 
 # API para adicionar produto a uma célula
 @app.route('/api/add_product', methods=['POST'])
+@role_required('auditor')
 def api_add_product():
     """API para adicionar um produto a uma célula."""
-    if not session.get('logged_in'):
-        return jsonify({"success": False, "message": "Unauthorized"}), 401
-    
-    # Verificar se o usuário tem permissão (apenas auditores)
-    username = session.get('username')
-    users = get_users()
-    user_profile = users.get(username, {}).get('profile', 'supplier')
-    
-    if user_profile != 'auditor':
-        return jsonify({"success": False, "message": "Acesso restrito."}), 403
-    
     # Obter dados da requisição
     data = request.json
     cell_name = data.get('cell_name')
@@ -2271,19 +2292,9 @@ def api_add_product():
 
 # API para adicionar item a um produto
 @app.route('/api/add_item', methods=['POST'])
+@role_required('auditor')
 def api_add_item():
     """API para adicionar um item a um produto."""
-    if not session.get('logged_in'):
-        return jsonify({"success": False, "message": "Unauthorized"}), 401
-    
-    # Verificar se o usuário tem permissão (apenas auditores)
-    username = session.get('username')
-    users = get_users()
-    user_profile = users.get(username, {}).get('profile', 'supplier')
-    
-    if user_profile != 'auditor':
-        return jsonify({"success": False, "message": "Acesso restrito."}), 403
-    
     # Obter dados da requisição
     data = request.json
     cell_name = data.get('cell_name')
@@ -2390,19 +2401,9 @@ def api_product_items(cell_name, product_code):
 
 # API para excluir um produto
 @app.route('/api/delete_product', methods=['POST'])
+@role_required('auditor')
 def api_delete_product():
     """API para excluir um produto."""
-    if not session.get('logged_in'):
-        return jsonify({"success": False, "message": "Unauthorized"}), 401
-    
-    # Verificar se o usuário tem permissão (apenas auditores)
-    username = session.get('username')
-    users = get_users()
-    user_profile = users.get(username, {}).get('profile', 'supplier')
-    
-    if user_profile != 'auditor':
-        return jsonify({"success": False, "message": "Acesso restrito."}), 403
-    
     # Obter dados da requisição
     data = request.json
     cell_name = data.get('cell_name')
@@ -2421,19 +2422,9 @@ def api_delete_product():
 
 # API para excluir um item
 @app.route('/api/delete_item', methods=['POST'])
+@role_required('auditor')
 def api_delete_item():
     """API para excluir um item de um produto."""
-    if not session.get('logged_in'):
-        return jsonify({"success": False, "message": "Unauthorized"}), 401
-    
-    # Verificar se o usuário tem permissão (apenas auditores)
-    username = session.get('username')
-    users = get_users()
-    user_profile = users.get(username, {}).get('profile', 'supplier')
-    
-    if user_profile != 'auditor':
-        return jsonify({"success": False, "message": "Acesso restrito."}), 403
-    
     # Obter dados da requisição
     data = request.json
     cell_name = data.get('cell_name')
@@ -2454,6 +2445,93 @@ def api_delete_item():
 # O registro de exclusões é armazenado no arquivo deletion_history.json
 # Não é necessária uma página dedicada para visualização
 
-# Chamar a função de atualização do formato de QR codes ao iniciar
-with app.app_context():
-    update_qrcodes_format()
+@app.cli.command('import-setups')
+@click.option('--workers', type=int, default=None, help='Processos de leitura (padrão: número de CPUs).')
+@click.option('--batch-size', type=int, default=500, show_default=True, help='Setups gravados por transação.')
+@click.option('--restart', is_flag=True, help='Ignorar o checkpoint e importar tudo novamente.')
+def import_setups_command(workers, batch_size, restart):
+    """Importa a árvore dados_setup para o backend configurado (segmentos, SQLite ou PostgreSQL)."""
+    from import_setups import import_tree
+    
+    create_app()
+    if repository.name == BACKEND_FILES:
+        raise click.ClickException(
+            "Defina SETUP_STORAGE_BACKEND=segments, sqlite ou postgres para escolher o destino da importação."
+        )
+    
+    import_tree(DATA_DIR, repository, workers=workers, batch_size=batch_size, restart=restart, echo=click.echo)
+
+@app.cli.command('rebuild-manifests')
+@click.option('--cell', 'cells', multiple=True, help='Célula a reconstruir (pode repetir; padrão: todas).')
+def rebuild_manifests_command(cells):
+    """Reconstrói os manifestos das células (backends de arquivos e de segmentos) a partir dos registros."""
+    create_app()
+    if repository.name not in (BACKEND_FILES, BACKEND_SEGMENTS):
+        raise click.ClickException(
+            "Os manifestos só existem nos backends de arquivos e de segmentos (SETUP_STORAGE_BACKEND=files ou segments)."
+        )
+    
+    counts = repository.rebuild_manifests(list(cells) or None)
+    for cell_name, count in sorted(counts.items()):
+        click.echo(f"Célula {cell_name}: {count} setups")
+    click.echo(f"Manifestos reconstruídos: {len(counts)} células, {sum(counts.values())} setups")
+
+@app.cli.command('compact-segments')
+@click.option('--cell', 'cells', multiple=True, help='Célula a compactar (pode repetir; padrão: todas).')
+def compact_segments_command(cells):
+    """Reescreve os segmentos das células só com os registros vigentes (backend de segmentos)."""
+    create_app()
+    if repository.name != BACKEND_SEGMENTS:
+        raise click.ClickException("Os segmentos só existem no backend de segmentos (SETUP_STORAGE_BACKEND=segments).")
+    
+    reclaimed = repository.compact_segments(list(cells) or None)
+    for cell_name, size in sorted(reclaimed.items()):
+        if size:
+            click.echo(f"Célula {cell_name}: {size / 1024:.1f} KB recuperados")
+    click.echo(f"Segmentos compactados: {len(reclaimed)} células, {sum(reclaimed.values()) / 1024:.1f} KB recuperados")
+
+@app.cli.command('gc-uploads')
+def gc_uploads_command():
+    """Apaga os envios de fotos não usados há mais de UPLOAD_TTL_HOURS (padrão 24 horas) e as tarefas de fotos antigas."""
+    create_app()
+    removed = upload_staging.collect()
+    click.echo(f"Envios expirados apagados: {removed}")
+    purged = photo_queue.purge()
+    click.echo(f"Tarefas de fotos concluídas ou com falha há mais de PHOTO_JOB_TTL_HOURS apagadas: {purged}")
+
+@app.cli.command('recover-photos')
+def recover_photos_command():
+    """Devolve à fila (ou marca como falha) as fotos de setups em processamento sem tarefa na fila."""
+    create_app()
+    requeued, failed = recover_photo_jobs(echo=click.echo)
+    click.echo(f"Setups com as fotos de volta na fila: {requeued}; marcados como falha: {failed}")
+
+@app.cli.command('requeue-photos')
+def requeue_photos_command():
+    """Devolve à fila as tarefas de fotos com falha cujas fotos ainda estão na área de espera."""
+    create_app()
+    requeued = requeue_failed_photos(echo=click.echo)
+    click.echo(f"Tarefas de fotos de volta na fila: {requeued}")
+
+@app.cli.command('rebuild-indexes')
+def rebuild_indexes_command():
+    """Reconstrói o diário dos índices, contagens e estatísticas da auditoria a partir dos setups gravados."""
+    create_app()
+    if not repository.indexes_setups:
+        raise click.ClickException("O backend configurado consulta os filtros direto no banco; não há índices a reconstruir.")
+    
+    count = setup_indexes.rebuild()
+    click.echo(f"Índices reconstruídos: {count} setups")
+
+@app.cli.command('bootstrap')
+@click.option('--admin-password', envvar='ADMIN_PASSWORD', default='admin123', show_default=True,
+              help='Senha do usuário admin quando ele for criado (ou variável ADMIN_PASSWORD).')
+@click.option('--reset-admin', is_flag=True, help='Redefinir a senha do admin mesmo que ele já exista.')
+def bootstrap_command(admin_password, reset_admin):
+    """Cria os arquivos de dados e o usuário admin e migra o cadastro de QR codes.
+    
+    Executar uma vez na instalação (e após atualizações); pode ser repetido sem efeito.
+    """
+    create_app()
+    init_data_files(admin_password, reset_admin=reset_admin, echo=click.echo)
+    recover_photo_jobs(echo=click.echo)
@@ -0,0 +1,179 @@
+"""Diretório de usuários em cache e decorators de autenticação das rotas.
+
+Quase todas as rotas precisavam do perfil do usuário logado e, para isso,
+liam e convertiam o users.json inteiro a cada requisição. Agora:
+
+- UserDirectory mantém os usuários em memória e só recarrega quando a versão
+  do cadastro muda (users.json alterado por qualquer worker);
+- o perfil fica guardado na sessão assinada, junto com a versão do cadastro
+  em que foi lido, e só é consultado de novo se o cadastro mudar;
+- as rotas usam @login_required e @role_required('auditor') em vez de
+  repetir a verificação.
+"""
+import functools
+import threading
+
+from flask import current_app, flash, jsonify, redirect, request, session, url_for
+
+
+class UserDirectory:
+    """Cadastro de usuários em cache, invalidado pela versão do armazenamento."""
+
+    def __init__(self, repository):
+        self.repository = repository
+        self._lock = threading.Lock()
+        self._version = None
+        self._users = {}
+
+    @staticmethod
+    def _to_dict(users_list):
+        # Converter lista para dicionário para facilitar a manipulação
+        users_dict = {}
+        for user in users_list:
+            username = user.get('username')
+            if username:
+                users_dict[username] = {
+                    'password': user.get('password'),
+                    'last_updated': user.get('last_updated', ''),
+                    'profile': user.get('profile', 'auditor')  # Por padrão, usuários existentes serão auditores
+                }
+        return users_dict
+
+    def version(self):
+        """Versão atual do cadastro de usuários (texto, pode ir para a sessão)."""
+        return self.repository.users_version()
+
+    def users(self):
+        """Obtém o dicionário de usuários em cache (somente leitura)."""
+        version = self.version()
+        if version is None or version != self._version:
+            with self._lock:
+                if version is None or version != self._version:
+                    self._users = self._to_dict(self.repository.load_users_or_empty())
+                    self._version = version
+        return self._users
+
+    def get(self, username):
+        """Obtém os dados de um usuário, ou None."""
+        return self.users().get(username)
+
+    def save(self, users_dict):
+        """Grava o cadastro de usuários e atualiza o cache."""
+        users_list = []
+        for username, data in users_dict.items():
+            user_entry = {
+                'username': username,
+                'password': data.get('password'),
+                'profile': data.get('profile', 'auditor')
+            }
+            if 'last_updated' in data:
+                user_entry['last_updated'] = data['last_updated']
+            users_list.append(user_entry)
+
+        self.repository.save_users(users_list)
+        with self._lock:
+            self._users = self._to_dict(users_list)
+            self._version = self.version()
+
+    def set_password_hash(self, username, password_hash):
+        """Troca o hash da senha de um usuário (ex.: parâmetros do hash atualizados no login)."""
+        users = {name: dict(data) for name, data in self.users().items()}
+        if username not in users:
+            return False
+        users[username]['password'] = password_hash
+        self.save(users)
+        return True
+
+
+def get_directory():
+    """Diretório de usuários registrado na aplicação."""
+    return current_app.extensions['user_directory']
+
+
+def remember_user(username, user):
+    """Guarda o usuário autenticado e o seu perfil na sessão assinada."""
+    session['logged_in'] = True
+    session['username'] = username
+    session['profile'] = (user or {}).get('profile', 'supplier')
+    session['users_version'] = get_directory().version()
+
+
+def forget_user():
+    """Remove os dados do usuário da sessão."""
+    for key in ('logged_in', 'username', 'profile', 'users_version'):
+        session.pop(key, None)
+
+
+def current_profile(default='supplier'):
+    """Obtém o perfil do usuário logado.
+
+    Usa o perfil guardado na sessão enquanto o cadastro de usuários não
+    mudar; se mudou (perfil alterado, usuário excluído), lê de novo do
+    diretório em cache e atualiza a sessão.
+
+    Returns:
+        str: Perfil do usuário, ou None se não houver usuário logado
+    """
+    if not session.get('logged_in'):
+        return None
+
+    directory = get_directory()
+    version = directory.version()
+    if session.get('profile') is None or version is None or session.get('users_version') != version:
+        user = directory.get(session.get('username')) or {}
+        session['profile'] = user.get('profile', default)
+        session['users_version'] = version
+    return session['profile']
+
+
+def _is_api_request():
+    return request.path.startswith('/api/')
+
+
+def login_required(view=None, api=None):
+    """Exige usuário logado.
+
+    Páginas redirecionam para o login; rotas de API (ou api=True) respondem
+    401 em JSON.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped(*args, **kwargs):
+            if not session.get('logged_in'):
+                if api or (api is None and _is_api_request()):
+                    return jsonify({"success": False, "message": "Unauthorized"}), 401
+                return redirect(url_for('login', next=request.path))
+            return view(*args, **kwargs)
+        return wrapped
+
+    if view is not None:
+        return decorator(view)
+    return decorator
+
+
+def role_required(profile, message=None, api=None):
+    """Exige usuário logado com o perfil informado (ex.: 'auditor').
+
+    Args:
+        profile: Perfil exigido
+        message: (Opcional) Mensagem de acesso negado
+        api: Responder em JSON (403) em vez de redirecionar; por padrão,
+            True para rotas /api/
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped(*args, **kwargs):
+            is_api = api or (api is None and _is_api_request())
+            if not session.get('logged_in'):
+                if is_api:
+                    return jsonify({"success": False, "message": "Unauthorized"}), 401
+                return redirect(url_for('login', next=request.path))
+
+            if current_profile() != profile:
+                if is_api:
+                    return jsonify({"success": False, "message": message or "Acesso restrito."}), 403
+                flash(message or 'Acesso restrito. Apenas auditores podem acessar esta página.', 'danger')
+                return redirect(url_for('index'))
+            return view(*args, **kwargs)
+        return wrapped
+    return decorator
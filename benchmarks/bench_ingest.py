@@ -0,0 +1,129 @@
+"""Mede a latência por foto e o pico de memória (RSS) da conversão das fotos.
+
+Compara a conversão anterior (decodificação completa do JPEG antes do
+thumbnail) com a atual (photos.encode_photo: decodificação reduzida com
+draft e gravação sem nova codificação de um JPEG que já está no formato),
+para dois tipos de foto:
+
+    camera      JPEG de câmera de celular (por padrão 4000x3000, qualidade 92, EXIF com rotação)
+    formulario  JPEG já comprimido no celular pelo formulário (1200x900, qualidade 20)
+
+Cada combinação roda num processo separado, com --concurrency conversões
+simultâneas (como várias requisições ou threads da fila de fotos), para que
+o pico de RSS de uma não contamine a outra.
+
+Uso:
+    python benchmarks/bench_ingest.py [--photos N] [--size LxA] [--concurrency N]
+"""
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import tempfile
+import statistics
+import subprocess
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from photos import encode_photo, MAX_PHOTO_SIZE, JPEG_QUALITY  # noqa: E402
+
+MODES = ("anterior", "atual")
+KINDS = ("camera", "formulario")
+
+
+def legacy_encode(source, photo_path):
+    """Conversão anterior: a foto é decodificada inteira antes de reduzir."""
+    from PIL import Image
+
+    with Image.open(BytesIO(source)) as img:
+        img.load()
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        img.thumbnail(MAX_PHOTO_SIZE, Image.LANCZOS)
+        img.save(photo_path, format='JPEG', optimize=True, quality=JPEG_QUALITY)
+
+
+def synthetic_photo(kind, width, height, seed):
+    from PIL import Image
+
+    if kind == "formulario":
+        width, height, quality = 1200, 900, 20
+    else:
+        quality = 92
+    # Gradiente com ruído: comprime como uma foto real, não como uma cor sólida
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 40 + seed)
+    image = Image.merge("RGB", (gradient, noise, gradient.rotate(180)))
+    exif = Image.Exif()
+    if kind == "camera":
+        exif[0x0112] = 6  # Celular em pé: girar 90° na exibição
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=quality, exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+def run_child(args):
+    """Converte as fotos num modo e imprime as medidas em JSON (processo filho)."""
+    width, height = (int(value) for value in args.size.lower().split("x"))
+    photos = [synthetic_photo(args.kind, width, height, seed) for seed in range(args.photos)]
+    encode = legacy_encode if args.mode == "anterior" else encode_photo
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def convert(item):
+        index, photo = item
+        started = time.perf_counter()
+        encode(photo, os.path.join(images_dir, f"image_{index + 1}.jpg"))
+        return time.perf_counter() - started
+
+    with tempfile.TemporaryDirectory() as images_dir:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            timings = list(executor.map(convert, enumerate(photos)))
+        elapsed = time.perf_counter() - started
+        stored = sum(os.path.getsize(os.path.join(images_dir, name)) for name in os.listdir(images_dir))
+
+    print(json.dumps({
+        "median": statistics.median(timings),
+        "total": elapsed,
+        "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "baseline_rss": baseline_rss,
+        "stored": stored,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--photos", type=int, default=8)
+    parser.add_argument("--size", default="4000x3000")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--kind", choices=KINDS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_child(args)
+        return
+
+    print(f"{args.photos} fotos por tipo, {args.concurrency} conversões simultâneas, {os.cpu_count()} núcleos")
+    for kind in KINDS:
+        for mode in MODES:
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--mode", mode, "--kind", kind,
+                 "--photos", str(args.photos), "--size", args.size, "--concurrency", str(args.concurrency)],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            result = json.loads(output)
+            # ru_maxrss em KB no Linux
+            print(f"{kind:>10} {mode:>8}: {result['median'] * 1000:8.1f} ms/foto (mediana), "
+                  f"total {result['total'] * 1000:8.1f} ms, pico RSS {result['peak_rss'] / 1024:6.1f} MB "
+                  f"(+{(result['peak_rss'] - result['baseline_rss']) / 1024:6.1f} MB), "
+                  f"gravado {result['stored'] / 1024:7.1f} KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Mede a carga dos índices da auditoria a partir do diário (primeira consulta de um worker).
+
+Gera um diário sintético em um diretório temporário (por padrão 100 mil
+setups; cada um com dois 'put', como um registro com fotos processadas pela
+fila, e um terço deles com mais um 'put' da auditoria) e mede, num processo
+novo (como um worker do gunicorn recém-criado), o tempo e o pico de memória
+(RSS) de SetupIndexes.refresh com as cinco projeções registradas pelo app.
+Mostra também o tamanho do diário antes e depois da carga (a compactação
+automática reescreve o diário quando as versões substituídas passam do
+limite), e o tempo de uma segunda carga, já sobre o diário compactado.
+
+Uso:
+    python benchmarks/bench_journal.py [--setups N] [--cells N]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from journal import INDEX_DIR, JOURNAL_FILE, JOURNAL_VERSION  # noqa: E402
+
+SUPPLIERS = ["João Conceição", "Maria", "JOSÉ", "Ana Paula", "Luís"]
+AUDITORS = ["Auditor 1", "Auditora Lúcia", "Márcio"]
+WORDS = "parafuso etiqueta faltando peça conexões caixa trocada ok lote separado avaria".split()
+
+
+def build_journal(data_dir, setups, cells):
+    random.seed(1)
+    index_dir = os.path.join(data_dir, INDEX_DIR)
+    os.makedirs(index_dir)
+    path = os.path.join(index_dir, JOURNAL_FILE)
+    with open(path, "w") as f:
+        f.write(json.dumps({"version": JOURNAL_VERSION}) + "\n")
+        for index in range(setups):
+            cell_name = f"40000{index % cells:05d}"
+            setup_type = random.choice(["removal", "supply"])
+            timestamp = f"2025-{random.randint(1, 12):02d}-{random.randint(1, 28):02d}_{index % 24:02d}-00-00"
+            file_identifier = f"{index}_{setup_type}_{timestamp}"
+            document = {
+                "file_identifier": file_identifier, "setup_id": f"{index:032x}", "order_number": str(index // 2),
+                "setup_type": setup_type, "timestamp": timestamp, "audited": False, "auditor_name": "",
+                "supplier_name": random.choice(SUPPLIERS), "images": [], "cell_name": cell_name,
+                "audit_timestamp": "",
+                "text": {
+                    "observation": " ".join(random.choices(WORDS, k=8)), "audit_notes": "",
+                    "product": f"P{index % 50} Produto {index % 50}", "items": f"I{index % 7} Item {index % 7}",
+                },
+            }
+            event = {"op": "put", "cell": cell_name, "id": file_identifier, "doc": document}
+            f.write(json.dumps(event, separators=(",", ":")) + "\n")
+            # Segundo 'put': fotos processadas pela fila
+            document["images"] = [f"{file_identifier}/image_1.jpg"]
+            f.write(json.dumps(event, separators=(",", ":")) + "\n")
+            if index % 3 == 0:
+                document.update(audited=True, auditor_name=random.choice(AUDITORS),
+                                audit_timestamp=timestamp[:10] + " 18:00:00")
+                document["text"]["audit_notes"] = " ".join(random.choices(WORDS, k=4))
+                f.write(json.dumps(event, separators=(",", ":")) + "\n")
+    return path
+
+
+def run_child(data_dir):
+    """Carrega os índices e imprime as medidas em JSON (processo filho)."""
+    from storage import FileSetupRepository
+    from indexes import SetupIndexes
+    from search import SearchIndex
+    from facets import FacetIndex
+    from stats import StatsIndex
+    from changeovers import ChangeoverIndex
+
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    indexes = SetupIndexes(FileSetupRepository(data_dir))
+    for name, projection in (("search", SearchIndex()), ("facets", FacetIndex()),
+                             ("stats", StatsIndex()), ("changeovers", ChangeoverIndex())):
+        indexes.register(name, projection)
+    started = time.perf_counter()
+    indexes.refresh()
+    print(json.dumps({
+        "elapsed": time.perf_counter() - started,
+        "documents": len(indexes.documents),
+        "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "baseline_rss": baseline_rss,
+    }))
+
+
+def load(data_dir):
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", data_dir],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--setups", type=int, default=100000)
+    parser.add_argument("--cells", type=int, default=100)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child)
+        return
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        path = build_journal(data_dir, args.setups, args.cells)
+        for label in ("primeira carga", "segunda carga"):
+            size = os.path.getsize(path)
+            result = load(data_dir)
+            # ru_maxrss em KB no Linux
+            print(f"{label:>15}: {result['elapsed'] * 1000:8.1f} ms, {result['documents']} setups, "
+                  f"diário {size / 1024 / 1024:6.1f} MB -> {os.path.getsize(path) / 1024 / 1024:6.1f} MB, "
+                  f"pico RSS {result['peak_rss'] / 1024:6.1f} MB "
+                  f"(+{(result['peak_rss'] - result['baseline_rss']) / 1024:6.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
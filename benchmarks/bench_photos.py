@@ -0,0 +1,80 @@
+"""Mede a conversão das fotos de um registro de setup com 1, 2, 4 e 8 workers.
+
+Gera fotos sintéticas do tamanho de uma câmera de celular (por padrão 5
+fotos de 4000x3000 em JPEG) e mede photos.save_photos (decodificar,
+converter para RGB, reduzir para 1200x1200 e gravar em JPEG) com o
+PhotoEncoder em threads e em processos. A primeira execução de cada pool
+(criação das threads/processos) não entra na medição.
+
+Uso:
+    python benchmarks/bench_photos.py [--photos N] [--size LxA] [--workers 1,2,4,8] [--kind thread|process|both] [--runs N]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+from io import BytesIO
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from photos import PhotoEncoder, save_photos, ENCODER_THREADS, ENCODER_PROCESSES  # noqa: E402
+
+
+def synthetic_photo(width, height, seed):
+    from PIL import Image
+
+    # Gradiente com ruído: comprime como uma foto real, não como uma cor sólida
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 40 + seed)
+    image = Image.merge("RGB", (gradient, noise, gradient.rotate(180)))
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=92)
+    return buffer.getvalue()
+
+
+def measure(photos, encoder, runs):
+    timings = []
+    with tempfile.TemporaryDirectory() as images_dir:
+        # Aquecimento: cria o pool fora da medição
+        save_photos(images_dir, "bench", photos, encoder)
+        for _ in range(runs):
+            started = time.perf_counter()
+            images, errors = save_photos(images_dir, "bench", photos, encoder)
+            timings.append(time.perf_counter() - started)
+            assert len(images) == len(photos) and not errors, errors
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--photos", type=int, default=5)
+    parser.add_argument("--size", default="4000x3000")
+    parser.add_argument("--workers", default="1,2,4,8")
+    parser.add_argument("--kind", choices=[ENCODER_THREADS, ENCODER_PROCESSES, "both"], default="both")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    width, height = (int(value) for value in args.size.lower().split("x"))
+    photos = [synthetic_photo(width, height, seed) for seed in range(args.photos)]
+    print(f"{args.photos} fotos de {width}x{height} ({sum(map(len, photos)) / 1024 / 1024:.1f} MB), "
+          f"{os.cpu_count()} núcleos")
+
+    kinds = [ENCODER_THREADS, ENCODER_PROCESSES] if args.kind == "both" else [args.kind]
+    for kind in kinds:
+        baseline = None
+        for workers in (int(value) for value in args.workers.split(",")):
+            encoder = PhotoEncoder(workers=workers, kind=kind)
+            try:
+                elapsed = measure(photos, encoder, args.runs)
+            finally:
+                encoder.shutdown()
+            baseline = baseline or elapsed
+            label = f"{kind}, {workers} worker{'s' if workers > 1 else ''}"
+            print(f"{label:>20}: mediana {elapsed * 1000:8.1f} ms  ({baseline / elapsed:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
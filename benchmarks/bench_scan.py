@@ -0,0 +1,157 @@
+"""Mede a leitura de todos os setups do backend de arquivos (get_all_setups).
+
+Gera uma árvore sintética em um diretório temporário (por padrão 50 mil
+setups em 100 células; um quarto deles no formato antigo, sem a lista de
+imagens no registro, com a foto numa pasta) e compara:
+
+    antes: os.listdir + os.path.isdir/exists por entrada, célula a célula
+    depois: scanner.py (os.scandir, células em paralelo), com 1 e N threads
+
+Com o disco local e o cache de páginas quente, cada chamada ao sistema de
+arquivos custa microssegundos e a leitura fica limitada pela CPU (decodificar
+o JSON, com o GIL), então as threads pouco ajudam. Em NFS, ou com o cache
+frio, cada open/stat/listagem espera uma ida ao servidor ou ao disco; para
+medir esse caso, a comparação é repetida numa árvore menor com --latency ms
+de espera injetada em cada open, os.stat, os.listdir e os.scandir (a espera
+libera o GIL, como a de uma leitura real).
+
+Uso:
+    python benchmarks/bench_scan.py [--records N] [--cells N] [--workers N] [--runs N]
+                                    [--latency MS] [--latency-records N]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import builtins
+import tempfile
+import contextlib
+import statistics
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from storage import FileSetupRepository, is_cell_dir_name, normalize_setup  # noqa: E402
+
+
+def build_tree(data_dir, records, cells):
+    random.seed(1)
+    for cell_index in range(cells):
+        cell_dir = os.path.join(data_dir, f"40000{cell_index:05d}")
+        os.makedirs(cell_dir)
+        for index in range(cell_index, records, cells):
+            setup_type = random.choice(["removal", "supply"])
+            timestamp = f"2025-{random.randint(1, 12):02d}-{random.randint(1, 28):02d}_{index % 24:02d}-00-00"
+            file_identifier = f"{index}_{setup_type}_{timestamp}"
+            record = {
+                "order_number": str(index), "setup_type": setup_type, "timestamp": timestamp,
+                "supplier_name": "Abastecedor", "observation": "Setup sintético", "audited": index % 3 == 0,
+            }
+            if index % 4:
+                record["images"] = [{"filename": "image_1.jpg", "path": f"{file_identifier}/image_1.jpg"}]
+            else:
+                # Formato antigo: sem lista de imagens, foto na pasta do setup
+                os.makedirs(os.path.join(cell_dir, file_identifier))
+                open(os.path.join(cell_dir, file_identifier, "image_1.jpg"), "wb").close()
+            with open(os.path.join(cell_dir, f"{file_identifier}.txt"), "w") as f:
+                json.dump(record, f)
+
+
+def listdir_get_all_setups(data_dir):
+    # Implementação anterior: listdir, um isdir por célula e stats por registro
+    cells = {}
+    for cell_name in os.listdir(data_dir):
+        cell_dir = os.path.join(data_dir, cell_name)
+        if not is_cell_dir_name(cell_name) or not os.path.isdir(cell_dir):
+            continue
+        setups = []
+        for file in os.listdir(cell_dir):
+            if not file.endswith(".txt") or file.startswith("reset_"):
+                continue
+            txt_path = os.path.join(cell_dir, file)
+            if not os.path.exists(txt_path):
+                continue
+            with open(txt_path) as f:
+                setups.append(normalize_setup(json.load(f), file[:-4], cell_dir, cell_name))
+        cells[cell_name] = setups
+    return cells
+
+
+@contextlib.contextmanager
+def injected_latency(seconds):
+    """Acrescenta uma espera a cada open, os.stat, os.listdir e os.scandir (como num NFS)."""
+    originals = {
+        (builtins, "open"): builtins.open,
+        (os, "stat"): os.stat,
+        (os, "listdir"): os.listdir,
+        (os, "scandir"): os.scandir,
+    }
+
+    def delayed(function):
+        def wrapper(*args, **kwargs):
+            time.sleep(seconds)
+            return function(*args, **kwargs)
+        return wrapper
+
+    for (module, name), function in originals.items():
+        setattr(module, name, delayed(function))
+    try:
+        yield
+    finally:
+        for (module, name), function in originals.items():
+            setattr(module, name, function)
+
+
+def measure(function, runs):
+    timings, count = [], 0
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+        count = sum(len(setups) for setups in result.values())
+    return statistics.median(timings), count
+
+
+def compare(data_dir, workers, runs):
+    repository = FileSetupRepository(data_dir)
+    baseline, count = measure(lambda: listdir_get_all_setups(data_dir), runs)
+    print(f"{'listdir + stat':>22}: mediana {baseline * 1000:8.1f} ms  ({count} setups)")
+    for worker_count in sorted({1, workers}):
+        os.environ["SCAN_WORKERS"] = str(worker_count)
+        elapsed, count = measure(repository.get_all_setups, runs)
+        label = f"scandir, {worker_count} thread{'s' if worker_count > 1 else ''}"
+        print(f"{label:>22}: mediana {elapsed * 1000:8.1f} ms  ({count} setups, {baseline / elapsed:.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=50000)
+    parser.add_argument("--cells", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=1.0,
+                        help="ms de espera por chamada na segunda comparação (0 para não rodar)")
+    parser.add_argument("--latency-records", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        started = time.perf_counter()
+        build_tree(data_dir, args.records, args.cells)
+        print(f"árvore: {args.records} setups em {args.cells} células ({time.perf_counter() - started:.1f} s para gerar)")
+        print("disco local, cache quente:")
+        compare(data_dir, args.workers, args.runs)
+
+    if args.latency <= 0:
+        return
+    with tempfile.TemporaryDirectory() as data_dir:
+        build_tree(data_dir, args.latency_records, args.cells)
+        print(f"árvore: {args.latency_records} setups em {args.cells} células")
+        print(f"{args.latency:g} ms por open/stat/listagem (NFS ou cache frio):")
+        with injected_latency(args.latency / 1000):
+            compare(data_dir, args.workers, args.runs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Mede o tempo de inicialização de um worker (import do app e create_app).
+
+Cada medição roda num processo novo, dentro de um diretório temporário vazio,
+como um worker do gunicorn recém-criado. Também verifica que o import, o
+create_app e a primeira requisição (/login) não gravam arquivos (falha se
+algum for criado) e não carregam o Pillow, e mostra o custo de um hash de
+senha (o que cada worker pagava antes, ao recriar o usuário admin no import).
+
+Uso:
+    python benchmarks/bench_startup.py [--runs N]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r"""
+import os, sys, json, time, logging
+sys.path.insert(0, {repo!r})
+started = time.perf_counter()
+import app as app_module
+imported = time.perf_counter()
+app_module.create_app()
+created = time.perf_counter()
+logging.disable(logging.CRITICAL)
+response = app_module.app.test_client().get('/login')
+first_request = time.perf_counter()
+print(json.dumps({{
+    "import": imported - started,
+    "create_app": created - imported,
+    "first_request": first_request - created,
+    "status": response.status_code,
+    "pil_loaded": "PIL.Image" in sys.modules,
+    "files": sorted(name for name in os.listdir('.') if not name.startswith('.')),
+}}))
+"""
+
+
+def run_probe():
+    with tempfile.TemporaryDirectory() as work_dir:
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE.format(repo=REPO_DIR)],
+            cwd=work_dir, capture_output=True, text=True, check=True
+        ).stdout
+        return json.loads(output.strip().splitlines()[-1])
+
+
+def hash_cost(runs):
+    from werkzeug.security import generate_password_hash
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        generate_password_hash("admin123")
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    results = [run_probe() for _ in range(args.runs)]
+    for key in ("import", "create_app", "first_request"):
+        timings = [result[key] * 1000 for result in results]
+        print(f"{key:>14}: mediana {statistics.median(timings):7.1f} ms  (min {min(timings):.1f}, max {max(timings):.1f})")
+
+    last = results[-1]
+    print(f"{'status /login':>14}: {last['status']}")
+    print(f"{'Pillow':>14}: {'carregado' if last['pil_loaded'] else 'não carregado'} na inicialização")
+    print(f"{'arquivos':>14}: {last['files'] or 'nenhum arquivo gravado'}")
+    print(f"{'hash admin':>14}: mediana {hash_cost(args.runs) * 1000:7.1f} ms por worker (custo removido do import)")
+
+    written = sorted({name for result in results for name in result["files"]})
+    if written:
+        sys.exit(f"Arquivos gravados na inicialização: {written}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Cache em memória do cadastro de QR codes (células, produtos e itens).
+
+Uma única requisição GET /setup consulta o cadastro várias vezes (nome da
+célula, produtos, itens). Em vez de reler e reinterpretar o qrcodes.json a
+cada consulta, o cache mantém o dicionário carregado e índices O(1):
+
+    QR code -> entrada da célula
+    nome da célula -> entrada (primeira encontrada, como nas buscas antigas)
+    (QR code, código do produto) -> itens
+
+O cache é invalidado quando a versão do cadastro muda (mtime/tamanho/inode
+do qrcodes.json, inclusive quando outro worker grava o arquivo) e é
+reconstruído imediatamente após as gravações feitas por este processo.
+
+No backend PostgreSQL o banco já é a fonte compartilhada entre os hosts e
+tem consultas preparadas para essas buscas, então o cache apenas repassa as
+chamadas ao repositório.
+"""
+import copy
+import threading
+
+
+class CatalogCache:
+    """Cache do cadastro de QR codes com índices reversos."""
+
+    def __init__(self, repository):
+        self.repository = repository
+        self.generation = 0  # Incrementado a cada gravação feita por este processo
+        self._lock = threading.Lock()
+        self._version = None
+        self._qrcodes = {}
+        self._by_cell_name = {}
+        self._with_products_by_cell_name = {}
+        self._items = {}
+
+    @property
+    def enabled(self):
+        return self.repository.caches_catalog
+
+    def _build_indexes(self, qrcodes):
+        by_cell_name = {}
+        with_products = {}
+        items = {}
+        for qrcode, data in qrcodes.items():
+            if not isinstance(data, dict):
+                continue
+            cell_name = str(data.get("cell_name", ""))
+            if cell_name:
+                by_cell_name.setdefault(cell_name, qrcode)
+                if data.get("products"):
+                    with_products.setdefault(cell_name, qrcode)
+            for product in data.get("products", []):
+                items[(qrcode, str(product.get("code")))] = product.get("items", [])
+
+        self._qrcodes = qrcodes
+        self._by_cell_name = by_cell_name
+        self._with_products_by_cell_name = with_products
+        self._items = items
+
+    def _refresh(self):
+        version = self.repository.catalog_version()
+        if version == self._version:
+            return
+        with self._lock:
+            if version != self._version:
+                self._build_indexes(self.repository.load_qrcodes_or_empty())
+                self._version = version
+
+    def qrcodes(self):
+        """Obtém o dicionário do cadastro em cache (somente leitura)."""
+        if not self.enabled:
+            return self.repository.load_qrcodes_or_empty()
+        self._refresh()
+        return self._qrcodes
+
+    def copy_qrcodes(self):
+        """Obtém uma cópia do cadastro que pode ser alterada e gravada com save_qrcodes."""
+        if not self.enabled:
+            return self.repository.load_qrcodes_or_empty()
+        return copy.deepcopy(self.qrcodes())
+
+    def save_qrcodes(self, qrcodes):
+        """Grava o cadastro e atualiza o cache e os índices."""
+        self.repository.save_qrcodes(qrcodes)
+        self.generation += 1
+        if not self.enabled:
+            return
+        with self._lock:
+            self._build_indexes(qrcodes)
+            self._version = self.repository.catalog_version()
+
+    def lookup_qrcode(self, qrcode_value):
+        """Obtém a entrada de um QR code (string no formato antigo ou dicionário), ou None."""
+        if not self.enabled:
+            return self.repository.lookup_qrcode(qrcode_value)
+        return self.qrcodes().get(qrcode_value)
+
+    def _cell_key(self, cell_name, require_products=False):
+        qrcodes = self.qrcodes()
+        entry = qrcodes.get(cell_name)
+        if isinstance(entry, dict) and (entry.get("products") or not require_products):
+            return cell_name
+        index = self._with_products_by_cell_name if require_products else self._by_cell_name
+        return index.get(str(cell_name))
+
+    def cell_products(self, cell_name):
+        """Obtém os produtos cadastrados para a célula (busca exata), ou lista vazia."""
+        if not self.enabled:
+            return self.repository.cell_products(cell_name)
+        qrcode = self._cell_key(cell_name, require_products=True)
+        return self._qrcodes[qrcode].get("products", []) if qrcode is not None else []
+
+    def product_items(self, cell_name, product_code):
+        """Obtém os itens de um produto da célula (busca exata).
+
+        Returns:
+            list: Itens do produto, ou None se a célula não for encontrada
+        """
+        if not self.enabled:
+            return self.repository.product_items(cell_name, product_code)
+        qrcode = self._cell_key(cell_name)
+        if qrcode is None:
+            return None
+        return self._items.get((qrcode, str(product_code)), [])
+
+    def cell_names(self):
+        """Obtém os nomes de célula cadastrados e o QR code de cada um."""
+        if not self.enabled:
+            cell_names = {}
+            for qrcode, data in self.qrcodes().items():
+                if isinstance(data, dict) and data.get("cell_name"):
+                    cell_names.setdefault(str(data["cell_name"]), qrcode)
+            return cell_names
+        self._refresh()
+        return self._by_cell_name
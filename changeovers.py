@@ -0,0 +1,272 @@
+"""Tempos de troca (retirada -> abastecimento) por ordem, célula, turno e semana.
+
+Cada OP tem um registro de retirada e um de abastecimento na célula; o
+tempo de troca é o intervalo entre eles. A projeção do diário de
+alterações (ver indexes.py) pareia os registros de cada (célula, ordem):
+
+    retirada: a mais antiga da ordem
+    abastecimento: o mais antigo registrado depois dessa retirada
+
+e mantém, para cada (célula, turno, semana) da retirada, um esboço de
+distribuição dos tempos (histograma logarítmico, com erro relativo de
+ALPHA nos percentis). Os esboços aceitam inclusão e remoção e podem ser
+somados, então um registro, edição ou exclusão só ajusta o par da ordem
+alterada, e uma consulta soma os esboços do período sem percorrer o
+histórico.
+
+Os turnos são configurados em CHANGEOVER_SHIFTS (padrão
+"06:00-14:00,14:00-22:00,22:00-06:00"); as semanas seguem a ISO 8601
+(ex.: "2025-W18"). No PostgreSQL, os pares são montados pelo banco a cada
+consulta, só os das células e semanas filtradas.
+"""
+import os
+import math
+import datetime
+
+from indexes import fold
+from stats import parse_timestamp
+
+
+DEFAULT_SHIFTS = "06:00-14:00,14:00-22:00,22:00-06:00"
+
+# Erro relativo dos percentis calculados pelos esboços
+ALPHA = 0.01
+
+# Percentis devolvidos pela API
+PERCENTILES = (50, 90, 95, 99)
+
+# Agrupamentos aceitos pela API
+GROUP_BY = ("cell", "shift", "week")
+
+
+def parse_shifts(value=None):
+    """Lê os turnos no formato "HH:MM-HH:MM,..." (CHANGEOVER_SHIFTS).
+
+    Returns:
+        list: Tuplas (nome, início, fim) com início/fim em minutos do dia
+
+    Raises:
+        ValueError: Se o formato for inválido
+    """
+    shifts = []
+    for part in (value or os.environ.get("CHANGEOVER_SHIFTS") or DEFAULT_SHIFTS).split(","):
+        part = part.strip()
+        try:
+            start, end = part.split("-")
+            start_hour, start_minute = map(int, start.split(":"))
+            end_hour, end_minute = map(int, end.split(":"))
+        except ValueError:
+            raise ValueError(f"Turno inválido: {part!r} (use HH:MM-HH:MM)")
+        shifts.append((part, start_hour * 60 + start_minute, end_hour * 60 + end_minute))
+    return shifts
+
+
+def shift_of(moment, shifts):
+    """Nome do turno em que um horário cai (turnos podem passar da meia-noite)."""
+    minute = moment.hour * 60 + moment.minute
+    for name, start, end in shifts:
+        if (start <= minute < end) if start <= end else (minute >= start or minute < end):
+            return name
+    return ""
+
+
+def week_of(moment):
+    """Semana ISO 8601 de uma data (ex.: "2025-W18")."""
+    year, week, _ = moment.isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def week_bounds(date_start=None, date_end=None):
+    """Primeiro e último dia (AAAA-MM-DD) das semanas ISO do período, ou None sem limite."""
+    first = last = None
+    if date_start:
+        day = datetime.date.fromisoformat(date_start)
+        first = (day - datetime.timedelta(days=day.weekday())).isoformat()
+    if date_end:
+        day = datetime.date.fromisoformat(date_end)
+        last = (day + datetime.timedelta(days=6 - day.weekday())).isoformat()
+    return first, last
+
+
+class DurationSketch:
+    """Histograma logarítmico de durações (segundos) com remoção e soma.
+
+    Cada valor cai no balde ceil(log(x) / log(gamma)), com
+    gamma = (1 + ALPHA) / (1 - ALPHA); o percentil é estimado pelo centro do
+    balde, com erro relativo de no máximo ALPHA.
+    """
+
+    def __init__(self):
+        self.gamma = (1 + ALPHA) / (1 - ALPHA)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zeros = 0
+        self.count = 0
+        self.total = 0
+
+    def _bucket(self, value):
+        return math.ceil(math.log(value) / self.log_gamma)
+
+    def add(self, value, delta=1):
+        """Inclui (ou, com delta=-1, remove) uma duração."""
+        self.count += delta
+        self.total += delta * value
+        if value < 1:
+            self.zeros += delta
+            return
+        bucket = self._bucket(value)
+        count = self.buckets.get(bucket, 0) + delta
+        if count > 0:
+            self.buckets[bucket] = count
+        else:
+            self.buckets.pop(bucket, None)
+
+    def merge(self, other):
+        """Soma as durações de outro esboço a este."""
+        self.count += other.count
+        self.total += other.total
+        self.zeros += other.zeros
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+
+    def percentile(self, percent):
+        """Duração estimada no percentil informado (0 a 100), ou None se vazio."""
+        if self.count <= 0:
+            return None
+        rank = percent / 100 * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if rank < seen:
+                return 2 * self.gamma ** bucket / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def summary(self):
+        """Quantidade, média e percentis, em minutos."""
+        result = {
+            "count": self.count,
+            "mean_minutes": round(self.total / self.count / 60, 1) if self.count else None,
+        }
+        for percent in PERCENTILES:
+            value = self.percentile(percent)
+            result[f"p{percent}_minutes"] = round(value / 60, 1) if value is not None else None
+        return result
+
+
+class ChangeoverIndex:
+    """Projeção com os pares retirada/abastecimento e os esboços por célula, turno e semana."""
+
+    def __init__(self, shifts=None):
+        self.shifts = shifts or parse_shifts()
+        self.reset()
+
+    def reset(self):
+        self.orders = {}
+        self.pairs = {}
+        self.sketches = {}
+
+    def _pair(self, records):
+        removals = sorted(records["removal"].values())
+        if not removals:
+            return None
+        removal = removals[0]
+        supplies = sorted(timestamp for timestamp in records["supply"].values() if timestamp >= removal)
+        if not supplies:
+            return None
+        return removal, supplies[0]
+
+    def _apply_pair(self, cell_name, pair, delta):
+        removal, supply = pair
+        removal_time, supply_time = parse_timestamp(removal), parse_timestamp(supply)
+        if removal_time is None or supply_time is None:
+            return
+        duration = int((supply_time - removal_time).total_seconds())
+        sketch_key = (cell_name, shift_of(removal_time, self.shifts), week_of(removal_time))
+        sketch = self.sketches.get(sketch_key)
+        if sketch is None:
+            sketch = self.sketches[sketch_key] = DurationSketch()
+        sketch.add(duration, delta)
+        if sketch.count <= 0:
+            del self.sketches[sketch_key]
+
+    def _update(self, key, document, present):
+        setup_type = document.get("setup_type")
+        if setup_type not in ("removal", "supply") or not document.get("order_number"):
+            return
+        order_key = (document["cell_name"], document["order_number"])
+        records = self.orders.setdefault(order_key, {"removal": {}, "supply": {}})
+        if present:
+            records[setup_type][key] = document.get("timestamp") or ""
+        else:
+            records[setup_type].pop(key, None)
+
+        # Só o par da ordem alterada é recalculado
+        previous = self.pairs.pop(order_key, None)
+        if previous is not None:
+            self._apply_pair(order_key[0], previous, -1)
+        pair = self._pair(records)
+        if pair is not None:
+            self.pairs[order_key] = pair
+            self._apply_pair(order_key[0], pair, 1)
+        if not records["removal"] and not records["supply"]:
+            del self.orders[order_key]
+
+    def add_pair(self, cell_name, removal, supply):
+        """Inclui um par retirada/abastecimento já montado (ex.: pareado pelo banco)."""
+        self._apply_pair(cell_name, (removal, supply), 1)
+
+    def add(self, key, document):
+        self._update(key, document, True)
+
+    def remove(self, key, document):
+        self._update(key, document, False)
+
+    def summary(self, group_by="cell", date_start=None, date_end=None, cell=None, shift=None):
+        """Tempos de troca agrupados por célula, turno ou semana.
+
+        Args:
+            group_by: 'cell', 'shift' ou 'week'
+            date_start, date_end: (Opcional) Período (AAAA-MM-DD), pela semana da retirada
+            cell: (Opcional) Trecho do nome da célula
+            shift: (Opcional) Nome do turno (ex.: "06:00-14:00")
+
+        Returns:
+            dict: overall (todos os pares do filtro) e groups (um resumo por grupo)
+        """
+        week_start = week_of(datetime.date.fromisoformat(date_start)) if date_start else None
+        week_end = week_of(datetime.date.fromisoformat(date_end)) if date_end else None
+        cell_query = fold(cell) if cell else None
+        position = GROUP_BY.index(group_by)
+
+        overall, groups = DurationSketch(), {}
+        for sketch_key, sketch in self.sketches.items():
+            cell_name, shift_name, week = sketch_key
+            if (week_start and week < week_start) or (week_end and week > week_end):
+                continue
+            if (cell_query and cell_query not in fold(cell_name)) or (shift and shift_name != shift):
+                continue
+            overall.merge(sketch)
+            group = groups.get(sketch_key[position])
+            if group is None:
+                group = groups[sketch_key[position]] = DurationSketch()
+            group.merge(sketch)
+
+        return {
+            "overall": overall.summary(),
+            "groups": [dict(groups[name].summary(), **{group_by: name}) for name in sorted(groups)],
+        }
+
+
+def changeover_stats(indexes, group_by="cell", date_start=None, date_end=None, cell=None, shift=None):
+    """Tempos de troca (ver ChangeoverIndex.summary).
+
+    Nos backends sem índices em memória (PostgreSQL), os tempos vêm do
+    repositório (SetupRepository.changeover_stats).
+    """
+    if not indexes.enabled:
+        return indexes.repository.changeover_stats(group_by, date_start, date_end, cell, shift)
+
+    with indexes.snapshot():
+        return indexes.projections["changeovers"].summary(group_by, date_start, date_end, cell, shift)
@@ -0,0 +1,118 @@
+"""Contagens por faceta para a barra de filtros da auditoria.
+
+Para os filtros da auditoria, a página mostra quantos setups há por
+célula, abastecedor, auditor, tipo de setup e status de auditoria. As
+contagens gerais (sem filtros, ou filtrando só pelo status de auditoria)
+são mantidas incrementalmente como projeção do diário de alterações (ver
+indexes.py): cada registro, auditoria ou exclusão só ajusta os contadores
+do setup alterado. Com outros filtros, os setups que os atendem vêm dos
+índices secundários e só eles são contados.
+
+Os valores são agrupados sem diferenciar maiúsculas e acentos ("João" e
+"JOAO" contam juntos); o rótulo é o primeiro valor encontrado. Os poucos
+valores distintos de célula, abastecedor e auditor se repetem em todos os
+setups, então a normalização de cada um é guardada em cache.
+"""
+import functools
+
+from indexes import fold
+
+
+# Facetas contadas: nome -> campo do documento do setup
+FACETS = {
+    "cell": "cell_name",
+    "supplier": "supplier_name",
+    "auditor": "auditor_name",
+    "setup_type": "setup_type",
+}
+
+# Valores exibidos por faceta (os mais frequentes)
+DEFAULT_FACET_SIZE = 50
+
+_fold_label = functools.lru_cache(maxsize=4096)(fold)
+
+
+class FacetCounter:
+    """Contadores por faceta de um conjunto de setups."""
+
+    def __init__(self):
+        self.total = 0
+        self.audited = {True: 0, False: 0}
+        self.counts = {facet: {} for facet in FACETS}
+        self.labels = {facet: {} for facet in FACETS}
+
+    def add(self, document, delta=1):
+        """Conta (ou, com delta=-1, desconta) um setup."""
+        self.total += delta
+        self.audited[bool(document.get("audited"))] += delta
+        for facet, field in FACETS.items():
+            label = str(document.get(field) or "")
+            value = _fold_label(label)
+            counts = self.counts[facet]
+            count = counts.get(value, 0) + delta
+            if count > 0:
+                counts[value] = count
+                self.labels[facet].setdefault(value, label)
+            else:
+                counts.pop(value, None)
+                self.labels[facet].pop(value, None)
+
+    def result(self, size=DEFAULT_FACET_SIZE):
+        """Contagens no formato da API: total, valores mais frequentes de cada faceta e auditados."""
+        facets = {}
+        for facet in FACETS:
+            labels = self.labels[facet]
+            ranked = sorted(self.counts[facet].items(), key=lambda item: (-item[1], item[0]))
+            facets[facet] = [{"value": labels[value], "count": count} for value, count in ranked[:size]]
+        facets["audited"] = {"true": self.audited[True], "false": self.audited[False]}
+        return {"total": self.total, "facets": facets}
+
+
+def count_facets(documents, size=DEFAULT_FACET_SIZE):
+    """Conta as facetas de uma sequência de documentos/resumos de setups (com cell_name)."""
+    counter = FacetCounter()
+    for document in documents:
+        counter.add(document)
+    return counter.result(size)
+
+
+class FacetIndex:
+    """Projeção com as contagens gerais e por status de auditoria."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.counters = {None: FacetCounter(), True: FacetCounter(), False: FacetCounter()}
+
+    def add(self, key, document):
+        self.counters[None].add(document)
+        self.counters[bool(document.get("audited"))].add(document)
+
+    def remove(self, key, document):
+        self.counters[None].add(document, -1)
+        self.counters[bool(document.get("audited"))].add(document, -1)
+
+
+def _only_audited_filter(filters):
+    return all(
+        value in (None, "") for name, value in filters.items() if name not in ("audited", "match")
+    )
+
+
+def facet_counts(indexes, filters=None, size=DEFAULT_FACET_SIZE):
+    """Contagens por faceta dos setups que atendem aos filtros (ver storage.setup_matches).
+
+    Nos backends sem índices em memória (PostgreSQL), as contagens vêm do
+    repositório (SetupRepository.facet_counts).
+    """
+    filters = filters or {}
+    if not indexes.enabled:
+        return indexes.repository.facet_counts(filters, size)
+
+    with indexes.snapshot() as documents:
+        if _only_audited_filter(filters):
+            audited = filters.get("audited")
+            return indexes.projections["facets"].counters[None if audited is None else bool(audited)].result(size)
+        entries, _, _ = indexes.projections["setups"].search(documents, filters)
+        return count_facets((documents[(cell_name, file_identifier)] for _, cell_name, file_identifier in entries), size)
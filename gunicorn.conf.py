@@ -0,0 +1,11 @@
+"""Configuração do gunicorn (lida automaticamente quando ele é iniciado na pasta do projeto).
+
+O endereço, a quantidade de workers e os demais parâmetros continuam vindo
+da linha de comando (ex.: gunicorn --bind 0.0.0.0:5000 main:app).
+"""
+
+
+def post_worker_init(worker):
+    """Inicia a fila de fotos e carrega os índices da auditoria assim que cada worker sobe (ver app.warm_up_worker)."""
+    from app import warm_up_worker
+    warm_up_worker()
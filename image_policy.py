@@ -0,0 +1,222 @@
+"""Política das imagens gravadas dos setups (dimensões, tamanho e formato).
+
+Antes, toda foto era gravada em JPEG qualidade 85 e até 1200x1200, fosse a
+visão geral de uma linha ou o close de uma etiqueta, e o tamanho dos
+arquivos variava muito. A política define, por tipo de setup e por célula:
+
+    max_width, max_height   Dimensões máximas (padrão 1200x1200)
+    max_bytes               Tamanho máximo de cada imagem (padrão: sem limite)
+    format                  "jpeg" (padrão) ou "webp"
+    quality                 Qualidade máxima (padrão 85)
+    min_quality             Qualidade mínima na busca pelo tamanho (padrão 40)
+
+Com max_bytes, a conversão procura (busca binária entre min_quality e
+quality) a maior qualidade cujo arquivo cabe no limite (ver
+photos.encode_photo). A política usada e a razão entre os bytes gravados e
+os recebidos ficam no registro do setup (image_policy e image_ratio, e em
+cada imagem).
+
+As políticas ficam em dados_setup/image_policy.json; cada nível completa o
+anterior:
+
+    {
+        "default": {"max_bytes": 400000},
+        "setup_types": {"removal": {"max_width": 1600, "max_height": 1600}},
+        "cells": {
+            "4000004399": {
+                "format": "webp",
+                "setup_types": {"supply": {"max_bytes": 250000}}
+            }
+        }
+    }
+
+O arquivo é relido quando muda; sem ele, vale a política padrão.
+
+Variáveis de ambiente:
+    IMAGE_POLICY_FILE   Arquivo das políticas (padrão: dados_setup/image_policy.json)
+"""
+import os
+import json
+import logging
+import threading
+
+
+POLICY_FILE = "image_policy.json"
+
+FORMAT_JPEG = "jpeg"
+FORMAT_WEBP = "webp"
+FORMAT_EXTENSIONS = {FORMAT_JPEG: ".jpg", FORMAT_WEBP: ".webp"}
+
+# Campos da política e seus tipos (max_bytes também pode ser null)
+POLICY_FIELDS = {
+    "max_width": int,
+    "max_height": int,
+    "max_bytes": int,
+    "format": str,
+    "quality": int,
+    "min_quality": int,
+}
+
+
+class ImagePolicy:
+    """Política de gravação das imagens de um setup.
+
+    Args:
+        max_width: (Opcional) Largura máxima em pixels
+        max_height: (Opcional) Altura máxima em pixels
+        max_bytes: (Opcional) Tamanho máximo de cada imagem em bytes (None: sem limite)
+        format: (Opcional) "jpeg" ou "webp"
+        quality: (Opcional) Qualidade máxima (1 a 100)
+        min_quality: (Opcional) Qualidade mínima ao buscar o tamanho
+        source: (Opcional) Níveis de configuração aplicados (registrado no setup)
+    """
+
+    __slots__ = ("max_width", "max_height", "max_bytes", "format", "quality", "min_quality", "source")
+
+    def __init__(self, max_width=1200, max_height=1200, max_bytes=None, format=FORMAT_JPEG,
+                 quality=85, min_quality=40, source="default"):
+        format = str(format).lower()
+        if format not in FORMAT_EXTENSIONS:
+            raise ValueError(f"Formato de imagem inválido: {format!r} (use jpeg ou webp)")
+        if max_width < 1 or max_height < 1:
+            raise ValueError("Dimensões máximas inválidas")
+        if max_bytes is not None and max_bytes < 1:
+            raise ValueError("max_bytes inválido")
+        if not 1 <= min_quality <= quality <= 100:
+            raise ValueError("Qualidades inválidas (1 <= min_quality <= quality <= 100)")
+        self.max_width = max_width
+        self.max_height = max_height
+        self.max_bytes = max_bytes
+        self.format = format
+        self.quality = quality
+        self.min_quality = min_quality
+        self.source = source
+
+    @property
+    def max_size(self):
+        return (self.max_width, self.max_height)
+
+    @property
+    def extension(self):
+        """Extensão dos arquivos gravados (.jpg ou .webp)."""
+        return FORMAT_EXTENSIONS[self.format]
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Política gravada no registro de um setup (a padrão, se não houver)."""
+        if not data:
+            return DEFAULT_POLICY
+        return cls(**{field: data[field] for field in cls.__slots__ if field in data})
+
+    def __eq__(self, other):
+        return isinstance(other, ImagePolicy) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f"ImagePolicy({self.to_dict()!r})"
+
+
+DEFAULT_POLICY = ImagePolicy()
+
+
+def _check_rules(rules, where):
+    """Valida os campos de um nível da configuração."""
+    if not isinstance(rules, dict):
+        raise ValueError(f"{where}: esperado um objeto")
+    for field, value in rules.items():
+        if field == "setup_types":
+            continue
+        expected = POLICY_FIELDS.get(field)
+        if expected is None:
+            raise ValueError(f"{where}: campo desconhecido {field!r}")
+        if value is None and field == "max_bytes":
+            continue
+        if not isinstance(value, expected) or isinstance(value, bool):
+            raise ValueError(f"{where}: {field} deve ser {expected.__name__}")
+
+
+def _fields(rules):
+    return {field: value for field, value in rules.items() if field in POLICY_FIELDS}
+
+
+class ImagePolicies:
+    """Políticas das imagens por tipo de setup e por célula (arquivo JSON).
+
+    Args:
+        data_dir: Diretório raiz dos dados (dados_setup)
+        path: (Opcional) Arquivo das políticas (padrão: IMAGE_POLICY_FILE ou
+            dados_setup/image_policy.json)
+    """
+
+    def __init__(self, data_dir, path=None):
+        self.path = path or os.environ.get("IMAGE_POLICY_FILE") or os.path.join(data_dir, POLICY_FILE)
+        self._config = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        """Relê o arquivo se ele mudou; uma configuração inválida é ignorada."""
+        try:
+            stat = os.stat(self.path)
+            version = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            version = None
+        if version == self._version:
+            return self._config
+
+        with self._lock:
+            if version == self._version:
+                return self._config
+            config = {}
+            if version is not None:
+                try:
+                    with open(self.path, encoding='utf-8') as f:
+                        config = json.load(f)
+                    if not isinstance(config, dict) or set(config) - {"default", "setup_types", "cells"}:
+                        raise ValueError("use apenas as chaves default, setup_types e cells")
+                    _check_rules(config.get("default", {}), "default")
+                    for setup_type, rules in config.get("setup_types", {}).items():
+                        _check_rules(rules, f"setup_types.{setup_type}")
+                    for cell_name, rules in config.get("cells", {}).items():
+                        _check_rules(rules, f"cells.{cell_name}")
+                        for setup_type, type_rules in rules.get("setup_types", {}).items():
+                            _check_rules(type_rules, f"cells.{cell_name}.setup_types.{setup_type}")
+                    # Todas as combinações precisam formar uma política válida
+                    setup_types = {None, *config.get("setup_types", {})}
+                    for rules in config.get("cells", {}).values():
+                        setup_types.update(rules.get("setup_types", {}))
+                    for cell_name in [None, *config.get("cells", {})]:
+                        for setup_type in setup_types:
+                            self._resolve(config, cell_name, setup_type)
+                except (OSError, ValueError, TypeError, AttributeError) as e:
+                    logging.error(f"Política de imagens inválida em {self.path}: {e}; usando a política padrão")
+                    config = {}
+            self._config = config
+            self._version = version
+            return config
+
+    def _resolve(self, config, cell_name, setup_type):
+        fields = {}
+        source = ["default"]
+        fields.update(_fields(config.get("default", {})))
+        type_rules = config.get("setup_types", {}).get(setup_type)
+        if type_rules:
+            fields.update(_fields(type_rules))
+            source.append(f"setup_types.{setup_type}")
+        cell_rules = config.get("cells", {}).get(cell_name)
+        if cell_rules:
+            fields.update(_fields(cell_rules))
+            source.append(f"cells.{cell_name}")
+            cell_type_rules = cell_rules.get("setup_types", {}).get(setup_type)
+            if cell_type_rules:
+                fields.update(_fields(cell_type_rules))
+                source.append(f"cells.{cell_name}.setup_types.{setup_type}")
+        if len(source) == 1 and not fields:
+            return DEFAULT_POLICY
+        return ImagePolicy(source="+".join(source), **fields)
+
+    def resolve(self, cell_name, setup_type):
+        """Política das imagens de um setup da célula e do tipo informados."""
+        return self._resolve(self._load(), cell_name, setup_type)
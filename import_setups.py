@@ -0,0 +1,183 @@
+"""Importação em lote de uma árvore dados_setup para o backend configurado.
+
+Lê os arquivos <ordem>_<tipo>_<timestamp>.txt de todas as células em paralelo
+(um processo por célula), normaliza cada registro uma única vez (imagem
+antiga .jpg na raiz da célula, 'audited' gravado como string, QR codes no
+formato antigo) e grava no repositório de destino em lotes.
+
+A importação pode ser retomada: as células já concluídas ficam registradas
+em dados_setup/_import_checkpoint.json e são ignoradas numa nova execução.
+
+Uso:
+    flask --app main import-setups [--workers N] [--batch-size N] [--restart]
+"""
+import os
+import json
+import time
+import logging
+import datetime
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from storage import FileSetupRepository
+
+
+CHECKPOINT_FILE = "_import_checkpoint.json"
+
+
+def read_cell_setups(data_dir, cell_name):
+    """Lê e normaliza todos os setups de uma célula.
+
+    Executada nos processos do pool, por isso recebe apenas valores simples.
+
+    Returns:
+        tuple: (cell_name, lista de tuplas (file_identifier, dados do setup))
+    """
+    source = FileSetupRepository(data_dir)
+    setups = [(setup_data["file_identifier"], setup_data) for setup_data in source.iter_cell_setups(cell_name)]
+    setups.sort(key=lambda setup: setup[0])
+    return cell_name, setups
+
+
+def normalize_qrcodes(qrcodes):
+    """Converte as entradas de QR code no formato antigo (apenas o nome da célula)."""
+    return {
+        qrcode: {"cell_name": data, "products": []} if isinstance(data, str) else data
+        for qrcode, data in qrcodes.items()
+    }
+
+
+def load_checkpoint(path, backend):
+    """Carrega o checkpoint da importação para o backend de destino."""
+    checkpoint = {"backend": backend, "finished_cells": [], "catalog_done": False, "deletions_done": False}
+    if not os.path.exists(path):
+        return checkpoint
+    try:
+        with open(path, 'r') as f:
+            saved = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logging.error(f"Erro ao ler checkpoint da importação {path}: {e}")
+        return checkpoint
+    # Um checkpoint de outro backend não vale para este destino
+    if saved.get("backend") != backend:
+        return checkpoint
+    checkpoint.update(saved)
+    return checkpoint
+
+
+def save_checkpoint(path, checkpoint):
+    """Grava o checkpoint de forma atômica (arquivo temporário + rename)."""
+    checkpoint["updated_at"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _same_dir(path, other):
+    return os.path.realpath(path) == os.path.realpath(other)
+
+
+def import_tree(data_dir, target, workers=None, batch_size=500, restart=False, echo=print):
+    """Importa a árvore de arquivos dados_setup para o repositório de destino.
+
+    Args:
+        data_dir: Diretório raiz dos dados (dados_setup)
+        target: Repositório de destino (segmentos, SQLite ou PostgreSQL)
+        workers: Número de processos de leitura (padrão: número de CPUs)
+        batch_size: Quantidade de setups gravados por transação
+        restart: Ignorar o checkpoint e importar tudo novamente
+        echo: Função usada para reportar o progresso
+
+    Returns:
+        dict: Totais da importação (células, registros, segundos, registros/s)
+    """
+    source = FileSetupRepository(data_dir)
+    checkpoint_path = os.path.join(data_dir, CHECKPOINT_FILE)
+    if restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    checkpoint = load_checkpoint(checkpoint_path, target.name)
+    finished_cells = set(checkpoint["finished_cells"])
+
+    # Cadastros (usuários e QR codes); um destino que os guarda nos mesmos
+    # arquivos JSON (segmentos, SQLite) já os tem
+    if not checkpoint["catalog_done"] and target.stores_catalog_files and _same_dir(target.data_dir, data_dir):
+        checkpoint["catalog_done"] = True
+    if not checkpoint["catalog_done"]:
+        try:
+            target.save_users(source.load_users())
+        except FileNotFoundError:
+            pass
+        try:
+            target.save_qrcodes(normalize_qrcodes(source.load_qrcodes()))
+        except FileNotFoundError:
+            pass
+        checkpoint["catalog_done"] = True
+        save_checkpoint(checkpoint_path, checkpoint)
+        echo("Cadastros de usuários e QR codes importados")
+
+    pending_cells = sorted(cell for cell in source.list_cells() if cell not in finished_cells)
+    if finished_cells:
+        echo(f"Retomando importação: {len(finished_cells)} células já concluídas, {len(pending_cells)} pendentes")
+
+    total_records = 0
+    started = time.monotonic()
+    workers = workers or os.cpu_count() or 1
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Manter apenas alguns lotes de células em memória por vez
+        cells_iter = iter(pending_cells)
+        running = set()
+        while True:
+            while len(running) < workers * 2:
+                cell_name = next(cells_iter, None)
+                if cell_name is None:
+                    break
+                running.add(executor.submit(read_cell_setups, data_dir, cell_name))
+            if not running:
+                break
+
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                cell_name, setups = future.result()
+                cell_started = time.monotonic()
+                for start in range(0, len(setups), batch_size):
+                    target.save_setups(cell_name, setups[start:start + batch_size])
+
+                finished_cells.add(cell_name)
+                checkpoint["finished_cells"] = sorted(finished_cells)
+                save_checkpoint(checkpoint_path, checkpoint)
+
+                total_records += len(setups)
+                elapsed = time.monotonic() - started
+                echo(
+                    f"Célula {cell_name}: {len(setups)} registros em {time.monotonic() - cell_started:.2f}s "
+                    f"(total {total_records} registros, {total_records / elapsed if elapsed else 0:.0f} reg/s)"
+                )
+
+    # Histórico de exclusões (o backend de segmentos usa o mesmo deletion_history.json)
+    if not checkpoint["deletions_done"] and target.stores_deletion_file and _same_dir(target.data_dir, data_dir):
+        checkpoint["deletions_done"] = True
+    if not checkpoint["deletions_done"]:
+        history_file = os.path.join(data_dir, "deletion_history.json")
+        if os.path.exists(history_file):
+            with open(history_file, 'r') as f:
+                history = json.load(f)
+            target.log_deletions(history)
+            echo(f"Histórico de exclusões importado: {len(history)} registros")
+        checkpoint["deletions_done"] = True
+        save_checkpoint(checkpoint_path, checkpoint)
+
+    elapsed = time.monotonic() - started
+    stats = {
+        "cells": len(pending_cells),
+        "records": total_records,
+        "seconds": round(elapsed, 2),
+        "records_per_second": round(total_records / elapsed, 1) if elapsed else 0,
+    }
+    echo(
+        f"Importação concluída: {stats['records']} registros de {stats['cells']} células "
+        f"em {stats['seconds']}s ({stats['records_per_second']} reg/s)"
+    )
+    return stats
@@ -0,0 +1,369 @@
+"""Índices secundários em memória para os filtros da auditoria.
+
+A listagem da auditoria filtrava os setups comparando trechos de texto em
+todos os registros. Cada worker mantém agora, a partir do diário de
+alterações (journal.py), os índices:
+
+    data/hora -> lista ordenada das chaves de listagem (faixas de datas por bisect)
+    célula, ordem, abastecedor, auditor -> valor normalizado -> setups
+    trigramas -> valores normalizados (busca por trecho ou por início)
+    auditado -> setups auditados / não auditados
+    ID do setup -> (célula, file_identifier) (ver setup_ids.py)
+
+Os textos são normalizados com casefold e sem acentos ("joão" encontra
+"JOAO"). Uma consulta intersecta os conjuntos dos filtros, começando pelo
+menor (ou percorre a faixa de datas, se ela for menor), então só os setups
+que atendem aos filtros são visitados. As páginas da listagem são montadas
+com os resumos dos documentos indexados (journal.SetupDocument), sem ler
+os registros completos; o registro completo de um setup é carregado só ao
+abrir os detalhes (/api/setup/<setup_id>).
+
+No backend PostgreSQL o banco é compartilhado entre os hosts e o diário
+ficaria restrito a um deles, então as consultas vão direto ao banco.
+"""
+import bisect
+import logging
+import contextlib
+import threading
+
+from journal import COMPACT_MIN_DEAD_EVENTS, JournalVersionError, SetupDocument, setup_document
+from storage import SETUP_TEXT_FILTERS, decode_cursor, encode_cursor, fold, listing_key
+
+
+# Marcador de início do texto nos trigramas (permite buscar pelo começo do valor)
+START = "\x02"
+
+# Tipos de busca nos filtros de texto
+MATCH_CONTAINS = "contains"
+MATCH_PREFIX = "prefix"
+
+
+def trigrams(text):
+    """Trigramas de um texto normalizado (o primeiro começa com o marcador de início)."""
+    padded = START + text
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ValueIndex:
+    """Índice de um campo de texto: valor normalizado -> setups, e trigramas -> valores."""
+
+    def __init__(self, field):
+        self.field = field
+        self.postings = {}
+        self.grams = {}
+
+    def value_of(self, document):
+        return fold(document.get(self.field))
+
+    def add(self, key, document):
+        value = self.value_of(document)
+        keys = self.postings.get(value)
+        if keys is None:
+            keys = self.postings[value] = set()
+            for gram in trigrams(value):
+                self.grams.setdefault(gram, set()).add(value)
+        keys.add(key)
+
+    def remove(self, key, document):
+        value = self.value_of(document)
+        keys = self.postings.get(value)
+        if keys is None:
+            return
+        keys.discard(key)
+        if not keys:
+            del self.postings[value]
+            for gram in trigrams(value):
+                values = self.grams.get(gram)
+                if values is not None:
+                    values.discard(value)
+                    if not values:
+                        del self.grams[gram]
+
+    def values_matching(self, query, match=MATCH_CONTAINS):
+        """Valores normalizados que contêm (ou começam com) o trecho normalizado."""
+        if match == MATCH_PREFIX:
+            test = lambda value: value.startswith(query)  # noqa: E731
+            pattern = START + query
+        else:
+            test = lambda value: query in value  # noqa: E731
+            pattern = query
+
+        grams = [pattern[i:i + 3] for i in range(len(pattern) - 2)]
+        if not grams:
+            # Trecho curto demais para trigramas: percorre os valores distintos
+            return [value for value in self.postings if test(value)]
+
+        candidate_sets = []
+        for gram in grams:
+            values = self.grams.get(gram)
+            if not values:
+                return []
+            candidate_sets.append(values)
+        candidate_sets.sort(key=len)
+        candidates = candidate_sets[0].intersection(*candidate_sets[1:])
+        # Os trigramas podem estar fora de ordem no valor: confirma o trecho
+        return [value for value in candidates if test(value)]
+
+    def keys_matching(self, query, match=MATCH_CONTAINS):
+        """Setups cujo campo contém (ou começa com) o trecho."""
+        keys = set()
+        for value in self.values_matching(fold(query), match):
+            keys.update(self.postings[value])
+        return keys
+
+
+class SetupIndex:
+    """Projeção com os índices secundários da listagem de setups."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.timeline = []
+        self.fields = {name: ValueIndex(field) for name, field in SETUP_TEXT_FILTERS.items()}
+        self.audited = {True: set(), False: set()}
+
+    def add(self, key, document):
+        bisect.insort(self.timeline, listing_key(document))
+        for index in self.fields.values():
+            index.add(key, document)
+        self.audited[bool(document.get("audited"))].add(key)
+
+    def remove(self, key, document):
+        position = bisect.bisect_left(self.timeline, listing_key(document))
+        if position < len(self.timeline) and self.timeline[position] == listing_key(document):
+            del self.timeline[position]
+        for index in self.fields.values():
+            index.remove(key, document)
+        self.audited[bool(document.get("audited"))].discard(key)
+
+    def _date_range(self, filters):
+        # A data/hora é "AAAA-MM-DD_HH-MM-SS": a faixa de datas é uma faixa de prefixos
+        low = bisect.bisect_left(self.timeline, (filters["date_start"],)) if filters.get("date_start") else 0
+        high = (
+            bisect.bisect_left(self.timeline, (filters["date_end"] + "\uffff",))
+            if filters.get("date_end") else len(self.timeline)
+        )
+        return low, max(low, high)
+
+    def search(self, documents, filters, after=None, descending=True):
+        """Chaves de listagem dos setups que atendem aos filtros, na ordem da listagem.
+
+        Args:
+            documents: Documentos indexados ((célula, file_identifier) -> documento)
+            filters: Filtros (ver storage.setup_matches) e 'match' ('contains' ou 'prefix')
+            after: (Opcional) Chave de listagem do último setup da página anterior
+            descending: Mais recentes primeiro
+
+        Returns:
+            tuple: (chaves de listagem depois de 'after', total e auditados entre
+            todos os que atendem aos filtros)
+        """
+        match = filters.get("match") or MATCH_CONTAINS
+        sets = [
+            self.fields[name].keys_matching(filters[name], match)
+            for name in SETUP_TEXT_FILTERS if filters.get(name)
+        ]
+        if filters.get("audited") is not None:
+            sets.append(self.audited[bool(filters["audited"])])
+        sets.sort(key=len)
+        low, high = self._date_range(filters)
+
+        if not sets or high - low <= len(sets[0]):
+            # Faixa de datas menor que qualquer conjunto: percorre a faixa (já ordenada)
+            entries = [
+                entry for entry in self.timeline[low:high]
+                if all((entry[1], entry[2]) in keys for keys in sets)
+            ]
+        else:
+            # Conjunto mais seletivo: intersecta e confere a data de cada setup
+            date_start, date_end = filters.get("date_start"), filters.get("date_end")
+            entries = []
+            for key in sets[0].intersection(*sets[1:]):
+                document = documents[key]
+                setup_date = document["timestamp"][:10]
+                if (not date_start or setup_date >= date_start) and (not date_end or setup_date <= date_end):
+                    entries.append(listing_key(document))
+            entries.sort()
+
+        total = len(entries)
+        audited_keys = self.audited[True]
+        audited = sum(1 for entry in entries if (entry[1], entry[2]) in audited_keys)
+
+        if descending:
+            if after is not None:
+                entries = entries[:bisect.bisect_left(entries, after)]
+            entries.reverse()
+        elif after is not None:
+            entries = entries[bisect.bisect_right(entries, after):]
+        return entries, total, audited
+
+
+class SetupIdIndex:
+    """Projeção com o mapa ID do setup -> (célula, file_identifier)."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.locations = {}
+
+    def add(self, key, document):
+        if document.get("setup_id"):
+            self.locations[document["setup_id"]] = key
+
+    def remove(self, key, document):
+        if self.locations.get(document.get("setup_id")) == key:
+            del self.locations[document["setup_id"]]
+
+
+class SetupIndexes:
+    """Projeções em memória alimentadas pelo diário de alterações dos setups.
+
+    Antes de cada consulta, lê só as linhas novas do diário (um stat quando
+    nada mudou). Se o diário não existir, ele é construído a partir do
+    repositório; se tiver sido substituído (rebuild-indexes ou compactação
+    por outro worker), as projeções são recriadas. Quando as versões mortas
+    acumuladas no diário passam do limite, ele é compactado (ver
+    SetupJournal.compact).
+    """
+
+    def __init__(self, repository):
+        self.repository = repository
+        self.journal = repository.journal
+        self.documents = {}
+        self.projections = {}
+        self._lock = threading.RLock()
+        self._inode = None
+        self._offset = 0
+        # Eventos lidos do diário atual (desde a primeira linha), para medir as versões mortas
+        self._events = 0
+        self.register("setups", SetupIndex())
+        self.register("ids", SetupIdIndex())
+
+    @property
+    def enabled(self):
+        return self.repository.indexes_setups
+
+    def register(self, name, projection):
+        """Registra uma projeção (objeto com reset(), add(chave, doc) e remove(chave, doc))."""
+        with self._lock:
+            self.projections[name] = projection
+            for key, document in self.documents.items():
+                projection.add(key, document)
+
+    def get(self, name):
+        """Obtém uma projeção atualizada até a última linha do diário."""
+        self.refresh()
+        return self.projections[name]
+
+    @contextlib.contextmanager
+    def snapshot(self):
+        """Atualiza as projeções e as mantém travadas durante uma consulta.
+
+        Yields:
+            dict: Documentos indexados ((célula, file_identifier) -> documento)
+        """
+        self.refresh()
+        with self._lock:
+            yield self.documents
+
+    def rebuild(self):
+        """Reescreve o diário a partir do repositório (os workers recarregam as projeções)."""
+        count = self.journal.rebuild(self.repository.iter_setup_documents())
+        self.refresh()
+        return count
+
+    def _apply(self, event):
+        key = (event["cell"], event["id"])
+        previous = self.documents.pop(key, None)
+        if previous is not None:
+            for projection in self.projections.values():
+                projection.remove(key, previous)
+        if event["op"] == "put":
+            document = SetupDocument(event["doc"])
+            self.documents[key] = document
+            for projection in self.projections.values():
+                projection.add(key, document)
+
+    def _replay(self):
+        with self.journal.reader(self._inode, self._offset) as reader:
+            if reader.restarted:
+                self.documents = {}
+                self._events = 0
+                for projection in self.projections.values():
+                    projection.reset()
+            for event in reader.events():
+                self._apply(event)
+                self._events += 1
+            self._inode, self._offset = reader.inode, reader.offset
+
+    def _compact_if_needed(self):
+        dead = self._events - len(self.documents)
+        if dead < COMPACT_MIN_DEAD_EVENTS or dead * 2 < self._events:
+            return
+        identity = self.journal.compact(self._inode, self._offset, (
+            (cell_name, file_identifier, document.document())
+            for (cell_name, file_identifier), document in self.documents.items()
+        ))
+        if identity is not None:
+            self._inode, self._offset = identity
+            self._events = len(self.documents)
+
+    def refresh(self):
+        """Aplica as linhas novas do diário às projeções."""
+        identity = self.journal.identity()
+        if identity is not None and identity == (self._inode, self._offset):
+            return
+        with self._lock:
+            if identity is None:
+                self.journal.ensure(self.repository.iter_setup_documents)
+            try:
+                self._replay()
+            except JournalVersionError as e:
+                logging.info(f"Formato do diário de índices mudou ({e}); reconstruindo")
+                self.journal.rebuild(self.repository.iter_setup_documents())
+                self._inode, self._offset = None, 0
+                self._replay()
+            self._compact_if_needed()
+
+    def locate(self, setup_id):
+        """Localiza um setup pelo ID.
+
+        Returns:
+            tuple: (célula, file_identifier), ou None se o ID não existir
+        """
+        if not self.enabled:
+            return self.repository.locate_setup(setup_id)
+        with self.snapshot():
+            return self.projections["ids"].locations.get(setup_id)
+
+    def query_setups(self, filters=None, cursor=None, limit=50, descending=True):
+        """Mesma interface de SetupRepository.query_setups, mas com os resumos dos setups.
+
+        Os setups da página vêm no formato de SetupDocument.listing (sem
+        textos livres, itens e fotos); os detalhes são carregados à parte.
+
+        Raises:
+            ValueError: Se o cursor for inválido
+        """
+        if not self.enabled:
+            result = self.repository.query_setups(filters, cursor=cursor, limit=limit, descending=descending)
+            result["setups"] = [
+                SetupDocument(setup_document(setup["cell_name"], setup)).listing() for setup in result["setups"]
+            ]
+            return result
+
+        filters = filters or {}
+        after = decode_cursor(cursor) if cursor else None
+        result = {}
+        with self.snapshot() as documents:
+            keys, total, audited = self.projections["setups"].search(documents, filters, after, descending)
+            result["setups"] = [
+                documents[(cell_name, file_identifier)].listing() for _, cell_name, file_identifier in keys[:limit]
+            ]
+
+        if after is None:
+            result["total"], result["audited"] = total, audited
+        result["next_cursor"] = encode_cursor(keys[limit - 1]) if len(keys) > limit else None
+        return result
@@ -0,0 +1,335 @@
+"""Diário (journal) de alterações dos setups, base dos índices em memória.
+
+Cada gravação ou exclusão de setup, em qualquer backend, acrescenta uma
+linha JSON em dados_setup/_indexes/journal.jsonl:
+
+    {"op": "put", "cell": "<célula>", "id": "<file_identifier>", "doc": {...}}
+    {"op": "delete", "cell": "<célula>", "id": "<file_identifier>"}
+
+O "doc" é o documento do setup usado pelos índices (ver setup_document):
+os campos do resumo do manifesto, o nome da célula, a data da auditoria e
+os textos livres (observação, notas da auditoria, produto e itens) usados
+na busca.
+Como cada linha traz o estado completo do setup, reaplicar uma linha é
+inofensivo.
+
+Os workers mantêm projeções em memória (índices, contadores), com cada
+documento guardado como um SetupDocument compacto, e, antes de
+cada consulta, leem apenas as linhas acrescentadas desde a última leitura.
+A leitura é feita linha a linha, sem carregar o arquivo inteiro.
+As gravações no diário usam um flock, para que linhas de workers diferentes
+não se misturem. O diário pode ser reescrito a partir do repositório
+(`flask --app main rebuild-indexes`); os workers percebem a troca do arquivo
+(novo inode) e recarregam as projeções.
+
+Cada edição, auditoria ou foto processada acrescenta uma versão nova do
+setup, e as anteriores ficam mortas no arquivo. Quando as versões mortas
+passam de COMPACT_MIN_DEAD_EVENTS e da metade das linhas, o worker que
+acabou de ler o diário o reescreve com um 'put' por setup, a partir dos
+documentos que já tem em memória (ver compact), como a compactação dos
+pacotes em segments.py.
+
+A primeira linha do arquivo é um cabeçalho com a versão do formato do
+documento. Se a versão mudar, o diário é reconstruído automaticamente.
+"""
+import os
+import json
+import fcntl
+import shutil
+import logging
+import contextlib
+
+from manifest import setup_summary
+
+
+INDEX_DIR = "_indexes"
+JOURNAL_FILE = "journal.jsonl"
+JOURNAL_VERSION = 4
+
+# Compactação automática: versões mortas mínimas e proporção (metade das linhas)
+COMPACT_MIN_DEAD_EVENTS = 5000
+
+
+class JournalVersionError(Exception):
+    """O cabeçalho do diário tem outra versão do formato do documento."""
+
+
+def _selected_items_text(selected_items):
+    # Registros antigos podem ter a lista gravada como texto JSON
+    if isinstance(selected_items, str):
+        try:
+            selected_items = json.loads(selected_items)
+        except json.JSONDecodeError:
+            return selected_items
+    if not isinstance(selected_items, list):
+        return ""
+    return " ".join(
+        f"{item.get('code', '')} {item.get('name', '')}" if isinstance(item, dict) else str(item)
+        for item in selected_items
+    )
+
+
+def setup_texts(setup_data):
+    """Textos livres de um setup usados na busca (ver search.py)."""
+    return {
+        "observation": str(setup_data.get("observation") or ""),
+        "audit_notes": str(setup_data.get("audit_notes") or ""),
+        "product": f"{setup_data.get('product_code') or ''} {setup_data.get('product_name') or ''}".strip(),
+        "items": _selected_items_text(setup_data.get("selected_items")),
+    }
+
+
+def setup_document(cell_name, setup_data):
+    """Documento de um setup normalizado, como gravado no diário."""
+    document = setup_summary(setup_data)
+    document["cell_name"] = cell_name
+    document["audit_timestamp"] = setup_data.get("audit_timestamp") or ""
+    document["text"] = setup_texts(setup_data)
+    return document
+
+
+class SetupDocument:
+    """Documento de um setup em memória (registro compacto, com __slots__).
+
+    Os índices guardam um destes por setup, em vez do dict lido do diário.
+    Aceita o mesmo acesso de leitura de um dict (documento["campo"] e
+    documento.get("campo")), usado pelas projeções e por setup_matches.
+    """
+
+    __slots__ = (
+        "cell_name", "file_identifier", "setup_id", "order_number", "setup_type", "timestamp", "audited",
+        "auditor_name", "supplier_name", "audit_timestamp", "images", "text",
+    )
+    _FIELDS = frozenset(__slots__)
+
+    # Campos devolvidos nas listagens (ver listing)
+    LISTING_FIELDS = (
+        "setup_id", "cell_name", "file_identifier", "order_number", "setup_type", "timestamp", "audited",
+        "auditor_name", "supplier_name", "audit_timestamp",
+    )
+
+    def __init__(self, document):
+        self.cell_name = document.get("cell_name") or ""
+        self.file_identifier = document.get("file_identifier") or ""
+        self.setup_id = document.get("setup_id") or ""
+        self.order_number = document.get("order_number") or ""
+        self.setup_type = document.get("setup_type") or "supply"
+        self.timestamp = document.get("timestamp") or ""
+        self.audited = bool(document.get("audited"))
+        self.auditor_name = document.get("auditor_name") or ""
+        self.supplier_name = document.get("supplier_name") or ""
+        self.audit_timestamp = document.get("audit_timestamp") or ""
+        self.images = tuple(document.get("images") or ())
+        self.text = document.get("text") or {}
+
+    def __getitem__(self, name):
+        if name not in self._FIELDS:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def get(self, name, default=None):
+        return getattr(self, name) if name in self._FIELDS else default
+
+    def document(self):
+        """Documento no formato gravado no diário (ver setup_document)."""
+        result = {name: getattr(self, name) for name in self.__slots__}
+        result["images"] = list(self.images)
+        return result
+
+    def listing(self):
+        """Resumo do setup para as listagens (sem textos livres nem caminhos das fotos)."""
+        result = {name: getattr(self, name) for name in self.LISTING_FIELDS}
+        result["image_count"] = len(self.images)
+        return result
+
+
+class SetupJournal:
+    """Arquivo de alterações compartilhado pelos workers (somente acréscimos)."""
+
+    def __init__(self, data_dir):
+        self.index_dir = os.path.join(data_dir, INDEX_DIR)
+        self.path = os.path.join(self.index_dir, JOURNAL_FILE)
+
+    @contextlib.contextmanager
+    def lock(self):
+        """Trava exclusiva do diário (arquivo separado, pois o diário pode ser substituído)."""
+        os.makedirs(self.index_dir, exist_ok=True)
+        with open(os.path.join(self.index_dir, "journal.lock"), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def append(self, events):
+        """Acrescenta eventos ao diário.
+
+        Se o diário ainda não existe, nada é gravado: ele será construído a
+        partir do repositório na primeira consulta. A existência é verificada
+        com a trava, então uma gravação concorrente com a construção entra no
+        diário depois dela (e um 'put' repetido é inofensivo).
+        """
+        if not events:
+            return
+        lines = "".join(json.dumps(event, separators=(",", ":")) + "\n" for event in events)
+        try:
+            with self.lock():
+                if not self.exists():
+                    return
+                with open(self.path, 'a') as f:
+                    f.write(lines)
+        except OSError as e:
+            # O registro já foi gravado; o diário pode ser reconstruído depois
+            logging.error(f"Erro ao gravar no diário de índices: {e}")
+
+    def put(self, cell_name, file_identifier, setup_data):
+        """Registra a gravação de um setup normalizado."""
+        self.append([{"op": "put", "cell": cell_name, "id": file_identifier,
+                      "doc": setup_document(cell_name, setup_data)}])
+
+    def put_many(self, cell_name, setups):
+        """Registra a gravação de vários setups normalizados [(file_identifier, setup)]."""
+        self.append([{"op": "put", "cell": cell_name, "id": file_identifier,
+                      "doc": setup_document(cell_name, setup_data)} for file_identifier, setup_data in setups])
+
+    def delete(self, cell_name, file_identifier):
+        """Registra a exclusão de um setup."""
+        self.append([{"op": "delete", "cell": cell_name, "id": file_identifier}])
+
+    def _write_file(self, path, documents):
+        count = 0
+        with open(path, 'w') as f:
+            f.write(json.dumps({"version": JOURNAL_VERSION}) + "\n")
+            for cell_name, file_identifier, document in documents:
+                f.write(json.dumps({"op": "put", "cell": cell_name, "id": file_identifier, "doc": document},
+                                   separators=(",", ":")) + "\n")
+                count += 1
+        return count
+
+    def _write(self, documents):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        count = self._write_file(tmp_path, documents)
+        os.replace(tmp_path, self.path)
+        return count
+
+    def rebuild(self, documents):
+        """Reescreve o diário com o estado atual (um 'put' por setup).
+
+        Args:
+            documents: Iterável de tuplas (célula, file_identifier, documento)
+
+        Returns:
+            int: Quantidade de setups gravados
+        """
+        with self.lock():
+            return self._write(documents)
+
+    def ensure(self, documents):
+        """Constrói o diário se ele ainda não existir (outro worker pode tê-lo criado antes).
+
+        Args:
+            documents: Função sem argumentos que devolve o iterável de rebuild()
+        """
+        with self.lock():
+            if not self.exists():
+                count = self._write(documents())
+                logging.info(f"Diário de índices construído com {count} setups")
+
+    def identity(self):
+        """Inode e tamanho atuais do diário, ou None se ele não existir."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size
+
+    @contextlib.contextmanager
+    def reader(self, inode, offset):
+        """Abre o diário para ler os eventos acrescentados depois de offset.
+
+        Args:
+            inode: Inode do arquivo lido da última vez (None na primeira leitura)
+            offset: Posição até onde o arquivo já foi lido
+
+        Yields:
+            JournalReader: Leitor com inode, offset e restarted ('restarted'
+            indica que o arquivo foi substituído, ou é lido do início, e as
+            projeções precisam ser recriadas)
+        """
+        with open(self.path, 'rb') as f:
+            yield JournalReader(f, inode, offset)
+
+    def compact(self, inode, offset, documents):
+        """Reescreve o diário só com a versão atual de cada setup.
+
+        O arquivo novo é escrito sem a trava, a partir dos documentos que o
+        worker já tem em memória (o estado do diário até offset). Com a
+        trava, as linhas acrescentadas depois de offset são copiadas para o
+        fim dele antes da troca, então nenhuma gravação se perde.
+
+        Args:
+            inode: Inode do diário lido pelo worker
+            offset: Posição até onde o diário foi lido (estado dos documentos)
+            documents: Iterável de tuplas (célula, file_identifier, documento)
+
+        Returns:
+            tuple: (inode, offset) do diário novo correspondentes aos mesmos
+            documentos, ou None se o diário foi substituído por outro worker
+        """
+        tmp_path = f"{self.path}.{os.getpid()}.compact.tmp"
+        try:
+            count = self._write_file(tmp_path, documents)
+            with self.lock():
+                identity = self.identity()
+                if identity is None or identity[0] != inode:
+                    return None
+                with open(tmp_path, 'ab') as tmp_file:
+                    compacted_size = tmp_file.tell()
+                    with open(self.path, 'rb') as f:
+                        f.seek(offset)
+                        shutil.copyfileobj(f, tmp_file)
+                os.replace(tmp_path, self.path)
+                new_inode = os.stat(self.path).st_ino
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        logging.info(f"Diário de índices compactado: {count} setups")
+        return new_inode, compacted_size
+
+
+class JournalReader:
+    """Leitura linha a linha de um diário aberto (ver SetupJournal.reader)."""
+
+    def __init__(self, f, inode, offset):
+        self._file = f
+        self.inode = os.fstat(f.fileno()).st_ino
+        self.restarted = self.inode != inode
+        self.offset = 0 if self.restarted else offset
+
+    def events(self):
+        """Eventos acrescentados, na ordem; self.offset avança a cada linha lida.
+
+        Raises:
+            JournalVersionError: Se o cabeçalho tiver outra versão do formato
+        """
+        self._file.seek(self.offset)
+        for line in self._file:
+            # Somente linhas completas (um acréscimo pode estar em andamento)
+            if not line.endswith(b"\n"):
+                break
+            self.offset += len(line)
+            if not line.strip():
+                continue
+            try:
+                event = json.loads(line)
+            except json.JSONDecodeError as e:
+                logging.error(f"Linha inválida no diário de índices: {e}")
+                continue
+            if "version" in event and "op" not in event:
+                if event["version"] != JOURNAL_VERSION:
+                    raise JournalVersionError(f"Versão {event['version']} do diário (esperada {JOURNAL_VERSION})")
+                continue
+            yield event
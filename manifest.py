@@ -0,0 +1,253 @@
+"""Manifesto por célula dos setups gravados em arquivos.
+
+No backend de arquivos, descobrir os setups de uma célula exigia listar o
+diretório e abrir cada .txt. O manifesto guarda, num único arquivo por
+célula (dados_setup/_manifests/<célula>.json), um resumo compacto de cada
+setup:
+
+    file_identifier -> ID do setup, ordem, tipo, data/hora, auditado,
+                       auditor, abastecedor e caminhos das imagens
+
+Ele é atualizado a cada gravação ou exclusão de setup (sob um flock por
+célula, pois vários workers podem gravar na mesma célula) e gravado de forma
+atômica (arquivo temporário + rename).
+
+O manifesto também guarda o mtime do diretório da célula no momento da
+gravação. Se o diretório mudar por fora do sistema (ex.: pastas de OPs
+antigas excluídas manualmente), o manifesto é conciliado na próxima leitura:
+uma listagem do diretório, lendo apenas os .txt novos e descartando os que
+sumiram. Sem manifesto, ele é construído da mesma forma. Alterações feitas
+diretamente dentro de um .txt não mudam o diretório; para esses casos existe
+o comando `flask --app main rebuild-manifests`.
+
+Junto com o manifesto é gravado o status materializado da célula
+(<célula>.status.json: ordem mais recente, tipos registrados para ela e data
+do último setup de cada tipo e do último reset). A leitura do QR code
+consulta só esse arquivo pequeno, em tempo constante, qualquer que seja o
+histórico da célula.
+"""
+import os
+import json
+import fcntl
+import logging
+import contextlib
+
+
+MANIFEST_DIR = "_manifests"
+MANIFEST_VERSION = 2
+
+
+def cell_status_from_summaries(summaries, last_reset=None):
+    """Calcula o status de uma célula a partir dos resumos dos seus setups.
+
+    Returns:
+        dict: most_recent_order (maior número de ordem registrado), as flags
+        'removal' e 'supply' dos tipos já registrados para essa ordem, a data
+        do último setup de cada tipo (last_removal, last_supply) e do último
+        reset (last_reset)
+    """
+    status = {
+        "most_recent_order": None, "removal": False, "supply": False,
+        "last_removal": None, "last_supply": None, "last_reset": last_reset,
+    }
+    types_by_order = {}
+    for summary in summaries:
+        setup_type = summary["setup_type"]
+        last_key = f"last_{setup_type}"
+        if last_key in status and summary["timestamp"] and (status[last_key] or "") < summary["timestamp"]:
+            status[last_key] = summary["timestamp"]
+
+        order_number = summary["order_number"]
+        if not order_number:
+            continue
+        types_by_order.setdefault(order_number, set()).add(setup_type)
+        if status["most_recent_order"] is None or order_number > status["most_recent_order"]:
+            status["most_recent_order"] = order_number
+
+    latest_types = types_by_order.get(status["most_recent_order"], set())
+    status["removal"] = "removal" in latest_types
+    status["supply"] = "supply" in latest_types
+    return status
+
+
+def setup_summary(setup_data):
+    """Resumo compacto de um setup normalizado (entrada do manifesto)."""
+    return {
+        "file_identifier": setup_data.get("file_identifier"),
+        "setup_id": setup_data.get("setup_id") or "",
+        "order_number": str(setup_data.get("order_number", "")),
+        "setup_type": setup_data.get("setup_type", "supply"),
+        "timestamp": setup_data.get("timestamp", ""),
+        "audited": bool(setup_data.get("audited", False)),
+        "auditor_name": setup_data.get("auditor_name") or "",
+        "supplier_name": setup_data.get("supplier_name") or "",
+        "images": [image["path"] for image in setup_data.get("images", []) if image.get("path")],
+    }
+
+
+class CellManifests:
+    """Leitura, atualização incremental e reconstrução dos manifestos das células.
+
+    Args:
+        data_dir: Diretório raiz dos dados (dados_setup)
+        list_ids: Função (célula) -> file_identifiers dos .txt existentes
+        read_setup: Função (célula, file_identifier) -> setup normalizado, ou None
+    """
+
+    def __init__(self, data_dir, list_ids, read_setup):
+        self.data_dir = data_dir
+        self.manifest_dir = os.path.join(data_dir, MANIFEST_DIR)
+        self.list_ids = list_ids
+        self.read_setup = read_setup
+
+    def path(self, cell_name):
+        return os.path.join(self.manifest_dir, f"{cell_name}.json")
+
+    def status_path(self, cell_name):
+        return os.path.join(self.manifest_dir, f"{cell_name}.status.json")
+
+    @contextlib.contextmanager
+    def lock(self, cell_name):
+        """Trava exclusiva da célula, compartilhada entre os processos."""
+        os.makedirs(self.manifest_dir, exist_ok=True)
+        with open(os.path.join(self.manifest_dir, f"{cell_name}.lock"), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _dir_mtime(self, cell_name):
+        try:
+            return os.stat(os.path.join(self.data_dir, cell_name)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _read_json(self, path, cell_name):
+        try:
+            with open(path, 'r') as f:
+                document = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, json.JSONDecodeError) as e:
+            logging.error(f"Manifesto da célula {cell_name} inválido, reconstruindo: {e}")
+            return None
+        if document.get("version") != MANIFEST_VERSION:
+            return None
+        return document
+
+    def _read(self, cell_name):
+        """Lê o manifesto gravado, ou None se não existir ou for inválido."""
+        return self._read_json(self.path(cell_name), cell_name)
+
+    def _atomic_dump(self, path, document):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(document, f)
+        os.replace(tmp_path, path)
+
+    def _write(self, cell_name, setups, last_reset=None):
+        dir_mtime = self._dir_mtime(cell_name)
+        self._atomic_dump(self.path(cell_name), {
+            "version": MANIFEST_VERSION,
+            "cell_name": cell_name,
+            "dir_mtime_ns": dir_mtime,
+            "last_reset": last_reset,
+            "setups": setups,
+        })
+        self._atomic_dump(self.status_path(cell_name), {
+            "version": MANIFEST_VERSION,
+            "dir_mtime_ns": dir_mtime,
+            "status": cell_status_from_summaries(setups.values(), last_reset),
+        })
+
+    def _fresh(self, document, cell_name):
+        return document is not None and document.get("dir_mtime_ns") == self._dir_mtime(cell_name)
+
+    def _reconcile(self, cell_name, setups):
+        # Uma listagem do diretório: lê só os .txt novos e descarta os que sumiram
+        current_ids = set(self.list_ids(cell_name))
+        for file_identifier in set(setups) - current_ids:
+            del setups[file_identifier]
+        for file_identifier in current_ids - set(setups):
+            setup_data = self.read_setup(cell_name, file_identifier)
+            if setup_data is not None:
+                setups[file_identifier] = setup_summary(setup_data)
+        return setups
+
+    def _load_locked(self, cell_name):
+        """Lê o manifesto (com a trava da célula), conciliando-o se estiver desatualizado."""
+        manifest = self._read(cell_name)
+        if self._fresh(manifest, cell_name):
+            return manifest["setups"], manifest.get("last_reset"), False
+        setups = self._reconcile(cell_name, manifest["setups"] if manifest else {})
+        return setups, manifest.get("last_reset") if manifest else None, True
+
+    def load(self, cell_name):
+        """Obtém os resumos dos setups da célula (file_identifier -> resumo)."""
+        if self._dir_mtime(cell_name) is None:
+            return {}
+        manifest = self._read(cell_name)
+        if self._fresh(manifest, cell_name):
+            return manifest["setups"]
+
+        with self.lock(cell_name):
+            # Outro processo pode ter atualizado enquanto esperávamos a trava
+            setups, last_reset, changed = self._load_locked(cell_name)
+            if changed:
+                self._write(cell_name, setups, last_reset)
+        return setups
+
+    def status(self, cell_name):
+        """Obtém o status materializado da célula (ver cell_status_from_summaries)."""
+        if self._dir_mtime(cell_name) is None:
+            return cell_status_from_summaries([])
+        document = self._read_json(self.status_path(cell_name), cell_name)
+        if self._fresh(document, cell_name):
+            return document["status"]
+
+        with self.lock(cell_name):
+            setups, last_reset, _ = self._load_locked(cell_name)
+            self._write(cell_name, setups, last_reset)
+        return cell_status_from_summaries(setups.values(), last_reset)
+
+    def update(self, cell_name, file_identifier, setup_data=None):
+        """Atualiza (ou remove, se setup_data for None) a entrada de um setup.
+
+        Deve ser chamada depois que o .txt foi gravado ou excluído.
+        """
+        self.update_many(cell_name, [(file_identifier, setup_data)])
+
+    def update_many(self, cell_name, setups):
+        """Atualiza várias entradas da célula numa única gravação do manifesto.
+
+        Args:
+            cell_name: Nome da célula
+            setups: Lista de tuplas (file_identifier, setup normalizado ou None)
+        """
+        with self.lock(cell_name):
+            summaries, last_reset, _ = self._load_locked(cell_name)
+            for file_identifier, setup_data in setups:
+                if setup_data is None:
+                    summaries.pop(file_identifier, None)
+                else:
+                    summaries[file_identifier] = setup_summary(dict(setup_data, file_identifier=file_identifier))
+            self._write(cell_name, summaries, last_reset)
+
+    def record_reset(self, cell_name, reset_timestamp):
+        """Guarda a data do último reset da célula no status."""
+        with self.lock(cell_name):
+            setups, _, _ = self._load_locked(cell_name)
+            self._write(cell_name, setups, reset_timestamp)
+
+    def rebuild(self, cell_name):
+        """Reconstrói o manifesto da célula lendo todos os .txt.
+
+        Returns:
+            int: Quantidade de setups no manifesto
+        """
+        with self.lock(cell_name):
+            manifest = self._read(cell_name)
+            setups = self._reconcile(cell_name, {})
+            self._write(cell_name, setups, manifest.get("last_reset") if manifest else None)
+        return len(setups)
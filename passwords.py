@@ -0,0 +1,156 @@
+"""Hash e verificação de senhas fora da thread da requisição.
+
+O scrypt é propositalmente caro; quando um turno inteiro faz login nos tablets
+ao mesmo tempo, verificar as senhas dentro dos workers deixa as leituras de
+QR code na fila atrás dos logins. Por isso:
+
+- as verificações rodam num pool de processos limitado, com um limite de
+  verificações pendentes (acima dele o login responde "tente novamente" em
+  vez de acumular requisições);
+- os parâmetros do hash são configuráveis (PASSWORD_HASH_METHOD) e uma senha
+  gravada com parâmetros diferentes é refeita no próximo login bem-sucedido;
+- um login repetido do mesmo aparelho, com a mesma senha, dentro de poucos
+  minutos, é aceito sem calcular o hash de novo.
+
+Variáveis de ambiente:
+    PASSWORD_HASH_METHOD    Método do werkzeug (padrão: scrypt:32768:8:1)
+    PASSWORD_WORKERS        Processos de verificação por worker (0 = na própria thread)
+    PASSWORD_MAX_PENDING    Verificações simultâneas antes de recusar logins
+    PASSWORD_VERIFY_TIMEOUT Segundos de espera por uma verificação
+    PASSWORD_CACHE_TTL      Segundos em que um login verificado é lembrado (0 = desligado)
+"""
+import os
+import hmac
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+
+DEFAULT_HASH_METHOD = "scrypt:32768:8:1"
+CACHE_MAX_ENTRIES = 1024
+
+
+class LoginBusy(Exception):
+    """Muitas verificações de senha em andamento; o login deve ser tentado de novo."""
+
+
+def normalize_method(method):
+    """Completa o método com os parâmetros padrão do werkzeug (como fica gravado no hash)."""
+    name, *params = method.split(":")
+    if name == "scrypt":
+        defaults = ["32768", "8", "1"]
+    elif name == "pbkdf2":
+        defaults = ["sha256", str(DEFAULT_PBKDF2_ITERATIONS)]
+    else:
+        return method
+    return ":".join([name] + params + defaults[len(params):])
+
+
+def hash_method():
+    """Método de hash configurado (PASSWORD_HASH_METHOD)."""
+    return normalize_method(os.environ.get("PASSWORD_HASH_METHOD") or DEFAULT_HASH_METHOD)
+
+
+def hash_password(password):
+    """Gera o hash da senha com os parâmetros configurados."""
+    return generate_password_hash(password, method=hash_method())
+
+
+def needs_rehash(password_hash):
+    """Indica se o hash gravado usa parâmetros diferentes dos configurados."""
+    return normalize_method(password_hash.split("$", 1)[0]) != hash_method()
+
+
+class PasswordVerifier:
+    """Verificação de senhas num pool de processos limitado, com cache de logins recentes."""
+
+    def __init__(self, secret, workers=None, max_pending=None, timeout=None, cache_ttl=None):
+        self.secret = secret.encode() if isinstance(secret, str) else secret
+        default_workers = min(2, os.cpu_count() or 1)
+        self.workers = int(workers if workers is not None else os.environ.get("PASSWORD_WORKERS", default_workers))
+        self.max_pending = int(max_pending or os.environ.get("PASSWORD_MAX_PENDING", max(self.workers, 1) * 4))
+        self.timeout = float(timeout or os.environ.get("PASSWORD_VERIFY_TIMEOUT", 10))
+        self.cache_ttl = float(cache_ttl if cache_ttl is not None else os.environ.get("PASSWORD_CACHE_TTL", 300))
+        self._pending = threading.BoundedSemaphore(self.max_pending)
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+
+    def executor(self):
+        """Obtém o pool de processos do worker atual (criado no primeiro uso, após o fork)."""
+        if self._executor is not None and self._executor_pid == os.getpid():
+            return self._executor
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _run(self, function, *args):
+        # Limite de verificações simultâneas: acima dele, recusar em vez de enfileirar
+        if not self._pending.acquire(blocking=False):
+            raise LoginBusy("Muitas verificações de senha em andamento")
+        try:
+            if self.workers <= 0:
+                return function(*args)
+            try:
+                return self.executor().submit(function, *args).result(timeout=self.timeout)
+            except FutureTimeoutError:
+                raise LoginBusy("Tempo esgotado na verificação de senha")
+        finally:
+            self._pending.release()
+
+    def _cache_key(self, username, password_hash, password, device):
+        # O hash gravado faz parte da chave: trocar a senha invalida o cache
+        message = "\0".join([username, password_hash, password, device or ""]).encode()
+        return hmac.new(self.secret, message, hashlib.sha256).digest()
+
+    def verify(self, username, password_hash, password, device=None):
+        """Verifica a senha de um usuário.
+
+        Args:
+            username: Nome do usuário
+            password_hash: Hash gravado no cadastro
+            password: Senha informada
+            device: (Opcional) Identificação do aparelho (endereço e navegador)
+
+        Returns:
+            bool: True se a senha confere
+
+        Raises:
+            LoginBusy: Se o limite de verificações simultâneas foi atingido
+        """
+        key = self._cache_key(username, password_hash, password, device) if self.cache_ttl > 0 else None
+        if key is not None:
+            with self._lock:
+                expires = self._cache.get(key)
+                if expires is not None:
+                    if expires > time.monotonic():
+                        return True
+                    del self._cache[key]
+
+        verified = self._run(check_password_hash, password_hash, password)
+
+        if verified and key is not None:
+            with self._lock:
+                self._cache[key] = time.monotonic() + self.cache_ttl
+                self._cache.move_to_end(key)
+                while len(self._cache) > CACHE_MAX_ENTRIES:
+                    self._cache.popitem(last=False)
+        return verified
+
+    def hash(self, password):
+        """Gera o hash com os parâmetros configurados, no pool de processos."""
+        return self._run(hash_password, password)
+
+    def shutdown(self):
+        """Encerra o pool de processos do worker atual."""
+        if self._executor is not None and self._executor_pid == os.getpid():
+            self._executor.shutdown(wait=False)
+        self._executor = None
+        self._executor_pid = None
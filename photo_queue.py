@@ -0,0 +1,465 @@
+"""Fila de processamento das fotos dos setups.
+
+Converter as fotos (Pillow: decodificar, reduzir e gravar em JPEG) levava
+alguns segundos dentro do POST /setup, com o worker do gunicorn preso. Com a
+fila, a requisição só grava as fotos recebidas numa área de espera e cria o
+registro com photo_status "processing"; um pool de threads de cada worker
+faz a conversão depois e completa o registro.
+
+A fila é um banco SQLite local (dados_setup/_photo_queue/jobs.db, modo WAL),
+compartilhado pelos workers:
+
+    staged   -> fotos na área de espera, aguardando a gravação do registro
+    pending  -> aguardando (ou aguardando nova tentativa)
+    running  -> em processamento, com prazo (lease) para terminar
+    done     -> concluído; as fotos da área de espera são apagadas
+    failed   -> tentativas esgotadas
+
+Cada tarefa é reservada com um UPDATE condicional, então só um worker a
+processa. Se o worker cair no meio, a tarefa volta para a fila quando o
+prazo vence. Uma falha é tentada de novo com espera crescente, até
+PHOTO_MAX_ATTEMPTS tentativas.
+
+A tarefa é criada (staged) antes de o registro do setup ser gravado e só é
+liberada (pending) depois: se o worker cair entre as duas etapas, a tarefa
+não se perde. As threads da fila verificam, no máximo a cada
+MAINTENANCE_INTERVAL segundos, as tarefas staged há mais de LEASE_SECONDS:
+a tarefa é liberada se o registro do setup aponta para ela, ou apagada
+(com as fotos da área de espera) se o registro não chegou a ser gravado.
+
+As fotos de uma tarefa que falhou ficam na área de espera, para que ela
+possa voltar para a fila (`flask --app main requeue-photos`). Na mesma
+verificação, as tarefas concluídas ou com falha há mais de
+PHOTO_JOB_TTL_HOURS são apagadas do banco, junto com as fotos que restaram
+na área de espera (ver purge; também com `flask --app main gc-uploads`).
+
+As threads de cada worker são criadas depois do fork do gunicorn, quando o
+worker sobe (gunicorn.conf.py) ou no primeiro enfileiramento; nenhuma
+requisição sem fotos cria o banco ou as threads. Cada enfileiramento acorda
+uma delas; sem aviso, a fila é consultada a cada POLL_INTERVAL segundos.
+
+Variáveis de ambiente:
+    PHOTO_PROCESSING    "async" (padrão) ou "sync" (processar dentro da requisição)
+    PHOTO_WORKERS       Threads de processamento por worker (padrão 2)
+    PHOTO_MAX_ATTEMPTS  Tentativas antes de desistir de uma tarefa (padrão 3)
+    PHOTO_JOB_TTL_HOURS Horas até uma tarefa concluída ou com falha ser apagada (padrão 168)
+"""
+import os
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import logging
+import datetime
+import threading
+
+from photos import spool_photos
+
+
+QUEUE_DIR = "_photo_queue"
+
+STATUS_STAGED = "staged"
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+# Segundos para uma tarefa reservada terminar antes de voltar para a fila
+LEASE_SECONDS = 300
+# Espera antes da primeira nova tentativa (dobra a cada falha)
+RETRY_DELAY = 10
+POLL_INTERVAL = 5
+# Intervalo mínimo entre duas manutenções da fila (por worker)
+MAINTENANCE_INTERVAL = 600
+
+QUEUE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS photo_jobs (
+    id TEXT PRIMARY KEY,
+    cell_name TEXT NOT NULL,
+    file_identifier TEXT NOT NULL,
+    setup_id TEXT NOT NULL DEFAULT '',
+    photos TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT NOT NULL DEFAULT '',
+    available_at REAL NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_photo_jobs_available ON photo_jobs (status, available_at);
+CREATE INDEX IF NOT EXISTS idx_photo_jobs_setup ON photo_jobs (cell_name, file_identifier);
+"""
+
+
+def async_photos_enabled():
+    """Indica se as fotos são processadas pela fila (PHOTO_PROCESSING)."""
+    return os.environ.get("PHOTO_PROCESSING", "async").lower() != "sync"
+
+
+def _photo_number(name):
+    # Ordem das fotos na área de espera (photo_<n>.raw)
+    number = name[len("photo_"):-len(".raw")]
+    return int(number) if number.isdigit() else 0
+
+
+def _now():
+    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+class PhotoQueue:
+    """Fila persistente de tarefas de fotos, com pool de threads por worker.
+
+    Args:
+        data_dir: Diretório raiz dos dados (dados_setup)
+        process: Função (tarefa) que processa as fotos; uma exceção conta como falha
+        on_failure: (Opcional) Função (tarefa, erro) chamada quando as tentativas se esgotam
+        is_registered: (Opcional) Função (tarefa) -> bool que indica se o registro do
+            setup aponta para a tarefa (usada para liberar tarefas staged esquecidas)
+        workers: (Opcional) Threads por worker (padrão: PHOTO_WORKERS ou 2)
+        max_attempts: (Opcional) Tentativas por tarefa (padrão: PHOTO_MAX_ATTEMPTS ou 3)
+        job_ttl: (Opcional) Segundos até uma tarefa concluída ou com falha ser
+            apagada (padrão: PHOTO_JOB_TTL_HOURS ou 7 dias)
+    """
+
+    def __init__(self, data_dir, process, on_failure=None, workers=None, max_attempts=None, is_registered=None,
+                 job_ttl=None):
+        self.queue_dir = os.path.join(data_dir, QUEUE_DIR)
+        self.staging_dir = os.path.join(self.queue_dir, "staging")
+        self.db_path = os.path.join(self.queue_dir, "jobs.db")
+        self.process = process
+        self.on_failure = on_failure
+        self.is_registered = is_registered
+        self.workers = int(workers if workers is not None else os.environ.get("PHOTO_WORKERS", 2))
+        self.max_attempts = int(max_attempts or os.environ.get("PHOTO_MAX_ATTEMPTS", 3))
+        self.job_ttl = job_ttl if job_ttl is not None else float(os.environ.get("PHOTO_JOB_TTL_HOURS", 168)) * 3600
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._threads = []
+        self._threads_pid = None
+        self._last_maintenance = 0
+
+    def connection(self):
+        """Obtém a conexão da thread atual, criando o esquema se necessário."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        os.makedirs(self.queue_dir, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(QUEUE_SCHEMA)
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    # Enfileiramento
+
+    def new_job_id(self):
+        return uuid.uuid4().hex
+
+    def job_dir(self, job_id):
+        """Área de espera das fotos recebidas de uma tarefa."""
+        return os.path.join(self.staging_dir, job_id)
+
+    def stage(self, job_id, photos):
+        """Grava as fotos recebidas (bytes ou arquivos enviados) na área de espera da tarefa.
+
+        Returns:
+            list: Caminhos gravados, na ordem das fotos (None para uma foto inválida)
+        """
+        return spool_photos(self.job_dir(job_id), photos)
+
+    def unstage(self, job_id, photos, paths=None):
+        """Desfaz stage de uma tarefa que não chegou a ser registrada.
+
+        As fotos que vieram da área de envios (caminhos, ver uploads.py)
+        voltam para o lugar de origem; a área de espera da tarefa é apagada.
+
+        Args:
+            job_id: ID da tarefa
+            photos: Fotos passadas para stage
+            paths: (Opcional) Caminhos devolvidos por stage; sem eles (stage
+                falhou no meio), os arquivos que chegaram a ser gravados
+        """
+        if paths is None:
+            paths = [os.path.join(self.job_dir(job_id), f"photo_{index + 1}.raw") for index in range(len(photos))]
+            paths = [path if os.path.exists(path) else None for path in paths]
+        for photo, path in zip(photos, paths):
+            if isinstance(photo, str) and path is not None:
+                try:
+                    shutil.move(path, photo)
+                except OSError as e:
+                    logging.error(f"Erro ao devolver a foto {path} para a área de envios: {e}")
+        shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+
+    def reserve(self, job_id, cell_name, file_identifier, setup_id, paths):
+        """Cria a tarefa das fotos já gravadas na área de espera, ainda sem liberá-la (staged).
+
+        Chamada antes de gravar o registro do setup; depois da gravação, a
+        tarefa é liberada com activate (ou apagada com discard, se ela falhar).
+        """
+        now = _now()
+        self.connection().execute(
+            "INSERT INTO photo_jobs (id, cell_name, file_identifier, setup_id, photos, status, "
+            "available_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, cell_name, file_identifier, setup_id or "", json.dumps(paths), STATUS_STAGED,
+             time.time(), now, now)
+        )
+
+    def activate(self, job_id):
+        """Libera uma tarefa staged para processamento e acorda um worker."""
+        self.connection().execute(
+            "UPDATE photo_jobs SET status = ?, available_at = ?, updated_at = ? WHERE id = ? AND status = ?",
+            (STATUS_PENDING, time.time(), _now(), job_id, STATUS_STAGED)
+        )
+        self.start()
+        self._wakeup.set()
+
+    def discard(self, job_id):
+        """Apaga uma tarefa staged cujo registro não foi gravado (as fotos ficam com unstage)."""
+        self.connection().execute("DELETE FROM photo_jobs WHERE id = ? AND status = ?", (job_id, STATUS_STAGED))
+
+    def enqueue(self, job_id, cell_name, file_identifier, setup_id, paths):
+        """Registra e libera a tarefa das fotos já gravadas na área de espera."""
+        self.reserve(job_id, cell_name, file_identifier, setup_id, paths)
+        self.activate(job_id)
+
+    def staged_paths(self, job_id):
+        """Fotos de uma tarefa que ainda estão na área de espera, na ordem (photo_1.raw, ...)."""
+        try:
+            names = [name for name in os.listdir(self.job_dir(job_id)) if name.endswith(".raw")]
+        except FileNotFoundError:
+            return []
+        names.sort(key=_photo_number)
+        return [os.path.join(self.job_dir(job_id), name) for name in names]
+
+    # Consulta
+
+    def _job(self, row):
+        job = dict(row)
+        job["photos"] = json.loads(job["photos"])
+        return job
+
+    def get(self, job_id):
+        """Obtém uma tarefa (dict com status, tentativas e último erro), ou None."""
+        row = self.connection().execute("SELECT * FROM photo_jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job(row) if row is not None else None
+
+    def counts(self):
+        """Quantidade de tarefas por status."""
+        rows = self.connection().execute("SELECT status, COUNT(*) AS count FROM photo_jobs GROUP BY status")
+        return {row["status"]: row["count"] for row in rows}
+
+    def failed_jobs(self):
+        """Tarefas com falha cujas fotos ainda estão na área de espera (podem voltar para a fila)."""
+        rows = self.connection().execute(
+            "SELECT * FROM photo_jobs WHERE status = ? ORDER BY updated_at", (STATUS_FAILED,)
+        ).fetchall()
+        jobs = [self._job(row) for row in rows]
+        return [
+            job for job in jobs
+            if any(job["photos"]) and all(path is None or os.path.exists(path) for path in job["photos"])
+        ]
+
+    # Processamento
+
+    def claim(self):
+        """Reserva a próxima tarefa disponível (ou com prazo vencido).
+
+        Returns:
+            dict: A tarefa reservada, ou None se a fila estiver vazia
+        """
+        conn = self.connection()
+        now = time.time()
+        while True:
+            row = conn.execute(
+                "SELECT * FROM photo_jobs WHERE status IN (?, ?) AND available_at <= ? "
+                "ORDER BY available_at LIMIT 1",
+                (STATUS_PENDING, STATUS_RUNNING, now)
+            ).fetchone()
+            if row is None:
+                return None
+            # Reserva condicional: se outro worker pegou a tarefa antes, tentar a próxima
+            claimed = conn.execute(
+                "UPDATE photo_jobs SET status = ?, attempts = attempts + 1, available_at = ?, updated_at = ? "
+                "WHERE id = ? AND status = ? AND available_at = ?",
+                (STATUS_RUNNING, now + LEASE_SECONDS, _now(), row["id"], row["status"], row["available_at"])
+            ).rowcount
+            if claimed:
+                job = self._job(row)
+                job["attempts"] += 1
+                return job
+
+    def _finish(self, job):
+        self.connection().execute(
+            "UPDATE photo_jobs SET status = ?, last_error = '', updated_at = ? WHERE id = ?",
+            (STATUS_DONE, _now(), job["id"])
+        )
+        shutil.rmtree(self.job_dir(job["id"]), ignore_errors=True)
+
+    def _retry_or_fail(self, job, error):
+        if job["attempts"] < self.max_attempts:
+            delay = RETRY_DELAY * 2 ** (job["attempts"] - 1)
+            self.connection().execute(
+                "UPDATE photo_jobs SET status = ?, last_error = ?, available_at = ?, updated_at = ? WHERE id = ?",
+                (STATUS_PENDING, str(error), time.time() + delay, _now(), job["id"])
+            )
+            logging.warning(f"Fotos do setup {job['file_identifier']}: tentativa {job['attempts']} falhou ({error}); "
+                            f"nova tentativa em {delay}s")
+            return
+        self.connection().execute(
+            "UPDATE photo_jobs SET status = ?, last_error = ?, updated_at = ? WHERE id = ?",
+            (STATUS_FAILED, str(error), _now(), job["id"])
+        )
+        logging.error(f"Fotos do setup {job['file_identifier']}: tentativas esgotadas ({error})")
+        if self.on_failure is not None:
+            try:
+                self.on_failure(job, error)
+            except Exception as e:
+                logging.error(f"Erro ao registrar a falha das fotos do setup {job['file_identifier']}: {e}")
+
+    def run_once(self):
+        """Processa a próxima tarefa disponível.
+
+        Returns:
+            bool: True se havia uma tarefa
+        """
+        job = self.claim()
+        if job is None:
+            return False
+        try:
+            self.process(job)
+        except Exception as e:
+            self._retry_or_fail(job, e)
+        else:
+            self._finish(job)
+        return True
+
+    # Manutenção
+
+    def recover_staged(self, older_than=LEASE_SECONDS):
+        """Resolve as tarefas staged há mais de older_than segundos.
+
+        A tarefa é liberada se o registro do setup aponta para ela
+        (is_registered); senão, o registro não foi gravado e a tarefa é
+        apagada junto com as fotos da área de espera.
+
+        Returns:
+            tuple: (tarefas liberadas, tarefas apagadas)
+        """
+        conn = self.connection()
+        rows = conn.execute(
+            "SELECT * FROM photo_jobs WHERE status = ? AND available_at <= ?",
+            (STATUS_STAGED, time.time() - older_than)
+        ).fetchall()
+        activated = removed = 0
+        for row in rows:
+            job = self._job(row)
+            if self.is_registered is not None and self.is_registered(job):
+                self.activate(job["id"])
+                activated += 1
+            else:
+                self.discard(job["id"])
+                shutil.rmtree(self.job_dir(job["id"]), ignore_errors=True)
+                removed += 1
+        if activated or removed:
+            logging.info(f"Tarefas de fotos esquecidas: {activated} liberadas, {removed} apagadas")
+        return activated, removed
+
+    def retry(self, job_id):
+        """Devolve uma tarefa com falha para a fila, com as tentativas zeradas.
+
+        Returns:
+            bool: True se a tarefa estava com falha
+        """
+        retried = self.connection().execute(
+            "UPDATE photo_jobs SET status = ?, attempts = 0, last_error = '', available_at = ?, updated_at = ? "
+            "WHERE id = ? AND status = ?",
+            (STATUS_PENDING, time.time(), _now(), job_id, STATUS_FAILED)
+        ).rowcount
+        self._wakeup.set()
+        return bool(retried)
+
+    def purge(self, now=None):
+        """Apaga as tarefas concluídas ou com falha há mais de job_ttl segundos.
+
+        As fotos que restaram na área de espera dessas tarefas (tarefas com
+        falha) também são apagadas, assim como pastas da área de espera sem
+        tarefa no banco e sem alteração no mesmo prazo.
+
+        Returns:
+            int: Quantidade de tarefas apagadas
+        """
+        now = now if now is not None else time.time()
+        cutoff = datetime.datetime.fromtimestamp(now - self.job_ttl).strftime("%Y-%m-%d %H:%M:%S")
+        conn = self.connection()
+        rows = conn.execute(
+            "SELECT id FROM photo_jobs WHERE status IN (?, ?) AND updated_at < ?",
+            (STATUS_DONE, STATUS_FAILED, cutoff)
+        ).fetchall()
+        removed = 0
+        for row in rows:
+            removed += conn.execute(
+                "DELETE FROM photo_jobs WHERE id = ? AND status IN (?, ?)", (row["id"], STATUS_DONE, STATUS_FAILED)
+            ).rowcount
+            shutil.rmtree(self.job_dir(row["id"]), ignore_errors=True)
+
+        try:
+            entries = list(os.scandir(self.staging_dir))
+        except FileNotFoundError:
+            entries = []
+        for entry in entries:
+            try:
+                expired = entry.is_dir() and now - entry.stat().st_mtime > self.job_ttl
+            except FileNotFoundError:
+                continue
+            if expired and conn.execute("SELECT 1 FROM photo_jobs WHERE id = ?", (entry.name,)).fetchone() is None:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        if removed:
+            logging.info(f"Tarefas de fotos antigas apagadas: {removed}")
+        return removed
+
+    def maybe_maintain(self):
+        """Roda a manutenção se a última deste worker foi há mais de MAINTENANCE_INTERVAL segundos."""
+        now = time.time()
+        if now - self._last_maintenance < MAINTENANCE_INTERVAL:
+            return
+        with self._lock:
+            if now - self._last_maintenance < MAINTENANCE_INTERVAL:
+                return
+            self._last_maintenance = now
+        try:
+            self.recover_staged()
+            self.purge(now)
+        except Exception as e:
+            logging.error(f"Erro na manutenção da fila de fotos: {e}")
+
+    def _worker(self):
+        while True:
+            try:
+                while self.run_once():
+                    pass
+            except Exception as e:
+                logging.error(f"Erro na fila de fotos: {e}")
+            self.maybe_maintain()
+            self._wakeup.wait(POLL_INTERVAL)
+            self._wakeup.clear()
+
+    def start(self):
+        """Cria as threads de processamento do worker atual (uma vez, após o fork)."""
+        if self.workers <= 0 or self._threads_pid == os.getpid():
+            return
+        with self._lock:
+            if self._threads_pid == os.getpid():
+                return
+            self._threads = [
+                threading.Thread(target=self._worker, name=f"photo-queue-{index + 1}", daemon=True)
+                for index in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+            self._threads_pid = os.getpid()
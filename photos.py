@@ -0,0 +1,433 @@
+"""Processamento das fotos dos setups.
+
+As fotos chegam do celular como arquivos de um formulário
+multipart/form-data (campo "photos") ou, nos clientes antigos, como data URLs
+em base64 (campo "photo_data"). Os arquivos são gravados em disco em blocos
+(spool_photo), sem passar a foto inteira pela memória, e convertidos a
+partir do arquivo gravado. As fotos também podem chegar antes do formulário,
+pela área de envios (ver uploads.py). Cada foto é convertida para RGB,
+reduzida e gravada em dados_setup/<célula>/<file_identifier>/ segundo a
+política de imagens da célula e do tipo de setup (ver image_policy.py; o
+padrão é JPEG qualidade 85 até 1200x1200).
+
+Um JPEG de câmera (12 MP) é decodificado já reduzido (draft: escala 1/2, 1/4
+ou 1/8 do DCT), sem montar a imagem inteira na memória, e a orientação do
+EXIF é aplicada uma vez, na imagem pequena. Um JPEG baseline que já cabe
+nas dimensões, na qualidade e no tamanho da política, sem rotação (o que o
+formulário envia depois de comprimir no celular), é gravado como chegou,
+sem nova codificação.
+
+As fotos de um setup são convertidas em paralelo (PhotoEncoder): o Pillow
+libera o GIL na maior parte da decodificação, do redimensionamento e da
+codificação, então um pool de threads já usa vários núcleos; um pool de
+processos também pode ser usado. O tamanho do pool limita as conversões
+simultâneas de cada worker, qualquer que seja o número de requisições ou de
+threads da fila de fotos.
+
+O Pillow só é carregado quando há fotos para processar.
+
+Variáveis de ambiente:
+    PHOTO_ENCODER           "thread" (padrão) ou "process"
+    PHOTO_ENCODE_WORKERS    Conversões simultâneas por worker (padrão: núcleos, até 4; 1 = em sequência)
+"""
+import os
+import base64
+import shutil
+import binascii
+import logging
+import threading
+from io import BytesIO
+from concurrent.futures import BrokenExecutor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+from werkzeug.datastructures import FileStorage
+
+from image_policy import DEFAULT_POLICY, FORMAT_JPEG, FORMAT_WEBP
+
+
+# Política padrão (ver image_policy.py)
+MAX_PHOTO_SIZE = DEFAULT_POLICY.max_size
+JPEG_QUALITY = DEFAULT_POLICY.quality
+
+# Tabela de quantização de luminância padrão do JPEG (qualidade 50), usada
+# para estimar a qualidade de um JPEG recebido
+STANDARD_LUMINANCE_TABLE = (
+    16, 11, 10, 16, 24, 40, 51, 61, 12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56, 14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77, 24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101, 72, 92, 95, 98, 112, 100, 103, 99,
+)
+
+# Tag EXIF da orientação e a transposição que a desfaz
+EXIF_ORIENTATION = 0x0112
+ORIENTATION_TRANSPOSE = {
+    2: "FLIP_LEFT_RIGHT",
+    3: "ROTATE_180",
+    4: "FLIP_TOP_BOTTOM",
+    5: "TRANSPOSE",
+    6: "ROTATE_270",
+    7: "TRANSVERSE",
+    8: "ROTATE_90",
+}
+
+# Blocos da cópia de uma foto enviada como arquivo para o disco
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+ENCODER_THREADS = "thread"
+ENCODER_PROCESSES = "process"
+
+
+def photo_list(photo_data):
+    """Lista de fotos recebida (uma string única no formato antigo ou uma lista)."""
+    if isinstance(photo_data, str):
+        return [photo_data] if photo_data else []
+    if isinstance(photo_data, list):
+        return photo_data
+    return []
+
+
+def decode_photo(photo_base64):
+    """Decodifica uma foto em base64 (com ou sem o cabeçalho da data URL).
+
+    Returns:
+        bytes, ou None se os dados forem inválidos
+    """
+    if not isinstance(photo_base64, str):
+        return None
+    # Remover o cabeçalho "data:image/jpeg;base64," se estiver presente
+    if ',' in photo_base64:
+        photo_base64 = photo_base64.split(',', 1)[1]
+    try:
+        photo_bytes = base64.b64decode(photo_base64)
+    except (binascii.Error, ValueError) as e:
+        logging.error(f"Foto com base64 inválido: {e}")
+        return None
+    return photo_bytes or None
+
+
+def spool_photo(photo, path):
+    """Grava uma foto recebida em disco.
+
+    Um arquivo do multipart/form-data é copiado em blocos de
+    UPLOAD_CHUNK_SIZE (o Werkzeug já guarda os arquivos grandes num arquivo
+    temporário enquanto lê a requisição). Uma foto já recebida pela área de
+    envios (ver uploads.py) é movida (sem cópia, no mesmo sistema de arquivos).
+
+    Args:
+        photo: Bytes decodificados do base64, arquivo enviado (FileStorage),
+            caminho de uma foto já recebida ou None
+        path: Caminho do arquivo a gravar
+
+    Returns:
+        str: path, ou None se não havia foto
+    """
+    if photo is None:
+        return None
+    if isinstance(photo, FileStorage):
+        photo.save(path, buffer_size=UPLOAD_CHUNK_SIZE)
+    elif isinstance(photo, str):
+        # Renomeia no mesmo sistema de arquivos; senão, copia e apaga a origem
+        shutil.move(photo, path)
+    else:
+        with open(path, 'wb') as f:
+            f.write(photo)
+    return path
+
+
+def spool_photos(directory, photos):
+    """Grava as fotos recebidas em directory (photo_1.raw, photo_2.raw, ...).
+
+    Returns:
+        list: Caminhos gravados, na ordem das fotos (None para uma foto inválida)
+    """
+    os.makedirs(directory, exist_ok=True)
+    return [
+        spool_photo(photo, os.path.join(directory, f"photo_{index + 1}.raw"))
+        for index, photo in enumerate(photos)
+    ]
+
+
+def jpeg_quality(img):
+    """Estima a qualidade (1 a 100, escala do libjpeg) de um JPEG aberto.
+
+    Compara a tabela de quantização de luminância com a tabela padrão.
+
+    Returns:
+        int, ou None se a imagem não for JPEG
+    """
+    tables = getattr(img, "quantization", None)
+    if img.format != "JPEG" or not tables or 0 not in tables:
+        return None
+    scale = sum(tables[0]) * 100 / sum(STANDARD_LUMINANCE_TABLE)
+    quality = (200 - scale) / 2 if scale <= 100 else 5000 / scale
+    return max(1, min(100, round(quality)))
+
+
+def _orientation(img):
+    try:
+        return img.getexif().get(EXIF_ORIENTATION, 1)
+    except Exception:
+        # EXIF corrompido: a foto é usada como está
+        return 1
+
+
+def _is_compliant_jpeg(img, orientation, source_bytes, policy):
+    """Indica se a foto recebida já pode ser gravada sem nova codificação."""
+    if policy.format != FORMAT_JPEG or img.format != "JPEG" or img.mode != "RGB" or orientation not in (None, 1):
+        return False
+    if img.info.get("progressive") or img.info.get("progression"):
+        return False
+    if policy.max_bytes is not None and source_bytes > policy.max_bytes:
+        return False
+    width, height = img.size
+    if width > policy.max_width or height > policy.max_height:
+        return False
+    quality = jpeg_quality(img)
+    return quality is not None and quality <= policy.quality
+
+
+def _source_size(source):
+    if isinstance(source, bytes):
+        return len(source)
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    source.seek(0, os.SEEK_END)
+    size = source.tell()
+    source.seek(0)
+    return size
+
+
+def _store_original(source, photo_path):
+    if isinstance(source, bytes):
+        with open(photo_path, 'wb') as f:
+            f.write(source)
+    elif isinstance(source, (str, os.PathLike)):
+        shutil.copyfile(source, photo_path)
+    else:
+        source.seek(0)
+        with open(photo_path, 'wb') as f:
+            shutil.copyfileobj(source, f, UPLOAD_CHUNK_SIZE)
+
+
+def _encode(img, image_format, quality):
+    buffer = BytesIO()
+    if image_format == FORMAT_WEBP:
+        img.save(buffer, format='WEBP', quality=quality, method=4)
+    else:
+        img.save(buffer, format='JPEG', optimize=True, quality=quality)
+    return buffer.getvalue()
+
+
+def encode_to_budget(img, policy):
+    """Codifica a imagem na maior qualidade cujo arquivo cabe em policy.max_bytes.
+
+    Sem limite de bytes, ou se a qualidade máxima já cabe, a imagem é
+    codificada uma vez; senão, a qualidade é buscada entre min_quality e
+    quality (busca binária, poucas codificações). Se nem min_quality couber,
+    fica com min_quality.
+
+    Returns:
+        tuple: (bytes codificados, qualidade usada)
+    """
+    encoded = _encode(img, policy.format, policy.quality)
+    if policy.max_bytes is None or len(encoded) <= policy.max_bytes:
+        return encoded, policy.quality
+
+    encodings = {}
+    best = None
+    low, high = policy.min_quality, policy.quality - 1
+    while low <= high:
+        quality = (low + high) // 2
+        encodings[quality] = _encode(img, policy.format, quality)
+        if len(encodings[quality]) <= policy.max_bytes:
+            best = quality
+            low = quality + 1
+        else:
+            high = quality - 1
+    if best is None:
+        best = policy.min_quality
+        if best not in encodings:
+            encodings[best] = _encode(img, policy.format, best)
+    return encodings[best], best
+
+
+def encode_photo(source, photo_path, policy=None):
+    """Converte uma foto para o formato gravado, segundo a política de imagens.
+
+    Args:
+        source: Bytes da foto, caminho do arquivo recebido ou arquivo aberto
+        photo_path: Caminho da imagem a gravar
+        policy: (Opcional) ImagePolicy (padrão: RGB, até 1200x1200, JPEG qualidade 85)
+
+    Returns:
+        dict: Dados da imagem gravada para o registro (format, width, height,
+        bytes, quality, original_bytes, ratio e reencoded)
+    """
+    from PIL import Image
+
+    policy = policy or DEFAULT_POLICY
+    source_bytes = _source_size(source)
+    with Image.open(BytesIO(source) if isinstance(source, bytes) else source) as img:
+        orientation = _orientation(img)
+        if _is_compliant_jpeg(img, orientation, source_bytes, policy):
+            # Copiado antes de fechar a imagem (o Pillow fecha o arquivo recebido junto)
+            _store_original(source, photo_path)
+            width, height = img.size
+            encoded_bytes, quality, reencoded = source_bytes, jpeg_quality(img), False
+        else:
+            # Com rotação de 90°, a caixa máxima vale para a imagem já girada
+            max_size = policy.max_size[::-1] if orientation in (5, 6, 7, 8) else policy.max_size
+            if img.format == "JPEG":
+                # Decodificar na menor escala do DCT que ainda cobre a caixa máxima
+                img.draft("RGB", max_size)
+            # Converter para RGB se estiver em modo P (palette) ou outros modos
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            # Redimensionar se a imagem for muito grande
+            img.thumbnail(max_size, Image.LANCZOS)
+            # Orientação do EXIF aplicada uma vez, na imagem já reduzida (o arquivo gravado não leva o EXIF)
+            if orientation in ORIENTATION_TRANSPOSE:
+                img = img.transpose(getattr(Image.Transpose, ORIENTATION_TRANSPOSE[orientation]))
+            encoded, quality = encode_to_budget(img, policy)
+            with open(photo_path, 'wb') as f:
+                f.write(encoded)
+            width, height = img.size
+            encoded_bytes, reencoded = len(encoded), True
+    return {
+        "format": policy.format,
+        "width": width,
+        "height": height,
+        "bytes": encoded_bytes,
+        "quality": quality,
+        "original_bytes": source_bytes,
+        "ratio": round(encoded_bytes / source_bytes, 4) if source_bytes else None,
+        "reencoded": reencoded,
+    }
+
+
+def images_ratio(images):
+    """Razão entre os bytes gravados e os recebidos das imagens de um setup.
+
+    Returns:
+        float, ou None se as imagens não têm esses dados (registros antigos)
+    """
+    measured = [image for image in images if image.get("original_bytes")]
+    if not measured:
+        return None
+    return round(sum(image["bytes"] for image in measured) / sum(image["original_bytes"] for image in measured), 4)
+
+
+class PhotoEncoder:
+    """Pool de conversão de fotos do worker (threads ou processos).
+
+    Args:
+        workers: (Opcional) Conversões simultâneas (padrão: PHOTO_ENCODE_WORKERS)
+        kind: (Opcional) "thread" ou "process" (padrão: PHOTO_ENCODER)
+    """
+
+    def __init__(self, workers=None, kind=None):
+        default_workers = min(4, os.cpu_count() or 1)
+        self.workers = int(workers if workers is not None else os.environ.get("PHOTO_ENCODE_WORKERS", default_workers))
+        self.kind = (kind or os.environ.get("PHOTO_ENCODER") or ENCODER_THREADS).lower()
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+
+    def executor(self):
+        """Obtém o pool do worker atual (criado no primeiro uso, após o fork)."""
+        if self._executor is not None and self._executor_pid == os.getpid():
+            return self._executor
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                if self.kind == ENCODER_PROCESSES:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="photo-encode")
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def submit(self, function, *args):
+        """Agenda uma conversão no pool (ou a executa na hora, com um único worker).
+
+        Returns:
+            Future: Resultado da função
+        """
+        if self.workers > 1:
+            executor = self.executor()
+            try:
+                return executor.submit(function, *args)
+            except BrokenExecutor:
+                # Um processo do pool morreu (ex.: falta de memória): o pool é recriado
+                with self._lock:
+                    if self._executor is executor:
+                        self._executor = None
+                executor.shutdown(wait=False)
+                return self.executor().submit(function, *args)
+        future = Future()
+        try:
+            future.set_result(function(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self):
+        """Encerra o pool do worker atual."""
+        if self._executor is not None and self._executor_pid == os.getpid():
+            self._executor.shutdown(wait=False)
+        self._executor = None
+        self._executor_pid = None
+
+
+# Conversão em sequência, na thread que chama (quando nenhum pool é informado)
+SEQUENTIAL = PhotoEncoder(workers=1)
+
+
+def save_photos(images_dir, file_identifier, sources, encoder=None, policy=None):
+    """Grava as fotos de um setup em images_dir (image_1.jpg, image_2.jpg, ...).
+
+    Uma foto com erro não impede a gravação das outras. Dados que não são
+    uma imagem são ignorados; os demais erros (ex.: disco) são devolvidos,
+    para que a gravação possa ser tentada de novo.
+
+    Args:
+        images_dir: Pasta das imagens do setup
+        file_identifier: Identificador do setup (prefixo dos caminhos gravados no registro)
+        sources: Fotos na ordem recebida (bytes ou caminhos; None para uma foto
+            inválida, que é ignorada)
+        encoder: (Opcional) PhotoEncoder que converte as fotos em paralelo
+        policy: (Opcional) ImagePolicy das imagens (formato, dimensões e tamanho)
+
+    Returns:
+        tuple: (entradas de imagem para o registro, erros de conversão
+        [(número da foto, mensagem)])
+    """
+    from PIL import UnidentifiedImageError
+
+    os.makedirs(images_dir, exist_ok=True)
+    encoder = encoder or SEQUENTIAL
+    policy = policy or DEFAULT_POLICY
+    # Todas as fotos vão para o pool antes de esperar a primeira
+    pending = [
+        (index, encoder.submit(encode_photo, source,
+                               os.path.join(images_dir, f"image_{index + 1}{policy.extension}"), policy))
+        for index, source in enumerate(sources)
+        # None: base64 inválido (já registrado no log na decodificação)
+        if source is not None
+    ]
+    images, errors = [], []
+    for index, future in pending:
+        photo_filename = f"image_{index + 1}{policy.extension}"
+        try:
+            details = future.result()
+        except UnidentifiedImageError as e:
+            logging.error(f"Error saving photo {index + 1}: {e}")
+            continue
+        except Exception as e:
+            logging.error(f"Error saving photo {index + 1}: {e}")
+            errors.append((index + 1, str(e)))
+            continue
+        images.append({
+            "filename": photo_filename,
+            "path": os.path.join(file_identifier, photo_filename),
+            **details
+        })
+    return images, errors
@@ -0,0 +1,131 @@
+"""Varredura dos diretórios do backend de arquivos com os.scandir.
+
+Percorrer dados_setup com os.listdir custava, além da listagem, um stat por
+entrada (os.path.isdir, os.path.exists, os.path.isfile) para saber o que é
+pasta e o que é arquivo. O os.scandir já traz o tipo de cada entrada (d_type
+do readdir), então uma célula é listada numa única chamada, sem stat:
+
+    arquivos .txt dos setups, demais arquivos (fotos antigas) e pastas (fotos)
+
+A leitura dos .txt de várias células é distribuída num pool de threads (a
+leitura do disco libera o GIL) e os setups são devolvidos por um gerador,
+célula a célula, na ordem das células: no máximo algumas células ficam em
+memória de cada vez, qualquer que seja o tamanho do histórico.
+
+O número de threads vem da variável de ambiente SCAN_WORKERS (padrão 8).
+"""
+import os
+import json
+import logging
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+
+DEFAULT_SCAN_WORKERS = 8
+
+
+def scan_workers():
+    """Número de threads da varredura (SCAN_WORKERS)."""
+    try:
+        return max(int(os.environ.get("SCAN_WORKERS", DEFAULT_SCAN_WORKERS)), 1)
+    except ValueError:
+        return DEFAULT_SCAN_WORKERS
+
+
+class DirListing:
+    """Entradas de um diretório, separadas pelo tipo informado pelo scandir.
+
+    Attributes:
+        setup_files: Nomes dos .txt de setups (sem os registros de reset)
+        files: Nomes de todos os arquivos
+        dirs: Nomes das subpastas
+    """
+
+    __slots__ = ("setup_files", "files", "dirs")
+
+    def __init__(self):
+        self.setup_files = []
+        self.files = set()
+        self.dirs = set()
+
+
+def scan_dir(path):
+    """Lista um diretório numa única chamada (sem stat por entrada).
+
+    Returns:
+        DirListing, ou None se o diretório não existir
+    """
+    listing = DirListing()
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                # is_dir/is_file usam o tipo devolvido pelo readdir; só há stat
+                # em sistemas de arquivos que não o informam
+                if entry.is_dir():
+                    listing.dirs.add(entry.name)
+                elif entry.is_file():
+                    listing.files.add(entry.name)
+                    if entry.name.endswith(".txt") and not entry.name.startswith("reset_"):
+                        listing.setup_files.append(entry.name)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    return listing
+
+
+def list_subdirs(path):
+    """Nomes das subpastas de um diretório (vazio se ele não existir)."""
+    listing = scan_dir(path)
+    return sorted(listing.dirs) if listing is not None else []
+
+
+def read_json_files(dir_path, file_names):
+    """Lê os arquivos JSON informados de um diretório.
+
+    Arquivos inválidos ou que sumiram durante a leitura são ignorados (com log).
+
+    Yields:
+        tuple: (nome do arquivo, conteúdo)
+    """
+    for file_name in file_names:
+        path = os.path.join(dir_path, file_name)
+        try:
+            with open(path, 'r') as f:
+                yield file_name, json.load(f)
+        except (json.JSONDecodeError, FileNotFoundError) as e:
+            logging.error(f"Error loading setup data from {path}: {e}")
+
+
+def scan_cells(cells, load_cell, max_workers=None):
+    """Carrega várias células em paralelo e devolve os itens célula a célula.
+
+    Args:
+        cells: Nomes das células, na ordem desejada
+        load_cell: Função (célula) -> lista de itens, executada nas threads
+        max_workers: (Opcional) Número de threads (padrão: SCAN_WORKERS)
+
+    Yields:
+        tuple: (célula, item), na ordem das células
+    """
+    cells = iter(cells)
+    max_workers = max_workers or scan_workers()
+    # Janela de células em andamento: limita o que fica em memória à espera do consumidor
+    window = max_workers * 2
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="scan") as executor:
+        pending = collections.deque()
+        try:
+            for cell_name in cells:
+                pending.append((cell_name, executor.submit(load_cell, cell_name)))
+                if len(pending) >= window:
+                    break
+            while pending:
+                cell_name, future = pending.popleft()
+                items = future.result()
+                next_cell = next(cells, None)
+                if next_cell is not None:
+                    pending.append((next_cell, executor.submit(load_cell, next_cell)))
+                for item in items:
+                    yield cell_name, item
+        finally:
+            # Consumidor parou antes do fim: não inicia as células que faltam
+            for _, future in pending:
+                future.cancel()
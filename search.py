@@ -0,0 +1,240 @@
+"""Busca por texto livre nos setups (observação, notas da auditoria, produto e itens).
+
+Os auditores procuram setups por trechos como "faltando", o código de uma
+peça citado na observação ou um comentário da auditoria. O índice invertido
+é uma projeção do diário de alterações (ver indexes.py), então acompanha
+cada registro, edição, auditoria e exclusão sem reler os arquivos:
+
+    termo -> {setup: frequência ponderada pelo campo}
+
+Os textos são divididos em palavras, sem acentos e sem diferenciar
+maiúsculas; palavras muito comuns do português são ignoradas e os plurais
+mais comuns são reduzidos ao singular ("parafusos" encontra "parafuso",
+"conexões" encontra "conexão"). Todas as palavras da busca precisam
+aparecer no setup; a última também é aceita como início de palavra
+("faltan" encontra "faltando"). Os resultados são ordenados por relevância
+(BM25) e, em caso de empate, pelos mais recentes.
+
+No PostgreSQL, a busca usa a coluna tsvector dos setups (índice GIN, com a
+configuração portuguesa sem acentos), gravada junto com cada setup; a
+relevância vem de ts_rank_cd com os mesmos pesos dos campos.
+"""
+import re
+import math
+import bisect
+import functools
+
+from indexes import fold
+from storage import setup_matches
+
+
+# Peso de cada campo do documento na relevância
+FIELD_WEIGHTS = {
+    "observation": 1.0,
+    "audit_notes": 1.0,
+    "product": 0.5,
+    "items": 0.5,
+}
+
+# Palavras ignoradas na indexação e na busca (já sem acentos)
+STOPWORDS = frozenset("""
+a ao aos as com da das de do dos e em na nas no nos o os ou para pela pelas pelo pelos
+por que se sem um uma umas uns foi ser esta este isso nao ja mais
+""".split())
+
+# Plurais reduzidos ao singular: (sufixo, substituição), verificados em ordem
+PLURAL_SUFFIXES = (
+    ("oes", "ao"), ("aes", "ao"), ("ais", "al"), ("eis", "el"), ("ois", "ol"),
+    ("res", "r"), ("zes", "z"), ("ns", "m"), ("s", ""),
+)
+
+# Parâmetros do BM25
+K1 = 1.2
+B = 0.75
+
+_WORD = re.compile(r"\w+")
+
+
+@functools.lru_cache(maxsize=65536)
+def stem(word):
+    """Reduz os plurais mais comuns ao singular (palavra já normalizada; o vocabulário se repete muito)."""
+    if len(word) <= 3 or word.isdigit():
+        return word
+    if word.endswith(("ss", "us", "is")) and not word.endswith(("ais", "eis", "ois")):
+        return word
+    for suffix, replacement in PLURAL_SUFFIXES:
+        if word.endswith(suffix):
+            return word[:-len(suffix)] + replacement
+    return word
+
+
+def tokenize(text):
+    """Palavras indexáveis de um texto (sem acentos, sem palavras comuns, no singular)."""
+    return [stem(word) for word in _WORD.findall(fold(text)) if word not in STOPWORDS]
+
+
+def query_words(query):
+    """Palavras de uma busca (sem acentos e sem palavras comuns, ainda sem reduzir os plurais)."""
+    return [word for word in _WORD.findall(fold(query)) if word not in STOPWORDS]
+
+
+def _snippet(text, words, width=60):
+    # Trecho do texto em volta da primeira palavra da busca (ou da última, como prefixo)
+    terms = {stem(word) for word in words}
+    prefix = words[-1] if words else None
+    for match in _WORD.finditer(fold(text)):
+        word = match.group()
+        if stem(word) in terms or (prefix and word.startswith(prefix)):
+            start = max(match.start() - width, 0)
+            end = min(match.start() + width, len(text))
+            return ("…" if start > 0 else "") + text[start:end].strip() + ("…" if end < len(text) else "")
+    return None
+
+
+class SearchIndex:
+    """Índice invertido dos textos livres dos setups."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.postings = {}
+        self.lengths = {}
+        # Termos de cada setup, para removê-lo sem tokenizar o documento de novo
+        self.terms = {}
+        self.total_length = 0.0
+        self.vocabulary = []
+
+    def _weighted_terms(self, document):
+        weights = {}
+        text = document.get("text") or {}
+        for field, weight in FIELD_WEIGHTS.items():
+            for term in tokenize(text.get(field, "")):
+                weights[term] = weights.get(term, 0.0) + weight
+        return weights
+
+    def add(self, key, document):
+        weights = self._weighted_terms(document)
+        if not weights:
+            return
+        terms = []
+        for term, weight in weights.items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = {}
+                bisect.insort(self.vocabulary, term)
+            postings[key] = weight
+            terms.append(term)
+        self.terms[key] = tuple(terms)
+        length = sum(weights.values())
+        self.lengths[key] = length
+        self.total_length += length
+
+    def remove(self, key, document):
+        length = self.lengths.pop(key, None)
+        if length is None:
+            return
+        self.total_length -= length
+        for term in self.terms.pop(key, ()):
+            postings = self.postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(key, None)
+            if not postings:
+                del self.postings[term]
+                position = bisect.bisect_left(self.vocabulary, term)
+                if position < len(self.vocabulary) and self.vocabulary[position] == term:
+                    del self.vocabulary[position]
+
+    def _expand_prefix(self, prefix):
+        # Termos do vocabulário que começam com o prefixo (vocabulário ordenado)
+        start = bisect.bisect_left(self.vocabulary, prefix)
+        end = bisect.bisect_left(self.vocabulary, prefix + "\uffff")
+        return self.vocabulary[start:end]
+
+    def _idf(self, postings):
+        count = len(self.lengths)
+        return math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+
+    def search(self, documents, query, filters=None, limit=20, offset=0):
+        """Busca os setups que contêm todas as palavras da consulta.
+
+        Args:
+            documents: Documentos indexados ((célula, file_identifier) -> documento)
+            query: Texto da busca
+            filters: (Opcional) Filtros da listagem (ver storage.setup_matches)
+            limit: Quantidade de resultados
+            offset: Resultados a pular (paginação)
+
+        Returns:
+            tuple: (total de setups encontrados, [(relevância, chave)] da página)
+        """
+        words = query_words(query)
+        if not words:
+            return 0, []
+
+        # Cada palavra da busca vira um grupo de termos: o próprio termo ou,
+        # para a última palavra, também os termos que começam com ela
+        groups = []
+        for position, word in enumerate(words):
+            term = stem(word)
+            group = {term} if term in self.postings else set()
+            if position == len(words) - 1:
+                group.update(self._expand_prefix(word))
+            if not group:
+                return 0, []
+            groups.append([(self.postings[item], self._idf(self.postings[item])) for item in group])
+
+        # Setups que têm todas as palavras, começando pelo grupo mais raro
+        keys_by_group = [set().union(*(postings for postings, _ in group)) for group in groups]
+        keys_by_group.sort(key=len)
+        candidates = keys_by_group[0].intersection(*keys_by_group[1:])
+        if filters:
+            candidates = {key for key in candidates if setup_matches(documents[key], filters)}
+
+        average_length = self.total_length / len(self.lengths) if self.lengths else 1.0
+        scored = []
+        for key in candidates:
+            norm = K1 * (1 - B + B * self.lengths[key] / average_length)
+            score = 0.0
+            for group in groups:
+                # A melhor variação de cada palavra conta uma vez
+                score += max(
+                    (idf * weight * (K1 + 1) / (weight + norm)
+                     for postings, idf in group for weight in [postings.get(key)] if weight),
+                    default=0.0
+                )
+            scored.append((score, documents[key]["timestamp"], key))
+        scored.sort(reverse=True)
+        return len(scored), [(score, key) for score, _, key in scored[offset:offset + limit]]
+
+
+def search_setups(indexes, query, filters=None, limit=20, offset=0):
+    """Busca por texto livre nos setups.
+
+    Usa o índice mantido pelo diário; nos backends sem índices em memória
+    (PostgreSQL), a busca vai ao repositório (SetupRepository.search_setups).
+
+    Returns:
+        dict: total e results (resumo de cada setup, ver SetupDocument.listing,
+        com relevância e o trecho do texto encontrado)
+    """
+    if indexes.enabled:
+        with indexes.snapshot() as documents:
+            total, page = indexes.projections["search"].search(documents, query, filters, limit, offset)
+            found = [(score, documents[key]) for score, key in page]
+    else:
+        total, found = indexes.repository.search_setups(query, filters, limit, offset)
+
+    words = query_words(query)
+    results = []
+    for score, document in found:
+        result = document.listing()
+        result["score"] = round(score, 4)
+        for field in FIELD_WEIGHTS:
+            snippet = _snippet(document["text"].get(field, ""), words)
+            if snippet:
+                result["match_field"], result["snippet"] = field, snippet
+                break
+        results.append(result)
+    return {"total": total, "results": results}
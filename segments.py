@@ -0,0 +1,390 @@
+"""Pacotes mensais de setups por célula (backend de segmentos).
+
+No backend de arquivos cada setup é um .txt pequeno: milhões deles esgotam
+os inodes do disco e deixam a listagem das células lenta. Aqui os registros
+de cada célula ficam agrupados por mês, num arquivo só de acréscimos:
+
+    dados_setup/_segments/<célula>/<AAAA-MM>.seg   registros (uma linha JSON por versão)
+    dados_setup/_segments/<célula>/<AAAA-MM>.idx   índice: file_identifier -> (offset, tamanho)
+
+Cada gravação acrescenta uma linha com o estado completo do setup, e cada
+exclusão uma linha de remoção:
+
+    {"id": "<file_identifier>", "data": {...}}
+    {"id": "<file_identifier>", "deleted": true}
+
+O mês vem do file_identifier ("<ordem>_<tipo>_<AAAA-MM-DD_HH-MM-SS>"), então
+um setup é encontrado sem consultar outros arquivos. O índice guarda o inode
+e o tamanho do .seg que ele descreve; se o .seg cresceu, só o trecho novo é
+lido. Por isso o .idx (que tem todos os registros do mês) não é reescrito a
+cada gravação, só depois de INDEX_FLUSH_BYTES acrescentados desde a última
+vez, e na compactação: um processo novo lê no máximo esse trecho a mais.
+
+As versões substituídas e as exclusões ficam no arquivo até a compactação,
+que reescreve o mês só com os registros vigentes (arquivo temporário +
+rename) quando eles passam de COMPACT_MIN_DEAD_BYTES e da metade do arquivo,
+ou com `flask --app main compact-segments`.
+
+A leitura de um mês mapeia o .seg em memória (mmap) e percorre os registros
+vigentes na ordem dos offsets: uma leitura sequencial do arquivo.
+
+As gravações de uma célula usam um flock, pois vários workers podem gravar
+na mesma célula. As imagens continuam em dados_setup/<célula>/.
+"""
+import os
+import re
+import json
+import mmap
+import fcntl
+import logging
+import threading
+import contextlib
+
+
+SEGMENT_DIR = "_segments"
+SEGMENT_EXTENSION = ".seg"
+INDEX_EXTENSION = ".idx"
+INDEX_VERSION = 1
+
+# Segmento dos setups cujo file_identifier não termina com a data/hora
+UNDATED_MONTH = "0000-00"
+
+# Compactação automática: bytes de versões antigas a partir dos quais o mês é reescrito
+COMPACT_MIN_DEAD_BYTES = 256 * 1024
+
+# Bytes acrescentados ao .seg a partir dos quais o .idx é reescrito
+INDEX_FLUSH_BYTES = 256 * 1024
+
+_MONTH_PATTERN = re.compile(r"_(\d{4}-\d{2})-\d{2}_\d{2}-\d{2}-\d{2}$")
+
+
+def segment_month(file_identifier):
+    """Mês ("AAAA-MM") do segmento de um setup, tirado do file_identifier."""
+    match = _MONTH_PATTERN.search(file_identifier)
+    return match.group(1) if match else UNDATED_MONTH
+
+
+class SegmentIndex:
+    """Registros vigentes de um segmento.
+
+    Attributes:
+        inode: Inode do .seg descrito
+        size: Bytes do .seg já indexados (sempre ao fim de uma linha)
+        dead: Bytes ocupados por versões substituídas e exclusões
+        live: file_identifier -> (offset, tamanho) da versão vigente
+        flushed: Bytes do .seg descritos pelo .idx gravado (não vai para o arquivo)
+    """
+
+    __slots__ = ("inode", "size", "dead", "live", "flushed")
+
+    def __init__(self, inode, size=0, dead=0, live=None):
+        self.inode = inode
+        self.size = size
+        self.dead = dead
+        self.live = live if live is not None else {}
+        self.flushed = size
+
+    def apply(self, file_identifier, offset, length, deleted=False):
+        """Aplica uma linha do segmento (tamanho sem a quebra de linha)."""
+        previous = self.live.pop(file_identifier, None)
+        if previous is not None:
+            self.dead += previous[1] + 1
+        if deleted:
+            self.dead += length + 1
+        else:
+            self.live[file_identifier] = (offset, length)
+
+    def scan(self, data, base_offset):
+        """Indexa as linhas completas de um trecho do segmento.
+
+        Args:
+            data: Bytes lidos a partir de base_offset
+            base_offset: Posição do trecho no arquivo
+
+        Returns:
+            int: Posição do fim da última linha completa
+        """
+        position = 0
+        end = data.rfind(b"\n") + 1
+        while position < end:
+            line_end = data.index(b"\n", position)
+            line = data[position:line_end]
+            if line.strip():
+                try:
+                    entry = json.loads(line)
+                    self.apply(entry["id"], base_offset + position, line_end - position, entry.get("deleted", False))
+                except (ValueError, KeyError, TypeError) as e:
+                    logging.error(f"Linha inválida no segmento (offset {base_offset + position}): {e}")
+                    self.dead += line_end - position + 1
+            position = line_end + 1
+        return base_offset + end
+
+    def to_json(self):
+        return {
+            "version": INDEX_VERSION, "inode": self.inode, "size": self.size, "dead": self.dead,
+            "live": {file_identifier: list(entry) for file_identifier, entry in self.live.items()},
+        }
+
+    @classmethod
+    def from_json(cls, document):
+        if not isinstance(document, dict) or document.get("version") != INDEX_VERSION:
+            return None
+        return cls(document["inode"], document["size"], document["dead"],
+                   {file_identifier: tuple(entry) for file_identifier, entry in document["live"].items()})
+
+
+class SegmentStore:
+    """Leitura, acréscimo e compactação dos segmentos das células.
+
+    Args:
+        data_dir: Diretório raiz dos dados (dados_setup)
+    """
+
+    def __init__(self, data_dir):
+        self.root = os.path.join(data_dir, SEGMENT_DIR)
+        # Índices já lidos por este processo (caminho do .seg -> SegmentIndex)
+        self._indexes = {}
+        self._lock = threading.RLock()
+
+    def cell_path(self, cell_name):
+        return os.path.join(self.root, cell_name)
+
+    def segment_path(self, cell_name, month):
+        return os.path.join(self.cell_path(cell_name), f"{month}{SEGMENT_EXTENSION}")
+
+    @contextlib.contextmanager
+    def lock(self, cell_name):
+        """Trava exclusiva das gravações da célula, compartilhada entre os processos."""
+        os.makedirs(self.cell_path(cell_name), exist_ok=True)
+        with open(os.path.join(self.cell_path(cell_name), ".lock"), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def cells(self):
+        """Células com segmentos gravados."""
+        try:
+            return sorted(entry.name for entry in os.scandir(self.root) if entry.is_dir())
+        except FileNotFoundError:
+            return []
+
+    def months(self, cell_name):
+        """Meses ("AAAA-MM") com segmento na célula, em ordem."""
+        try:
+            names = os.listdir(self.cell_path(cell_name))
+        except FileNotFoundError:
+            return []
+        return sorted(name[:-len(SEGMENT_EXTENSION)] for name in names if name.endswith(SEGMENT_EXTENSION))
+
+    # Índices
+
+    def _read_index_file(self, path, inode):
+        try:
+            with open(path[:-len(SEGMENT_EXTENSION)] + INDEX_EXTENSION, 'r') as f:
+                index = SegmentIndex.from_json(json.load(f))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.error(f"Índice do segmento {path} inválido, reconstruindo: {e}")
+            return None
+        if index is None or index.inode != inode:
+            return None
+        return index
+
+    def _write_index_file(self, path, index):
+        index_path = path[:-len(SEGMENT_EXTENSION)] + INDEX_EXTENSION
+        tmp_path = f"{index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(index.to_json(), f, separators=(",", ":"))
+        os.replace(tmp_path, index_path)
+        index.flushed = index.size
+
+    def _index(self, path, f):
+        """Índice atualizado do segmento aberto em f.
+
+        Usa o índice em memória ou o .idx (se descreverem o mesmo inode) e lê
+        apenas o trecho acrescentado depois dele.
+        """
+        stat = os.fstat(f.fileno())
+        with self._lock:
+            index = self._indexes.get(path)
+            if index is None or index.inode != stat.st_ino or index.size > stat.st_size:
+                index = self._read_index_file(path, stat.st_ino)
+                if index is None or index.size > stat.st_size:
+                    index = SegmentIndex(stat.st_ino)
+                self._indexes[path] = index
+            if index.size < stat.st_size:
+                f.seek(index.size)
+                index.size = index.scan(f.read(stat.st_size - index.size), index.size)
+            return index
+
+    # Leitura
+
+    def get(self, cell_name, file_identifier):
+        """Registro vigente de um setup, ou None."""
+        path = self.segment_path(cell_name, segment_month(file_identifier))
+        try:
+            with open(path, 'rb') as f:
+                entry = self._index(path, f).live.get(file_identifier)
+                if entry is None:
+                    return None
+                line = os.pread(f.fileno(), entry[1], entry[0])
+        except FileNotFoundError:
+            return None
+        return json.loads(line)["data"]
+
+    def ids(self, cell_name):
+        """file_identifiers vigentes da célula."""
+        identifiers = []
+        for month in self.months(cell_name):
+            path = self.segment_path(cell_name, month)
+            try:
+                with open(path, 'rb') as f:
+                    identifiers.extend(self._index(path, f).live)
+            except FileNotFoundError:
+                continue
+        return identifiers
+
+    def read_month(self, cell_name, month, prefix=""):
+        """Lê os registros vigentes de um mês, em sequência, pelo mmap do segmento.
+
+        Args:
+            cell_name: Nome da célula
+            month: Mês do segmento ("AAAA-MM")
+            prefix: (Opcional) Início do file_identifier (ex.: "<ordem>_")
+
+        Returns:
+            list: Tuplas (file_identifier, registro), na ordem do arquivo
+        """
+        path = self.segment_path(cell_name, month)
+        try:
+            with open(path, 'rb') as f:
+                index = self._index(path, f)
+                entries = sorted(
+                    (entry, file_identifier) for file_identifier, entry in index.live.items()
+                    if file_identifier.startswith(prefix)
+                )
+                if not entries:
+                    return []
+                with mmap.mmap(f.fileno(), index.size, access=mmap.ACCESS_READ) as mapped:
+                    if hasattr(mapped, "madvise"):
+                        mapped.madvise(mmap.MADV_SEQUENTIAL)
+                    return [
+                        (file_identifier, json.loads(mapped[offset:offset + length])["data"])
+                        for (offset, length), file_identifier in entries
+                    ]
+        except FileNotFoundError:
+            return []
+
+    def read_cell(self, cell_name, prefix=""):
+        """Lê os registros vigentes da célula, mês a mês (ver read_month).
+
+        Yields:
+            tuple: (file_identifier, registro)
+        """
+        for month in self.months(cell_name):
+            yield from self.read_month(cell_name, month, prefix)
+
+    # Gravação
+
+    def append(self, cell_name, records):
+        """Acrescenta versões de setups aos segmentos da célula.
+
+        Args:
+            cell_name: Nome da célula
+            records: Lista de tuplas (file_identifier, registro), com registro
+                None para uma exclusão
+
+        Returns:
+            set: file_identifiers excluídos que existiam
+        """
+        by_month = {}
+        for file_identifier, record in records:
+            by_month.setdefault(segment_month(file_identifier), []).append((file_identifier, record))
+
+        removed = set()
+        with self.lock(cell_name):
+            for month, month_records in by_month.items():
+                path = self.segment_path(cell_name, month)
+                with self._lock, open(path, 'a+b') as f:
+                    index = self._index(path, f)
+                    # Linha incompleta de uma gravação interrompida: descartada
+                    if os.fstat(f.fileno()).st_size > index.size:
+                        f.truncate(index.size)
+                    offset, lines = index.size, []
+                    for file_identifier, record in month_records:
+                        if record is None:
+                            if file_identifier not in index.live:
+                                continue
+                            removed.add(file_identifier)
+                            entry = {"id": file_identifier, "deleted": True}
+                        else:
+                            entry = {"id": file_identifier, "data": record}
+                        line = json.dumps(entry, separators=(",", ":")).encode("utf-8")
+                        index.apply(file_identifier, offset, len(line), record is None)
+                        lines.append(line)
+                        offset += len(line) + 1
+                    if not lines:
+                        continue
+                    f.write(b"\n".join(lines) + b"\n")
+                    f.flush()
+                    index.size = offset
+                    if index.size - index.flushed >= INDEX_FLUSH_BYTES:
+                        self._write_index_file(path, index)
+                if index.dead >= COMPACT_MIN_DEAD_BYTES and index.dead * 2 >= index.size:
+                    self._compact(cell_name, month)
+        return removed
+
+    # Compactação
+
+    def _compact(self, cell_name, month):
+        # Chamada com a trava da célula
+        path = self.segment_path(cell_name, month)
+        with self._lock:
+            try:
+                f = open(path, 'rb')
+            except FileNotFoundError:
+                return 0
+            with f:
+                index = self._index(path, f)
+                if not index.dead:
+                    return 0
+                reclaimed = index.dead
+                entries = sorted((entry, file_identifier) for file_identifier, entry in index.live.items())
+                if not entries:
+                    os.remove(path)
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(path[:-len(SEGMENT_EXTENSION)] + INDEX_EXTENSION)
+                    self._indexes.pop(path, None)
+                    return reclaimed
+
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                live, offset = {}, 0
+                with open(tmp_path, 'wb') as out:
+                    for (entry_offset, length), file_identifier in entries:
+                        out.write(os.pread(f.fileno(), length, entry_offset) + b"\n")
+                        live[file_identifier] = (offset, length)
+                        offset += length + 1
+                    out.flush()
+                    os.fsync(out.fileno())
+                    compacted = SegmentIndex(os.fstat(out.fileno()).st_ino, offset, 0, live)
+            # O índice é gravado antes do rename: os leitores só o aceitam para o inode novo
+            self._write_index_file(path, compacted)
+            os.replace(tmp_path, path)
+            self._indexes[path] = compacted
+        return reclaimed
+
+    def compact(self, cell_name, months=None):
+        """Reescreve os segmentos da célula só com os registros vigentes.
+
+        Args:
+            cell_name: Nome da célula
+            months: (Opcional) Meses a compactar; por padrão, todos
+
+        Returns:
+            int: Bytes recuperados
+        """
+        with self.lock(cell_name):
+            return sum(self._compact(cell_name, month) for month in (months or self.months(cell_name)))
@@ -0,0 +1,100 @@
+"""Identificadores estáveis dos setups, no estilo ULID.
+
+Os setups eram localizados pela ordem e pelo tipo (prefixo
+"<ordem>_<tipo>" dos arquivos), o que exige listar a célula e escolhe o
+registro errado quando a ordem tem mais de um setup do mesmo tipo. Cada
+setup recebe agora um ID de 26 caracteres (base32 de Crockford):
+
+    48 bits: milissegundos desde 1970 (os IDs ordenam pela data)
+    80 bits: aleatórios
+
+O ID é gravado no registro (campo setup_id) e os índices mantêm o mapa
+ID -> (célula, file_identifier) (ver indexes.SetupIdIndex), então as APIs
+localizam um setup em tempo constante.
+
+Registros gravados antes dos IDs recebem, na leitura, um ID derivado da
+data/hora do setup e de um hash da célula e do file_identifier: o mesmo
+registro sempre tem o mesmo ID, sem precisar reescrever os arquivos. O ID
+passa a ser gravado na próxima atualização do registro.
+"""
+import os
+import time
+import hashlib
+import datetime
+import threading
+
+
+# Alfabeto base32 de Crockford (sem I, L, O e U)
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+SETUP_ID_LENGTH = 26
+
+# Formato da data/hora dos setups (usado nos IDs derivados)
+TIMESTAMP_FORMAT = "%Y-%m-%d_%H-%M-%S"
+
+# Pares de caracteres (10 bits cada): o ID é montado em 13 consultas
+_PAIRS = [first + second for first in ALPHABET for second in ALPHABET]
+_PAIR_SHIFTS = range(10 * (SETUP_ID_LENGTH // 2 - 1), -1, -10)
+
+_lock = threading.Lock()
+_last = (0, 0)
+
+
+def _compose(milliseconds, randomness):
+    value = (milliseconds << 80) | randomness
+    return "".join([_PAIRS[(value >> shift) & 1023] for shift in _PAIR_SHIFTS])
+
+
+def _milliseconds(timestamp):
+    # Caminho rápido para o formato canônico; o strptime cobre as variações
+    # que ele também aceita (ex.: campos com um dígito)
+    try:
+        if (len(timestamp) == 19 and timestamp[4] == timestamp[7] == timestamp[13] == timestamp[16] == "-"
+                and timestamp[10] == "_"):
+            moment = datetime.datetime(
+                int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10]),
+                int(timestamp[11:13]), int(timestamp[14:16]), int(timestamp[17:19])
+            )
+        else:
+            moment = datetime.datetime.strptime(timestamp, TIMESTAMP_FORMAT)
+        return max(int(moment.timestamp() * 1000), 0)
+    except (TypeError, ValueError, OverflowError, OSError):
+        return 0
+
+
+def new_setup_id():
+    """Gera um ID novo.
+
+    IDs gerados no mesmo milissegundo pelo processo continuam crescentes (a
+    parte aleatória do anterior é incrementada).
+    """
+    global _last
+    milliseconds = time.time_ns() // 1_000_000
+    with _lock:
+        last_milliseconds, last_randomness = _last
+        if milliseconds <= last_milliseconds:
+            milliseconds, randomness = last_milliseconds, last_randomness + 1
+        else:
+            randomness = int.from_bytes(os.urandom(10), "big")
+        _last = (milliseconds, randomness)
+    return _compose(milliseconds, randomness)
+
+
+def legacy_setup_id(cell_name, file_identifier, timestamp=None):
+    """ID determinístico de um registro gravado sem setup_id.
+
+    Args:
+        cell_name: Nome da célula
+        file_identifier: Identificador do setup na célula
+        timestamp: (Opcional) Data/hora do setup ("AAAA-MM-DD_HH-MM-SS")
+    """
+    digest = hashlib.sha1(f"{cell_name}/{file_identifier}".encode("utf-8")).digest()
+    return _compose(_milliseconds(timestamp), int.from_bytes(digest[:10], "big"))
+
+
+def is_setup_id(value):
+    """Verifica se um valor tem o formato de um ID de setup."""
+    return (
+        isinstance(value, str) and len(value) == SETUP_ID_LENGTH
+        and all(char in ALPHABET for char in value)
+    )
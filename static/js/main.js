@@ -76,6 +76,18 @@ document.addEventListener('DOMContentLoaded', function() {
                 console.log("Botão de envio desabilitado para prevenir múltiplos envios");
             }
             
+            // Fotos já enviadas em partes: o formulário só leva os tokens
+            const photoFilesInput = document.getElementById('photoFiles');
+            const photoDataField = document.getElementById('photoData');
+            const photoTokensField = document.getElementById('photoTokens');
+            if (photoTokensField && photoTokensField.value) {
+                if (photoFilesInput) photoFilesInput.disabled = true;
+                if (photoDataField) photoDataField.disabled = true;
+            } else if (photoFilesInput && photoDataField && photoFilesInput.files.length > 0) {
+                // Fotos enviadas como arquivos: o base64 não precisa ir junto
+                photoDataField.disabled = true;
+            }
+            
             // Adicionar classe para ativar feedback visual
             setupForm.classList.add('was-validated');
             
@@ -92,12 +104,18 @@ document.addEventListener('DOMContentLoaded', function() {
             // Array para armazenar as imagens comprimidas
             let compressedImages = [];
             
+            // Cada nova seleção invalida os envios em andamento da anterior
+            let uploadGeneration = 0;
+            
             photoInput.addEventListener('change', function(event) {
                 const files = event.target.files;
                 if (files.length === 0) return;
                 
                 // Limpar arrays e exibições anteriores
                 compressedImages = [];
+                uploadGeneration++;
+                const photoTokensInput = document.getElementById('photoTokens');
+                if (photoTokensInput) photoTokensInput.value = '';
                 const carouselInner = document.getElementById('carouselInner');
                 carouselInner.innerHTML = '';
                 
@@ -213,6 +231,37 @@ document.addEventListener('DOMContentLoaded', function() {
                                 
                                 // Concatenar todas as imagens comprimidas em uma string JSON e armazenar no campo oculto
                                 photoDataInput.value = JSON.stringify(compressedImages);
+                                
+                                // Enviar as imagens comprimidas como arquivos do formulário (multipart),
+                                // sem o aumento de ~33% do base64; navegadores sem DataTransfer
+                                // continuam enviando o campo photo_data
+                                const photoFilesInput = document.getElementById('photoFiles');
+                                if (photoFilesInput && typeof DataTransfer !== 'undefined') {
+                                    try {
+                                        const transfer = new DataTransfer();
+                                        compressedImages.forEach((dataUrl, index) => {
+                                            transfer.items.add(dataUrlToFile(dataUrl, `photo_${index + 1}.jpg`));
+                                        });
+                                        photoFilesInput.files = transfer.files;
+                                    } catch (error) {
+                                        console.log("Envio das fotos como arquivos indisponível, usando base64:", error);
+                                        photoFilesInput.value = '';
+                                    }
+                                }
+                                
+                                // Enviar as fotos em partes já agora: no registro do setup só vão os
+                                // tokens. Se algum envio falhar, o formulário leva as fotos inteiras
+                                const generation = uploadGeneration;
+                                Promise.all(compressedImages.map((dataUrl, index) =>
+                                    uploadPhotoInChunks(dataUrlToFile(dataUrl, `photo_${index + 1}.jpg`))
+                                )).then(tokens => {
+                                    const photoTokensInput = document.getElementById('photoTokens');
+                                    if (photoTokensInput && generation === uploadGeneration) {
+                                        photoTokensInput.value = JSON.stringify(tokens);
+                                    }
+                                }).catch(error => {
+                                    console.log("Envio antecipado das fotos falhou, elas irão com o formulário:", error);
+                                });
                             }
                         };
                         img.src = e.target.result;
@@ -415,3 +464,72 @@ function updateSetup(cellName, orderNumber) {
         saveBtn.disabled = false;
     });
 }
+
+// Converte uma data URL (base64) em um arquivo para envio no formulário
+function dataUrlToFile(dataUrl, filename) {
+    const [header, base64Data] = dataUrl.split(',');
+    const mimeType = header.substring(header.indexOf(':') + 1, header.indexOf(';'));
+    const binary = atob(base64Data);
+    const bytes = new Uint8Array(binary.length);
+    for (let i = 0; i < binary.length; i++) {
+        bytes[i] = binary.charCodeAt(i);
+    }
+    return new File([bytes], filename, { type: mimeType });
+}
+
+// Envio de uma foto em partes, retomando de onde parou se a conexão cair (ver uploads.py)
+const UPLOAD_MAX_RETRIES = 5;
+
+async function uploadPhotoInChunks(file) {
+    const createResponse = await fetch('/api/uploads', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ size: file.size, filename: file.name })
+    });
+    if (!createResponse.ok) {
+        throw new Error(`Erro ao iniciar o envio da foto (${createResponse.status})`);
+    }
+    const upload = (await createResponse.json()).upload;
+    
+    let offset = upload.offset;
+    let failures = 0;
+    while (offset < file.size) {
+        try {
+            const response = await fetch(`/api/uploads/${upload.token}`, {
+                method: 'PATCH',
+                headers: {
+                    'Content-Type': 'application/offset+octet-stream',
+                    'Upload-Offset': String(offset)
+                },
+                body: file.slice(offset, offset + upload.chunk_size)
+            });
+            const result = await response.json();
+            if (response.status === 409) {
+                // O servidor já tinha recebido parte dos bytes: continuar dali
+                offset = result.offset;
+                continue;
+            }
+            if (!response.ok) {
+                throw new Error(result.message || `Erro ao enviar a foto (${response.status})`);
+            }
+            offset = result.upload.offset;
+            failures = 0;
+        } catch (error) {
+            failures++;
+            if (failures > UPLOAD_MAX_RETRIES) {
+                throw error;
+            }
+            await new Promise(resolve => setTimeout(resolve, 1000 * failures));
+            // Consultar quanto já chegou antes de tentar de novo
+            try {
+                const statusResponse = await fetch(`/api/uploads/${upload.token}`);
+                if (statusResponse.ok) {
+                    offset = (await statusResponse.json()).upload.offset;
+                }
+            } catch (statusError) {
+                console.log("Servidor indisponível, nova tentativa em breve:", statusError);
+            }
+        }
+    }
+    return upload.token;
+}
@@ -0,0 +1,198 @@
+"""Estatísticas da auditoria materializadas em acumulados por dia e por célula.
+
+Os gestores acompanham o backlog de auditoria por célula, as auditorias
+feitas por dia e o tempo médio entre o setup e a sua auditoria. Em vez de
+percorrer todos os setups a cada consulta, a projeção do diário de
+alterações (ver indexes.py) mantém, por dia e célula:
+
+    (dia, célula) -> setups registrados no dia e quantos deles já foram
+                     auditados; auditorias feitas no dia e a soma dos
+                     tempos entre setup e auditoria
+
+Cada registro, auditoria ou exclusão ajusta só os acumulados do setup
+alterado, e uma consulta por período soma os acumulados dos dias do
+período: o custo depende da quantidade de dias, não de setups. As
+estatísticas são reconstruídas junto com os índices
+(`flask --app main rebuild-indexes`). No PostgreSQL, os mesmos acumulados
+são agrupados pelo banco a cada consulta, só nos dias e células filtrados.
+"""
+import bisect
+import datetime
+
+from indexes import fold
+
+
+# Formatos da data/hora do setup e da auditoria
+SETUP_TIMESTAMP_FORMAT = "%Y-%m-%d_%H-%M-%S"
+AUDIT_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def parse_timestamp(value):
+    """Converte a data/hora de um setup ou de uma auditoria, ou None se inválida."""
+    # Caminho rápido para os formatos canônicos (chamada para cada setup ao
+    # carregar os índices); o strptime cobre as variações que ele aceita
+    if (isinstance(value, str) and len(value) == 19 and value[4] == value[7] == "-"
+            and (value[10:17:3] == "_--" or value[10:17:3] == " ::")):
+        try:
+            return datetime.datetime(
+                int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                int(value[11:13]), int(value[14:16]), int(value[17:19])
+            )
+        except ValueError:
+            pass
+    for fmt in (SETUP_TIMESTAMP_FORMAT, AUDIT_TIMESTAMP_FORMAT):
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def _new_rollup():
+    return {"setups": 0, "audited": 0, "audits": 0, "audit_seconds": 0, "timed_audits": 0}
+
+
+def _add_rollup(total, rollup):
+    for name, value in rollup.items():
+        total[name] += value
+
+
+def _average_hours(rollup):
+    return round(rollup["audit_seconds"] / rollup["timed_audits"] / 3600, 2) if rollup["timed_audits"] else None
+
+
+class StatsIndex:
+    """Projeção com os acumulados por dia e célula."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.rollups = {}
+        self.cells_by_day = {}
+        self.days = []
+
+    def _rollup(self, day, cell_name):
+        rollup = self.rollups.get((day, cell_name))
+        if rollup is None:
+            rollup = self.rollups[(day, cell_name)] = _new_rollup()
+            cells = self.cells_by_day.get(day)
+            if cells is None:
+                cells = self.cells_by_day[day] = set()
+                bisect.insort(self.days, day)
+            cells.add(cell_name)
+        return rollup
+
+    def _drop_if_empty(self, day, cell_name):
+        rollup = self.rollups.get((day, cell_name))
+        if rollup is None or any(rollup.values()):
+            return
+        del self.rollups[(day, cell_name)]
+        cells = self.cells_by_day[day]
+        cells.discard(cell_name)
+        if not cells:
+            del self.cells_by_day[day]
+            del self.days[bisect.bisect_left(self.days, day)]
+
+    def _count(self, document, delta):
+        cell_name = document["cell_name"]
+        audited = bool(document.get("audited"))
+
+        setup_day = (document.get("timestamp") or "")[:10]
+        rollup = self._rollup(setup_day, cell_name)
+        rollup["setups"] += delta
+        rollup["audited"] += delta if audited else 0
+        self._drop_if_empty(setup_day, cell_name)
+
+        audit_time = parse_timestamp(document.get("audit_timestamp")) if audited else None
+        if audit_time is None:
+            return
+        audit_day = audit_time.strftime("%Y-%m-%d")
+        rollup = self._rollup(audit_day, cell_name)
+        rollup["audits"] += delta
+        setup_time = parse_timestamp(document.get("timestamp"))
+        if setup_time is not None and audit_time >= setup_time:
+            rollup["audit_seconds"] += delta * int((audit_time - setup_time).total_seconds())
+            rollup["timed_audits"] += delta
+        self._drop_if_empty(audit_day, cell_name)
+
+    def add_rollup(self, day, cell_name, **counts):
+        """Soma contagens já agrupadas por dia e célula (ex.: calculadas pelo banco)."""
+        _add_rollup(self._rollup(day, cell_name), counts)
+        self._drop_if_empty(day, cell_name)
+
+    def add(self, key, document):
+        self._count(document, 1)
+
+    def remove(self, key, document):
+        self._count(document, -1)
+
+    def summary(self, date_start=None, date_end=None, cell=None):
+        """Estatísticas do período (dias AAAA-MM-DD, inclusive) e das células cujo nome contém 'cell'.
+
+        Returns:
+            dict: totals (setups, auditados, pendentes, auditorias e tempo médio
+            até a auditoria em horas), cells (backlog por célula) e days
+            (acumulados de cada dia do período)
+        """
+        cell_query = fold(cell) if cell else None
+        matches_cell = (lambda cell_name: cell_query in fold(cell_name)) if cell_query else (lambda cell_name: True)
+
+        low = bisect.bisect_left(self.days, date_start) if date_start else 0
+        high = bisect.bisect_right(self.days, date_end) if date_end else len(self.days)
+        totals, cells, days = _new_rollup(), {}, []
+        for day in self.days[low:high]:
+            day_total = _new_rollup()
+            for cell_name in self.cells_by_day[day]:
+                if not matches_cell(cell_name):
+                    continue
+                rollup = self.rollups[(day, cell_name)]
+                _add_rollup(day_total, rollup)
+                _add_rollup(cells.setdefault(cell_name, _new_rollup()), rollup)
+            if not any(day_total.values()):
+                continue
+            _add_rollup(totals, day_total)
+            if day:
+                days.append({
+                    "date": day,
+                    "setups": day_total["setups"],
+                    "audited": day_total["audited"],
+                    "pending": day_total["setups"] - day_total["audited"],
+                    "audits": day_total["audits"],
+                    "avg_audit_hours": _average_hours(day_total),
+                })
+
+        return {
+            "totals": {
+                "setups": totals["setups"],
+                "audited": totals["audited"],
+                "pending": totals["setups"] - totals["audited"],
+                "audits": totals["audits"],
+                "avg_audit_hours": _average_hours(totals),
+            },
+            "cells": sorted((
+                {
+                    "cell_name": cell_name,
+                    "setups": rollup["setups"],
+                    "audited": rollup["audited"],
+                    "pending": rollup["setups"] - rollup["audited"],
+                    "audits": rollup["audits"],
+                    "avg_audit_hours": _average_hours(rollup),
+                }
+                for cell_name, rollup in cells.items()
+            ), key=lambda entry: (-entry["pending"], entry["cell_name"])),
+            "days": days,
+        }
+
+
+def setup_stats(indexes, date_start=None, date_end=None, cell=None):
+    """Estatísticas da auditoria (ver StatsIndex.summary).
+
+    Nos backends sem índices em memória (PostgreSQL), as estatísticas vêm do
+    repositório (SetupRepository.setup_stats).
+    """
+    if not indexes.enabled:
+        return indexes.repository.setup_stats(date_start, date_end, cell)
+
+    with indexes.snapshot():
+        return indexes.projections["stats"].summary(date_start, date_end, cell)
@@ -0,0 +1,1287 @@
+"""Camada de armazenamento dos registros de setup.
+
+As funções de app.py não acessam mais o diretório dados_setup diretamente
+para ler ou gravar setups: elas chamam um repositório, que pode ser o
+formato original em arquivos (um .txt por setup dentro de dados_setup/<célula>/),
+pacotes mensais por célula (segments.py), um banco SQLite embutido (modo WAL) com tabelas indexadas para setups,
+metadados de imagens, auditorias e exclusões, ou o PostgreSQL
+(storage_postgres.py) para implantações com vários hosts.
+
+As imagens continuam sempre gravadas em disco, em dados_setup/<célula>/,
+para que a rota /photos continue funcionando com qualquer backend.
+"""
+import os
+import json
+import base64
+import logging
+import shutil
+import sqlite3
+import threading
+import unicodedata
+
+from manifest import CellManifests, cell_status_from_summaries, setup_summary
+from journal import SetupDocument, SetupJournal, setup_document
+from setup_ids import legacy_setup_id
+from scanner import list_subdirs, read_json_files, scan_cells, scan_dir
+from segments import SegmentStore
+
+
+# Extensões consideradas imagens de setup
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+# Backends disponíveis (valor da variável de ambiente SETUP_STORAGE_BACKEND)
+BACKEND_FILES = 'files'
+BACKEND_SEGMENTS = 'segments'
+BACKEND_SQLITE = 'sqlite'
+BACKEND_POSTGRES = 'postgres'
+
+
+def is_cell_dir_name(name):
+    """Verifica se uma entrada de dados_setup pode ser o diretório de uma célula.
+
+    Diretórios iniciados por '_' ou '.' são reservados para uso interno.
+    """
+    return bool(name) and not name.startswith(('_', '.'))
+
+
+def parse_audited(value):
+    """Converte o campo 'audited' (que pode estar gravado como string) para booleano."""
+    if isinstance(value, str):
+        return value.lower() in ['true', 'yes', '1', 'on']
+    return bool(value)
+
+
+def normalize_setup(setup_data, file_basename, cell_dir=None, cell_name=None, listing=None):
+    """Normaliza um registro de setup lido do armazenamento.
+
+    Aplica as mesmas conversões que get_all_setups sempre fez na leitura:
+    tipo de setup derivado do nome do arquivo, 'audited' booleano,
+    file_identifier e a lista de imagens (incluindo o formato antigo com
+    uma única .jpg na raiz da célula ou uma pasta de imagens sem metadados).
+    Registros gravados antes dos IDs recebem um setup_id derivado (ver
+    setup_ids.legacy_setup_id).
+
+    Args:
+        setup_data: Dicionário carregado do armazenamento
+        file_basename: Nome do arquivo do setup sem a extensão
+        cell_dir: (Opcional) Diretório da célula, usado para descobrir imagens antigas
+        cell_name: (Opcional) Nome da célula (padrão: nome do diretório da célula)
+        listing: (Opcional) Entradas do diretório da célula já listadas
+            (scanner.DirListing), para descobrir imagens antigas sem stat
+
+    Returns:
+        dict: O próprio setup_data normalizado
+    """
+    # Compatibilidade com arquivos antigos (sem tipo de setup no nome)
+    if "setup_type" not in setup_data:
+        if "_" in file_basename:
+            setup_data["setup_type"] = file_basename.rsplit("_", 1)[1]
+        else:
+            setup_data["setup_type"] = "supply"
+
+    if "audited" in setup_data:
+        setup_data["audited"] = parse_audited(setup_data["audited"])
+
+    setup_data["file_identifier"] = file_basename
+
+    if not setup_data.get("setup_id"):
+        if cell_name is None and cell_dir is not None:
+            cell_name = os.path.basename(cell_dir)
+        setup_data["setup_id"] = legacy_setup_id(cell_name or "", file_basename, setup_data.get("timestamp"))
+
+    images = setup_data.get("images")
+    if isinstance(images, list) and len(images) > 0:
+        setup_data["has_image"] = True
+        setup_data["main_image"] = images[0]["path"]
+        return setup_data
+
+    setup_data["has_image"] = False
+    setup_data["images"] = []
+    if cell_dir is None:
+        return setup_data
+
+    # Formato antigo (imagem única na raiz da célula)
+    if listing is not None:
+        has_single_image = f"{file_basename}.jpg" in listing.files
+    else:
+        has_single_image = os.path.exists(os.path.join(cell_dir, f"{file_basename}.jpg"))
+    if has_single_image:
+        setup_data["has_image"] = True
+        setup_data["images"] = [{
+            "filename": f"{file_basename}.jpg",
+            "path": f"{file_basename}.jpg"
+        }]
+        setup_data["main_image"] = f"{file_basename}.jpg"
+        return setup_data
+
+    # Pasta de imagens sem metadados no registro
+    images_dir = os.path.join(cell_dir, file_basename)
+    if listing is not None:
+        has_images_dir = file_basename in listing.dirs
+    else:
+        has_images_dir = os.path.isdir(images_dir)
+    if has_images_dir:
+        image_files = [f for f in os.listdir(images_dir) if f.lower().endswith(IMAGE_EXTENSIONS)]
+        if image_files:
+            setup_data["has_image"] = True
+            setup_data["images"] = [{
+                "filename": img_file,
+                "path": os.path.join(file_basename, img_file)
+            } for img_file in image_files]
+            setup_data["main_image"] = os.path.join(file_basename, image_files[0])
+
+    return setup_data
+
+
+def split_setup_record(data):
+    """Separa um setup no registro a gravar e na sua lista de imagens.
+
+    Campos derivados (como o file_identifier) são removidos, pois são
+    recalculados na leitura.
+    """
+    record = dict(data)
+    images = record.pop("images", None) or []
+    record.pop("file_identifier", None)
+    # A tabela das imagens só guarda nome e caminho; os demais campos de cada
+    # imagem (formato, dimensões, bytes, qualidade) ficam no registro
+    details = [{k: v for k, v in image.items() if k not in ("filename", "path")} for image in images]
+    if any(details):
+        record["image_details"] = details
+    else:
+        record.pop("image_details", None)
+    return record, images
+
+
+def join_setup_record(record, images):
+    """Junta um registro gravado com split_setup_record e a sua lista de imagens."""
+    details = record.pop("image_details", None) or []
+    for image, extra in zip(images, details):
+        for key, value in extra.items():
+            image.setdefault(key, value)
+    record["images"] = images
+    return record
+
+
+# Filtros aceitos por query_setups (textos são buscados por trecho, ou pelo início
+# com o filtro match='prefix', sem diferenciar maiúsculas e acentos)
+SETUP_TEXT_FILTERS = {
+    "cell": "cell_name",
+    "order": "order_number",
+    "supplier": "supplier_name",
+    "auditor": "auditor_name",
+}
+
+
+class _CombiningMarks(dict):
+    """Tabela de str.translate que remove os acentos (preenchida conforme os caracteres aparecem)."""
+
+    def __missing__(self, codepoint):
+        char = chr(codepoint)
+        self[codepoint] = None if unicodedata.combining(char) else char
+        return self[codepoint]
+
+
+_COMBINING_MARKS = _CombiningMarks()
+
+
+def fold(value):
+    """Normaliza um texto para busca: sem acentos e com casefold.
+
+    Usada em todos os filtros de texto (índices em memória, busca, facetas e
+    os backends SQL, que registram ou criam a função setup_fold). É chamada
+    para cada campo de cada setup ao carregar os índices, então textos ASCII
+    (a maioria) só passam por lower() e os demais removem os acentos com
+    str.translate.
+    """
+    text = str(value or "")
+    if text.isascii():
+        return text.lower()
+    return unicodedata.normalize("NFKD", text).translate(_COMBINING_MARKS).casefold()
+
+
+def encode_cursor(key):
+    """Codifica a chave de ordenação do último setup da página num cursor opaco."""
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Decodifica um cursor gerado por encode_cursor.
+
+    Raises:
+        ValueError: Se o cursor for inválido
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Cursor inválido: {e}")
+    if not isinstance(key, list) or len(key) != 3 or not all(isinstance(part, str) for part in key):
+        raise ValueError("Cursor inválido")
+    return tuple(key)
+
+
+def listing_key(summary):
+    """Chave de ordenação da listagem: data/hora, célula e identificador do setup."""
+    return (summary["timestamp"], summary["cell_name"], summary["file_identifier"])
+
+
+def setup_matches(summary, filters):
+    """Verifica se o resumo de um setup (com cell_name) atende aos filtros da listagem.
+
+    Args:
+        summary: Resumo do setup (ver manifest.setup_summary) com a chave cell_name
+        filters: date_start/date_end (AAAA-MM-DD, comparados com a data do setup),
+            cell, order, supplier, auditor (trechos), match ('contains' ou 'prefix')
+            e audited (True/False)
+    """
+    setup_date = summary["timestamp"][:10]
+    if filters.get("date_start") and setup_date < filters["date_start"]:
+        return False
+    if filters.get("date_end") and setup_date > filters["date_end"]:
+        return False
+    prefix = filters.get("match") == "prefix"
+    for name, field in SETUP_TEXT_FILTERS.items():
+        if not filters.get(name):
+            continue
+        query, value = fold(filters[name]), fold(summary.get(field))
+        if not (value.startswith(query) if prefix else query in value):
+            return False
+    if filters.get("audited") is not None and summary["audited"] != filters["audited"]:
+        return False
+    return True
+
+
+class SetupRepository:
+    """Interface comum dos backends de armazenamento de setups.
+
+    Os backends precisam implementar list_cells, iter_cell_setups, get_setup,
+    save_setup, delete_setup e log_deletion. As consultas restantes têm uma
+    implementação genérica aqui, que os backends podem sobrescrever com uma
+    versão indexada.
+    """
+
+    name = None
+
+    # O cadastro de QR codes pode ser mantido em cache no processo (ver catalog.py)
+    caches_catalog = True
+
+    # Os filtros da auditoria podem usar os índices em memória (ver indexes.py)
+    indexes_setups = True
+
+    # Cadastros (users.json e qrcodes.json) e histórico de exclusões
+    # (deletion_history.json) guardados nos arquivos JSON de data_dir; a
+    # importação não os copia sobre eles mesmos (ver import_setups.py)
+    stores_catalog_files = True
+    stores_deletion_file = False
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        # Diário de alterações que alimenta os índices; as gravações e exclusões
+        # de setups de cada backend registram nele o novo estado
+        self.journal = SetupJournal(data_dir)
+
+    def cell_dir(self, cell_name):
+        """Diretório da célula (onde ficam as imagens dos setups)."""
+        return os.path.join(self.data_dir, cell_name)
+
+    # Operações que cada backend precisa implementar
+
+    def list_cells(self):
+        raise NotImplementedError
+
+    def iter_cell_setups(self, cell_name):
+        raise NotImplementedError
+
+    def get_setup(self, cell_name, file_identifier):
+        raise NotImplementedError
+
+    def save_setup(self, cell_name, file_identifier, data):
+        raise NotImplementedError
+
+    def delete_setup(self, cell_name, file_identifier):
+        raise NotImplementedError
+
+    def log_deletion(self, entry):
+        raise NotImplementedError
+
+    def log_deletions(self, entries):
+        """Registra várias exclusões de uma vez (usado na importação em lote)."""
+        for entry in entries:
+            self.log_deletion(entry)
+
+    def save_setups(self, cell_name, setups):
+        """Grava vários setups de uma célula de uma vez (usado na importação em lote).
+
+        Args:
+            cell_name: Nome da célula
+            setups: Lista de tuplas (file_identifier, dados do setup)
+        """
+        for file_identifier, data in setups:
+            self.save_setup(cell_name, file_identifier, data)
+
+    def record_audit(self, cell_name, file_identifier, data):
+        """Registra uma mudança no status de auditoria de um setup.
+
+        No backend de arquivos o próprio registro do setup guarda o status,
+        então não há nada a fazer por padrão.
+        """
+
+    # Cadastros de usuários e QR codes (por padrão, arquivos JSON em dados_setup)
+
+    def load_users(self):
+        """Obtém a lista de usuários no formato de users.json."""
+        with open(os.path.join(self.data_dir, "users.json"), 'r') as f:
+            return json.load(f)
+
+    def save_users(self, users_list):
+        """Grava a lista de usuários no formato de users.json (gravação atômica)."""
+        users_file = os.path.join(self.data_dir, "users.json")
+        tmp_path = f"{users_file}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(users_list, f)
+        os.replace(tmp_path, users_file)
+
+    def users_version(self):
+        """Versão atual do cadastro de usuários, usada para invalidar o cache.
+
+        Returns:
+            str: Identificador da versão (texto, pode ser guardado na sessão), ou None
+        """
+        try:
+            stat = os.stat(os.path.join(self.data_dir, "users.json"))
+        except FileNotFoundError:
+            return None
+        return f"{stat.st_mtime_ns}-{stat.st_size}-{stat.st_ino}"
+
+    def load_users_or_empty(self):
+        try:
+            return self.load_users()
+        except (FileNotFoundError, json.JSONDecodeError) as e:
+            logging.error(f"Error loading users: {e}")
+            return []
+
+    def load_qrcodes(self):
+        """Obtém o dicionário de QR codes no formato de qrcodes.json."""
+        with open(os.path.join(self.data_dir, "qrcodes.json"), 'r') as f:
+            return json.load(f)
+
+    def save_qrcodes(self, qrcodes):
+        """Grava o dicionário de QR codes no formato de qrcodes.json.
+
+        A gravação é atômica (arquivo temporário + rename), então cada
+        gravação gera um novo inode e os outros workers percebem a mudança.
+        """
+        qrcodes_file = os.path.join(self.data_dir, "qrcodes.json")
+        tmp_path = f"{qrcodes_file}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(qrcodes, f)
+        os.replace(tmp_path, qrcodes_file)
+
+    def catalog_version(self):
+        """Versão atual do cadastro de QR codes, usada para invalidar o cache."""
+        try:
+            stat = os.stat(os.path.join(self.data_dir, "qrcodes.json"))
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def load_qrcodes_or_empty(self):
+        try:
+            return self.load_qrcodes()
+        except (FileNotFoundError, json.JSONDecodeError) as e:
+            logging.error(f"Error loading QR codes: {e}")
+            return {}
+
+    def lookup_qrcode(self, qrcode_value):
+        """Obtém a entrada de um QR code (string no formato antigo ou dicionário), ou None."""
+        return self.load_qrcodes_or_empty().get(qrcode_value)
+
+    def _find_cell_entry(self, qrcodes, cell_name, require_products=False):
+        # Busca direta pela chave e depois pelo nome da célula
+        entry = qrcodes.get(cell_name)
+        if isinstance(entry, dict) and (entry.get("products") or not require_products):
+            return entry
+        for data in qrcodes.values():
+            if isinstance(data, dict) and str(data.get("cell_name", "")) == str(cell_name):
+                if data.get("products") or not require_products:
+                    return data
+        return None
+
+    def cell_products(self, cell_name):
+        """Obtém os produtos cadastrados para a célula (busca exata), ou lista vazia."""
+        entry = self._find_cell_entry(self.load_qrcodes_or_empty(), cell_name, require_products=True)
+        return entry.get("products", []) if entry else []
+
+    def product_items(self, cell_name, product_code):
+        """Obtém os itens de um produto da célula (busca exata).
+
+        Returns:
+            list: Itens do produto, ou None se a célula não for encontrada
+        """
+        entry = self._find_cell_entry(self.load_qrcodes_or_empty(), cell_name)
+        if entry is None:
+            return None
+        for product in entry.get("products", []):
+            if str(product.get("code")) == str(product_code):
+                return product.get("items", [])
+        return []
+
+    # Consultas com implementação genérica
+
+    def get_all_setups(self):
+        """Obtém todos os setups organizados por célula."""
+        return {cell_name: list(self.iter_cell_setups(cell_name)) for cell_name in self.list_cells()}
+
+    def iter_setup_summaries(self):
+        """Percorre os resumos de todos os setups (ver manifest.setup_summary), com cell_name."""
+        for cell_name in self.list_cells():
+            for setup in self.iter_cell_setups(cell_name):
+                yield dict(setup_summary(setup), cell_name=cell_name)
+
+    def iter_setup_documents(self):
+        """Percorre os documentos de todos os setups (ver journal.setup_document).
+
+        Lê os registros completos; usado para (re)construir o diário dos índices.
+
+        Yields:
+            tuple: (célula, file_identifier, documento)
+        """
+        for cell_name in self.list_cells():
+            for setup in self.iter_cell_setups(cell_name):
+                yield cell_name, setup["file_identifier"], setup_document(cell_name, setup)
+
+    def query_setups(self, filters=None, cursor=None, limit=50, descending=True):
+        """Lista setups de todas as células, filtrados e paginados por cursor.
+
+        A ordenação é pela data/hora do setup (depois célula e identificador,
+        para desempate). O cursor é a chave do último setup da página anterior,
+        então as páginas continuam estáveis mesmo com novos registros.
+
+        Args:
+            filters: Filtros (ver setup_matches)
+            cursor: (Opcional) next_cursor devolvido pela página anterior
+            limit: Quantidade de setups por página
+            descending: Mais recentes primeiro (padrão) ou mais antigos primeiro
+
+        Returns:
+            dict: setups (registros completos, com cell_name), next_cursor (ou None)
+            e, na primeira página, total e audited (quantidades que atendem aos filtros)
+
+        Raises:
+            ValueError: Se o cursor for inválido
+        """
+        filters = filters or {}
+        after = decode_cursor(cursor) if cursor else None
+        matches = [summary for summary in self.iter_setup_summaries() if setup_matches(summary, filters)]
+        result = {}
+        if after is None:
+            result["total"] = len(matches)
+            result["audited"] = sum(1 for summary in matches if summary["audited"])
+
+        matches.sort(key=listing_key, reverse=descending)
+        if after is not None:
+            matches = [
+                summary for summary in matches
+                if (listing_key(summary) < after if descending else listing_key(summary) > after)
+            ]
+
+        page = matches[:limit]
+        setups = []
+        for summary in page:
+            setup_data = self.get_setup(summary["cell_name"], summary["file_identifier"])
+            if setup_data is not None:
+                setup_data["cell_name"] = summary["cell_name"]
+                setups.append(setup_data)
+        result["setups"] = setups
+        result["next_cursor"] = encode_cursor(listing_key(page[-1])) if len(matches) > limit else None
+        return result
+
+    def facet_counts(self, filters=None, size=50):
+        """Conta os setups que atendem aos filtros por célula, abastecedor, auditor,
+        tipo de setup e status de auditoria (ver facets.py).
+
+        Returns:
+            dict: total e facets (valores mais frequentes de cada faceta e auditados)
+        """
+        # Importado aqui porque facets.py depende deste módulo
+        from facets import count_facets
+        filters = filters or {}
+        return count_facets((summary for summary in self.iter_setup_summaries() if setup_matches(summary, filters)), size)
+
+    def setup_stats(self, date_start=None, date_end=None, cell=None):
+        """Estatísticas da auditoria do período e das células (ver stats.StatsIndex.summary)."""
+        # Importado aqui porque stats.py depende deste módulo
+        from stats import StatsIndex
+        index = StatsIndex()
+        for cell_name, file_identifier, document in self.iter_setup_documents():
+            index.add((cell_name, file_identifier), document)
+        return index.summary(date_start, date_end, cell)
+
+    def changeover_stats(self, group_by="cell", date_start=None, date_end=None, cell=None, shift=None):
+        """Tempos de troca retirada -> abastecimento (ver changeovers.ChangeoverIndex.summary)."""
+        # Importado aqui porque changeovers.py depende deste módulo
+        from changeovers import ChangeoverIndex
+        index = ChangeoverIndex()
+        for cell_name, file_identifier, document in self.iter_setup_documents():
+            index.add((cell_name, file_identifier), document)
+        return index.summary(group_by, date_start, date_end, cell, shift)
+
+    def search_setups(self, query, filters=None, limit=20, offset=0):
+        """Busca por texto livre nos setups (ver search.SearchIndex.search).
+
+        Returns:
+            tuple: (total de setups encontrados, [(relevância, journal.SetupDocument)] da página)
+        """
+        # Importado aqui porque search.py depende deste módulo
+        from search import SearchIndex
+        documents, index = {}, SearchIndex()
+        for cell_name, file_identifier, document in self.iter_setup_documents():
+            documents[(cell_name, file_identifier)] = SetupDocument(document)
+            index.add((cell_name, file_identifier), document)
+        total, page = index.search(documents, query, filters, limit, offset)
+        return total, [(score, documents[key]) for score, key in page]
+
+    def locate_setup(self, setup_id):
+        """Localiza um setup pelo ID (ver setup_ids.py).
+
+        Percorre os resumos; os backends com índices em memória usam o mapa
+        mantido por indexes.SetupIndexes.locate.
+
+        Returns:
+            tuple: (célula, file_identifier), ou None se o ID não existir
+        """
+        for summary in self.iter_setup_summaries():
+            if summary.get("setup_id") == setup_id:
+                return summary["cell_name"], summary["file_identifier"]
+        return None
+
+    def find_setups(self, cell_name, order_number, setup_type=None):
+        """Obtém os setups de uma ordem na célula, do mais antigo ao mais recente.
+
+        Args:
+            cell_name: Nome da célula
+            order_number: Número da ordem de produção
+            setup_type: (Opcional) Tipo de setup ('removal' ou 'supply')
+
+        Returns:
+            list: Setups encontrados, ordenados pelo file_identifier
+        """
+        setups = [
+            setup for setup in self.iter_cell_setups(cell_name)
+            if str(setup.get("order_number")) == str(order_number)
+            and (not setup_type or setup.get("setup_type") == setup_type)
+        ]
+        setups.sort(key=lambda setup: setup["file_identifier"])
+        return setups
+
+    def find_latest_setup(self, cell_name, order_number, setup_type=None):
+        """Obtém o setup mais recente de uma ordem na célula, ou None."""
+        setups = self.find_setups(cell_name, order_number, setup_type)
+        return setups[-1] if setups else None
+
+    def find_setup_summaries(self, cell_name, order_number, setup_type=None):
+        """Como find_setups, mas devolve apenas o resumo de cada setup (ver manifest.setup_summary)."""
+        return [setup_summary(setup) for setup in self.find_setups(cell_name, order_number, setup_type)]
+
+    def get_setup_images(self, cell_name, order_number, setup_type):
+        """Obtém os caminhos (relativos ao diretório da célula) das imagens de um setup.
+
+        Usa o setup mais recente da ordem/tipo que tenha imagens.
+        """
+        for setup in reversed(self.find_setups(cell_name, order_number, setup_type)):
+            paths = sorted(image["path"] for image in setup.get("images", []) if image.get("path"))
+            if paths:
+                return paths
+        return []
+
+    def cell_status(self, cell_name):
+        """Obtém o status de setup de uma célula.
+
+        Os backends mantêm esse status materializado, atualizado a cada
+        gravação, exclusão ou reset, para que a leitura do QR code não
+        dependa do tamanho do histórico da célula.
+
+        Returns:
+            dict: most_recent_order (maior número de ordem registrado), as
+            flags 'removal' e 'supply' indicando os tipos já registrados
+            para essa ordem e as datas last_removal, last_supply e last_reset
+        """
+        return cell_status_from_summaries(map(setup_summary, self.iter_cell_setups(cell_name)))
+
+    def record_cell_reset(self, cell_name, reset_timestamp):
+        """Guarda a data do último reset da célula no status materializado."""
+
+
+class FileSetupRepository(SetupRepository):
+    """Backend original: um arquivo .txt (JSON) por setup em dados_setup/<célula>/."""
+
+    name = BACKEND_FILES
+
+    stores_deletion_file = True
+
+    def __init__(self, data_dir):
+        super().__init__(data_dir)
+        self.deletion_log_file = os.path.join(data_dir, "deletion_history.json")
+        # Resumo dos setups de cada célula, mantido a cada gravação (ver manifest.py)
+        self.manifests = CellManifests(data_dir, self._setup_ids, self.get_setup)
+
+    def _txt_path(self, cell_name, file_identifier):
+        return os.path.join(self.cell_dir(cell_name), f"{file_identifier}.txt")
+
+    # Registros brutos (sem normalização); o backend de segmentos sobrescreve estes métodos
+
+    def _setup_ids(self, cell_name):
+        listing = scan_dir(self.cell_dir(cell_name))
+        if listing is None:
+            return []
+        return [file[:-4] for file in listing.setup_files]
+
+    def _read_record(self, cell_name, file_identifier):
+        txt_path = self._txt_path(cell_name, file_identifier)
+        if not os.path.exists(txt_path):
+            return None
+        try:
+            with open(txt_path, 'r') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, FileNotFoundError) as e:
+            logging.error(f"Error loading setup data from {txt_path}: {e}")
+            return None
+
+    def _read_records(self, cell_name, listing, prefix=""):
+        if listing is None:
+            return []
+        files = [file for file in listing.setup_files if file.startswith(prefix)]
+        return (
+            (file[:-4], setup_data) for file, setup_data in read_json_files(self.cell_dir(cell_name), files)
+        )
+
+    def _write_records(self, cell_name, records):
+        for file_identifier, record in records:
+            with open(self._txt_path(cell_name, file_identifier), 'w') as f:
+                json.dump(record, f)
+
+    def _remove_record(self, cell_name, file_identifier):
+        try:
+            os.remove(self._txt_path(cell_name, file_identifier))
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            logging.error(f"Erro ao excluir arquivo: {self._txt_path(cell_name, file_identifier)}, erro: {e}")
+            return False
+        return True
+
+    def _load_cell(self, cell_name, prefix=""):
+        # Uma listagem da célula (scanner.scan_dir) serve para achar os registros
+        # e as imagens antigas, sem stat por registro
+        cell_dir = self.cell_dir(cell_name)
+        listing = scan_dir(cell_dir)
+        return [
+            normalize_setup(setup_data, file_identifier, cell_dir, cell_name, listing)
+            for file_identifier, setup_data in self._read_records(cell_name, listing, prefix)
+        ]
+
+    def list_cells(self):
+        return [name for name in list_subdirs(self.data_dir) if is_cell_dir_name(name)]
+
+    def iter_cell_setups(self, cell_name):
+        return iter(self._load_cell(cell_name))
+
+    def scan_setups(self, cells=None, prefix=""):
+        """Lê os setups das células em paralelo (ver scanner.scan_cells).
+
+        Args:
+            cells: (Opcional) Células a ler; por padrão, todas
+            prefix: (Opcional) Início do nome dos .txt (ex.: "<ordem>_")
+
+        Yields:
+            tuple: (célula, setup normalizado)
+        """
+        return scan_cells(
+            self.list_cells() if cells is None else cells,
+            lambda cell_name: self._load_cell(cell_name, prefix)
+        )
+
+    def get_all_setups(self):
+        cells = {cell_name: [] for cell_name in self.list_cells()}
+        for cell_name, setup_data in self.scan_setups(list(cells)):
+            cells[cell_name].append(setup_data)
+        return cells
+
+    def iter_setup_documents(self):
+        for cell_name, setup_data in self.scan_setups():
+            yield cell_name, setup_data["file_identifier"], setup_document(cell_name, setup_data)
+
+    def iter_setup_summaries(self):
+        # Uma leitura de manifesto por célula; os .txt só são abertos para a página pedida
+        for cell_name in self.list_cells():
+            for summary in self.manifests.load(cell_name).values():
+                yield dict(summary, cell_name=cell_name)
+
+    def find_setup_summaries(self, cell_name, order_number, setup_type=None):
+        summaries = [
+            summary for summary in self.manifests.load(cell_name).values()
+            if summary["order_number"] == str(order_number)
+            and (not setup_type or summary["setup_type"] == setup_type)
+        ]
+        summaries.sort(key=lambda summary: summary["file_identifier"])
+        return summaries
+
+    def find_setups(self, cell_name, order_number, setup_type=None):
+        # O manifesto indica os candidatos, então só abrimos os .txt da ordem
+        setups = []
+        for summary in self.find_setup_summaries(cell_name, order_number, setup_type):
+            setup_data = self.get_setup(cell_name, summary["file_identifier"])
+            if setup_data is not None:
+                setups.append(setup_data)
+        return setups
+
+    def cell_status(self, cell_name):
+        return self.manifests.status(cell_name)
+
+    def record_cell_reset(self, cell_name, reset_timestamp):
+        self.manifests.record_reset(cell_name, reset_timestamp)
+
+    def get_setup(self, cell_name, file_identifier):
+        setup_data = self._read_record(cell_name, file_identifier)
+        if setup_data is None:
+            return None
+        return normalize_setup(setup_data, file_identifier, self.cell_dir(cell_name), cell_name)
+
+    def save_setup(self, cell_name, file_identifier, data):
+        self.save_setups(cell_name, [(file_identifier, data)])
+
+    def save_setups(self, cell_name, setups):
+        cell_dir = self.cell_dir(cell_name)
+        os.makedirs(cell_dir, exist_ok=True)
+        records = []
+        for file_identifier, data in setups:
+            record = dict(data)
+            # Campo derivado do nome do arquivo, recalculado na leitura
+            record.pop("file_identifier", None)
+            records.append((file_identifier, record))
+        self._write_records(cell_name, records)
+        normalized = [
+            (file_identifier, normalize_setup(dict(record), file_identifier, cell_dir, cell_name))
+            for file_identifier, record in records
+        ]
+        self.manifests.update_many(cell_name, normalized)
+        self.journal.put_many(cell_name, normalized)
+
+    def get_setup_images(self, cell_name, order_number, setup_type):
+        for summary in reversed(self.find_setup_summaries(cell_name, order_number, setup_type)):
+            if summary["images"]:
+                return sorted(summary["images"])
+
+        # Imagens antigas gravadas diretamente na raiz da célula
+        listing = scan_dir(self.cell_dir(cell_name))
+        if listing is None:
+            return []
+        return sorted(
+            file for file in listing.files
+            if file.lower().endswith(IMAGE_EXTENSIONS + ('.gif',)) and str(order_number) in file
+        )
+
+    def delete_setup(self, cell_name, file_identifier):
+        cell_dir = self.cell_dir(cell_name)
+        paths = [
+            os.path.join(cell_dir, file_identifier),
+            # Para compatibilidade, também o arquivo de imagem direto
+            os.path.join(cell_dir, f"{file_identifier}.jpg"),
+        ]
+        success = self._remove_record(cell_name, file_identifier)
+        for path in paths:
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                elif os.path.exists(path):
+                    os.remove(path)
+                else:
+                    continue
+                success = True
+            except Exception as e:
+                logging.error(f"Erro ao excluir arquivo: {path}, erro: {e}")
+        self.manifests.update(cell_name, file_identifier, None)
+        self.journal.delete(cell_name, file_identifier)
+        return success
+
+    def rebuild_manifests(self, cells=None):
+        """Reconstrói os manifestos das células a partir dos registros gravados.
+
+        Args:
+            cells: (Opcional) Células a reconstruir; por padrão, todas
+
+        Returns:
+            dict: Quantidade de setups por célula
+        """
+        return {cell_name: self.manifests.rebuild(cell_name) for cell_name in (cells or self.list_cells())}
+
+    def log_deletion(self, entry):
+        self.log_deletions([entry])
+
+    def log_deletions(self, entries):
+        history = []
+        if os.path.exists(self.deletion_log_file):
+            try:
+                with open(self.deletion_log_file, 'r') as f:
+                    history = json.load(f)
+            except Exception as e:
+                logging.error(f"Erro ao ler arquivo de histórico de exclusões: {e}")
+                history = []
+
+        history.extend(entries)
+
+        with open(self.deletion_log_file, 'w') as f:
+            json.dump(history, f, indent=2)
+
+
+class SegmentSetupRepository(FileSetupRepository):
+    """Setups em pacotes mensais por célula (ver segments.py).
+
+    Igual ao backend de arquivos (manifestos, imagens em dados_setup/<célula>/),
+    mas os registros ficam em dados_setup/_segments/<célula>/<AAAA-MM>.seg em
+    vez de um .txt por setup.
+    """
+
+    name = BACKEND_SEGMENTS
+
+    def __init__(self, data_dir):
+        self.segments = SegmentStore(data_dir)
+        super().__init__(data_dir)
+
+    def _setup_ids(self, cell_name):
+        return self.segments.ids(cell_name)
+
+    def _read_record(self, cell_name, file_identifier):
+        return self.segments.get(cell_name, file_identifier)
+
+    def _read_records(self, cell_name, listing, prefix=""):
+        return self.segments.read_cell(cell_name, prefix)
+
+    def _write_records(self, cell_name, records):
+        self.segments.append(cell_name, records)
+
+    def _remove_record(self, cell_name, file_identifier):
+        return file_identifier in self.segments.append(cell_name, [(file_identifier, None)])
+
+    def list_cells(self):
+        return sorted(set(super().list_cells()) | set(self.segments.cells()))
+
+    def compact_segments(self, cells=None):
+        """Compacta os segmentos das células (ver SegmentStore.compact).
+
+        Returns:
+            dict: Bytes recuperados por célula
+        """
+        return {cell_name: self.segments.compact(cell_name) for cell_name in (cells or self.segments.cells())}
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS setups (
+    cell_name TEXT NOT NULL,
+    file_identifier TEXT NOT NULL,
+    order_number TEXT NOT NULL,
+    setup_type TEXT NOT NULL,
+    timestamp TEXT NOT NULL DEFAULT '',
+    supplier_name TEXT NOT NULL DEFAULT '',
+    auditor_name TEXT NOT NULL DEFAULT '',
+    audited INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL,
+    PRIMARY KEY (cell_name, file_identifier)
+);
+CREATE INDEX IF NOT EXISTS idx_setups_order ON setups (cell_name, order_number, setup_type);
+CREATE INDEX IF NOT EXISTS idx_setups_timestamp ON setups (timestamp);
+CREATE INDEX IF NOT EXISTS idx_setups_audited ON setups (audited, timestamp);
+
+CREATE TABLE IF NOT EXISTS setup_images (
+    cell_name TEXT NOT NULL,
+    file_identifier TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    path TEXT NOT NULL,
+    PRIMARY KEY (cell_name, file_identifier, position)
+);
+
+CREATE TABLE IF NOT EXISTS audits (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    cell_name TEXT NOT NULL,
+    file_identifier TEXT NOT NULL,
+    audited INTEGER NOT NULL,
+    auditor_name TEXT NOT NULL DEFAULT '',
+    audit_notes TEXT NOT NULL DEFAULT '',
+    audit_timestamp TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_audits_setup ON audits (cell_name, file_identifier);
+
+CREATE TABLE IF NOT EXISTS deletions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    cell_name TEXT NOT NULL,
+    order_number TEXT,
+    setup_type TEXT,
+    deleted_by TEXT,
+    setup_data TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_deletions_cell ON deletions (cell_name, timestamp);
+
+CREATE TABLE IF NOT EXISTS cell_status (
+    cell_name TEXT PRIMARY KEY,
+    most_recent_order TEXT,
+    removal INTEGER NOT NULL DEFAULT 0,
+    supply INTEGER NOT NULL DEFAULT 0,
+    last_removal TEXT,
+    last_supply TEXT,
+    last_reset TEXT
+);
+"""
+
+
+class SQLiteSetupRepository(SetupRepository):
+    """Backend SQLite embutido (modo WAL) com tabelas indexadas.
+
+    Cada thread (e cada processo, após o fork dos workers do gunicorn) usa
+    a sua própria conexão. O arquivo do banco só é criado no primeiro acesso.
+    """
+
+    name = BACKEND_SQLITE
+
+    def __init__(self, data_dir, db_path=None):
+        super().__init__(data_dir)
+        self.db_path = db_path or os.path.join(data_dir, "setups.db")
+        self._local = threading.local()
+
+    def connection(self):
+        """Obtém a conexão da thread atual, criando o esquema se necessário."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        # Normalização dos filtros de texto (a mesma dos índices em memória)
+        conn.create_function("setup_fold", 1, fold, deterministic=True)
+        conn.executescript(SQLITE_SCHEMA)
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _images_for(self, conn, where, params):
+        images = {}
+        for row in conn.execute(
+            f"SELECT cell_name, file_identifier, filename, path FROM setup_images WHERE {where} "
+            "ORDER BY cell_name, file_identifier, position", params
+        ):
+            key = (row["cell_name"], row["file_identifier"])
+            images.setdefault(key, []).append({"filename": row["filename"], "path": row["path"]})
+        return images
+
+    def _rows_to_setups(self, conn, rows, images_where, images_params):
+        images = self._images_for(conn, images_where, images_params)
+        setups = []
+        for row in rows:
+            setup_data = join_setup_record(
+                json.loads(row["data"]), images.get((row["cell_name"], row["file_identifier"]), [])
+            )
+            setups.append(normalize_setup(setup_data, row["file_identifier"], cell_name=row["cell_name"]))
+        return setups
+
+    def list_cells(self):
+        conn = self.connection()
+        return [row[0] for row in conn.execute("SELECT DISTINCT cell_name FROM setups ORDER BY cell_name")]
+
+    def iter_cell_setups(self, cell_name):
+        conn = self.connection()
+        rows = conn.execute(
+            "SELECT cell_name, file_identifier, data FROM setups WHERE cell_name = ?", (cell_name,)
+        ).fetchall()
+        return iter(self._rows_to_setups(conn, rows, "cell_name = ?", (cell_name,)))
+
+    def get_all_setups(self):
+        conn = self.connection()
+        rows = conn.execute(
+            "SELECT cell_name, file_identifier, data FROM setups ORDER BY cell_name"
+        ).fetchall()
+        cells = {}
+        for setup_data, row in zip(self._rows_to_setups(conn, rows, "1 = 1", ()), rows):
+            cells.setdefault(row["cell_name"], []).append(setup_data)
+        return cells
+
+    def query_setups(self, filters=None, cursor=None, limit=50, descending=True):
+        filters = filters or {}
+        after = decode_cursor(cursor) if cursor else None
+        conditions, params = [], []
+        if filters.get("date_start"):
+            conditions.append("substr(timestamp, 1, 10) >= ?")
+            params.append(filters["date_start"])
+        if filters.get("date_end"):
+            conditions.append("substr(timestamp, 1, 10) <= ?")
+            params.append(filters["date_end"])
+        for name, column in SETUP_TEXT_FILTERS.items():
+            if filters.get(name):
+                query = fold(filters[name])
+                if filters.get("match") == "prefix":
+                    conditions.append(f"substr(setup_fold({column}), 1, ?) = ?")
+                    params.append(len(query))
+                else:
+                    conditions.append(f"instr(setup_fold({column}), ?) > 0")
+                params.append(query)
+        if filters.get("audited") is not None:
+            conditions.append("audited = ?")
+            params.append(1 if filters["audited"] else 0)
+
+        conn = self.connection()
+        where = " AND ".join(conditions) or "1 = 1"
+        result = {}
+        if after is None:
+            row = conn.execute(f"SELECT COUNT(*), COALESCE(SUM(audited), 0) FROM setups WHERE {where}", params).fetchone()
+            result["total"], result["audited"] = row[0], row[1]
+
+        page_where, page_params = where, list(params)
+        if after is not None:
+            page_where += f" AND (timestamp, cell_name, file_identifier) {'<' if descending else '>'} (?, ?, ?)"
+            page_params.extend(after)
+        direction = "DESC" if descending else "ASC"
+        rows = conn.execute(
+            f"SELECT cell_name, file_identifier, timestamp, data FROM setups WHERE {page_where} "
+            f"ORDER BY timestamp {direction}, cell_name {direction}, file_identifier {direction} LIMIT ?",
+            page_params + [limit + 1]
+        ).fetchall()
+
+        page = rows[:limit]
+        setups = []
+        if page:
+            placeholders = ",".join("(?, ?)" for _ in page)
+            keys = [value for row in page for value in (row["cell_name"], row["file_identifier"])]
+            setups = self._rows_to_setups(conn, page, f"(cell_name, file_identifier) IN (VALUES {placeholders})", keys)
+            for setup_data, row in zip(setups, page):
+                setup_data["cell_name"] = row["cell_name"]
+        result["setups"] = setups
+        last = page[-1] if page else None
+        result["next_cursor"] = (
+            encode_cursor((last["timestamp"], last["cell_name"], last["file_identifier"])) if len(rows) > limit else None
+        )
+        return result
+
+    def find_setups(self, cell_name, order_number, setup_type=None):
+        conn = self.connection()
+        query = "SELECT cell_name, file_identifier, data FROM setups WHERE cell_name = ? AND order_number = ?"
+        params = [cell_name, str(order_number)]
+        if setup_type:
+            query += " AND setup_type = ?"
+            params.append(setup_type)
+        rows = conn.execute(query + " ORDER BY file_identifier", params).fetchall()
+        if not rows:
+            return []
+        placeholders = ",".join("?" for _ in rows)
+        return self._rows_to_setups(
+            conn, rows,
+            f"cell_name = ? AND file_identifier IN ({placeholders})",
+            [cell_name] + [row["file_identifier"] for row in rows]
+        )
+
+    def get_setup(self, cell_name, file_identifier):
+        conn = self.connection()
+        rows = conn.execute(
+            "SELECT cell_name, file_identifier, data FROM setups WHERE cell_name = ? AND file_identifier = ?",
+            (cell_name, file_identifier)
+        ).fetchall()
+        if not rows:
+            return None
+        return self._rows_to_setups(
+            conn, rows, "cell_name = ? AND file_identifier = ?", (cell_name, file_identifier)
+        )[0]
+
+    def save_setup(self, cell_name, file_identifier, data):
+        self.save_setups(cell_name, [(file_identifier, data)])
+
+    def save_setups(self, cell_name, setups):
+        setup_rows, image_rows, keys, saved = [], [], [], []
+        for file_identifier, data in setups:
+            record, images = split_setup_record(data)
+            saved.append((
+                file_identifier, normalize_setup(dict(record, images=images), file_identifier, cell_name=cell_name)
+            ))
+            setup_rows.append((
+                cell_name, file_identifier,
+                str(record.get("order_number", "")),
+                record.get("setup_type", "supply"),
+                record.get("timestamp", ""),
+                record.get("supplier_name") or "",
+                record.get("auditor_name") or "",
+                1 if parse_audited(record.get("audited", False)) else 0,
+                json.dumps(record),
+            ))
+            keys.append((cell_name, file_identifier))
+            image_rows.extend(
+                (cell_name, file_identifier, position, image.get("filename", ""), image.get("path", ""))
+                for position, image in enumerate(images)
+            )
+
+        conn = self.connection()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO setups (cell_name, file_identifier, order_number, setup_type, "
+                "timestamp, supplier_name, auditor_name, audited, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                setup_rows
+            )
+            conn.executemany(
+                "DELETE FROM setup_images WHERE cell_name = ? AND file_identifier = ?", keys
+            )
+            conn.executemany(
+                "INSERT INTO setup_images (cell_name, file_identifier, position, filename, path) "
+                "VALUES (?, ?, ?, ?, ?)",
+                image_rows
+            )
+            self._refresh_cell_status(conn, cell_name)
+        self.journal.put_many(cell_name, saved)
+
+    def delete_setup(self, cell_name, file_identifier):
+        conn = self.connection()
+        with conn:
+            deleted = conn.execute(
+                "DELETE FROM setups WHERE cell_name = ? AND file_identifier = ?",
+                (cell_name, file_identifier)
+            ).rowcount
+            conn.execute(
+                "DELETE FROM setup_images WHERE cell_name = ? AND file_identifier = ?",
+                (cell_name, file_identifier)
+            )
+            self._refresh_cell_status(conn, cell_name)
+        self.journal.delete(cell_name, file_identifier)
+
+        # As imagens continuam em disco e precisam ser removidas junto com o registro
+        images_dir = os.path.join(self.cell_dir(cell_name), file_identifier)
+        if os.path.isdir(images_dir):
+            try:
+                shutil.rmtree(images_dir)
+            except Exception as e:
+                logging.error(f"Erro ao excluir imagens: {images_dir}, erro: {e}")
+        return deleted > 0
+
+    def log_deletion(self, entry):
+        self.log_deletions([entry])
+
+    def log_deletions(self, entries):
+        conn = self.connection()
+        with conn:
+            conn.executemany(
+                "INSERT INTO deletions (timestamp, cell_name, order_number, setup_type, deleted_by, setup_data) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        entry.get("timestamp", ""), entry.get("cell_name", ""),
+                        entry.get("order_number"), entry.get("setup_type"),
+                        entry.get("deleted_by"), json.dumps(entry.get("setup_data")),
+                    )
+                    for entry in entries
+                ]
+            )
+
+    def record_audit(self, cell_name, file_identifier, data):
+        conn = self.connection()
+        with conn:
+            conn.execute(
+                "INSERT INTO audits (cell_name, file_identifier, audited, auditor_name, audit_notes, audit_timestamp) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    cell_name, file_identifier,
+                    1 if parse_audited(data.get("audited", False)) else 0,
+                    data.get("auditor_name") or "",
+                    data.get("audit_notes") or "",
+                    data.get("audit_timestamp") or "",
+                )
+            )
+
+    def get_setup_images(self, cell_name, order_number, setup_type):
+        conn = self.connection()
+        rows = conn.execute(
+            "SELECT i.file_identifier, i.path FROM setup_images i "
+            "JOIN setups s ON s.cell_name = i.cell_name AND s.file_identifier = i.file_identifier "
+            "WHERE s.cell_name = ? AND s.order_number = ? AND s.setup_type = ? "
+            "ORDER BY i.file_identifier DESC, i.path",
+            (cell_name, str(order_number), setup_type)
+        ).fetchall()
+        if not rows:
+            return []
+        latest = rows[0]["file_identifier"]
+        return [row["path"] for row in rows if row["file_identifier"] == latest]
+
+    def _refresh_cell_status(self, conn, cell_name):
+        # Recalculado pelos índices da célula na mesma transação da gravação
+        row = conn.execute(
+            "SELECT MAX(order_number) FROM setups WHERE cell_name = ? AND order_number != ''", (cell_name,)
+        ).fetchone()
+        most_recent_order = row[0] if row else None
+        latest_types = {
+            setup_type for (setup_type,) in conn.execute(
+                "SELECT DISTINCT setup_type FROM setups WHERE cell_name = ? AND order_number = ?",
+                (cell_name, most_recent_order)
+            )
+        }
+        last_timestamps = dict(conn.execute(
+            "SELECT setup_type, MAX(timestamp) FROM setups WHERE cell_name = ? AND timestamp != '' "
+            "GROUP BY setup_type", (cell_name,)
+        ).fetchall())
+        conn.execute(
+            "INSERT INTO cell_status (cell_name, most_recent_order, removal, supply, last_removal, last_supply) "
+            "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (cell_name) DO UPDATE SET "
+            "most_recent_order = excluded.most_recent_order, removal = excluded.removal, "
+            "supply = excluded.supply, last_removal = excluded.last_removal, last_supply = excluded.last_supply",
+            (
+                cell_name, most_recent_order,
+                1 if "removal" in latest_types else 0, 1 if "supply" in latest_types else 0,
+                last_timestamps.get("removal"), last_timestamps.get("supply"),
+            )
+        )
+
+    def cell_status(self, cell_name):
+        conn = self.connection()
+        row = conn.execute("SELECT * FROM cell_status WHERE cell_name = ?", (cell_name,)).fetchone()
+        if row is None:
+            # Banco criado antes do status materializado (ou célula sem setups)
+            with conn:
+                self._refresh_cell_status(conn, cell_name)
+            row = conn.execute("SELECT * FROM cell_status WHERE cell_name = ?", (cell_name,)).fetchone()
+        return {
+            "most_recent_order": row["most_recent_order"],
+            "removal": bool(row["removal"]),
+            "supply": bool(row["supply"]),
+            "last_removal": row["last_removal"],
+            "last_supply": row["last_supply"],
+            "last_reset": row["last_reset"],
+        }
+
+    def record_cell_reset(self, cell_name, reset_timestamp):
+        conn = self.connection()
+        with conn:
+            conn.execute(
+                "INSERT INTO cell_status (cell_name, last_reset) VALUES (?, ?) "
+                "ON CONFLICT (cell_name) DO UPDATE SET last_reset = excluded.last_reset",
+                (cell_name, reset_timestamp)
+            )
+
+
+def create_repository(data_dir, backend=None):
+    """Cria o repositório de setups para o backend configurado.
+
+    Args:
+        data_dir: Diretório raiz dos dados (dados_setup)
+        backend: 'files' (padrão), 'segments', 'sqlite' ou 'postgres'. Se não informado, usa a
+            variável de ambiente SETUP_STORAGE_BACKEND.
+
+    Returns:
+        SetupRepository: Repositório pronto para uso
+    """
+    backend = (backend or os.environ.get("SETUP_STORAGE_BACKEND") or BACKEND_FILES).lower()
+    if backend == BACKEND_SEGMENTS:
+        return SegmentSetupRepository(data_dir)
+    if backend == BACKEND_SQLITE:
+        return SQLiteSetupRepository(data_dir, os.environ.get("SETUP_SQLITE_PATH"))
+    if backend == BACKEND_POSTGRES:
+        # Importado somente quando usado, para não exigir o psycopg2 nos outros backends
+        from storage_postgres import PostgresSetupRepository
+        return PostgresSetupRepository(data_dir)
+    if backend != BACKEND_FILES:
+        logging.warning(f"Backend de armazenamento desconhecido: {backend}. Usando '{BACKEND_FILES}'.")
+    return FileSetupRepository(data_dir)
@@ -0,0 +1,258 @@
+"""Área de envio das fotos, antes do registro do setup.
+
+Com Wi-Fi fraco, um POST /setup com várias fotos falhava inteiro e o
+operador tinha que começar de novo. Aqui cada foto é enviada sozinha, logo
+depois de capturada, e em partes que podem ser retomadas:
+
+    POST  /api/uploads           {"size": bytes}  -> token
+    PATCH /api/uploads/<token>   parte da foto a partir do byte Upload-Offset
+    GET   /api/uploads/<token>   bytes já recebidos (para retomar o envio)
+
+O formulário do setup só leva os tokens (campo photo_tokens), então o envio
+final é imediato: as fotos já estão no servidor e são movidas (sem cópia)
+para a fila de fotos.
+
+Cada envio fica em dados_setup/_uploads/<token>/ (meta.json e photo.part); o
+tamanho de photo.part é o total recebido. As partes de um envio são gravadas
+com um lock do arquivo, então dois workers não escrevem no mesmo ponto. Um
+envio não usado é apagado depois de UPLOAD_TTL_HOURS sem atividade: a
+verificação roda no máximo a cada GC_INTERVAL segundos, quando um envio é
+criado, e pelo comando "flask --app main gc-uploads".
+
+Variáveis de ambiente:
+    UPLOAD_TTL_HOURS    Horas sem atividade até um envio não usado ser apagado (padrão 24)
+"""
+import os
+import re
+import json
+import time
+import uuid
+import fcntl
+import shutil
+import logging
+import datetime
+import threading
+
+
+UPLOAD_DIR = "_uploads"
+META_FILE = "meta.json"
+DATA_FILE = "photo.part"
+
+# Tamanho das partes sugerido aos clientes
+CHUNK_SIZE = 256 * 1024
+# Blocos da cópia de uma parte recebida para o disco
+COPY_BUFFER = 64 * 1024
+# Intervalo mínimo entre duas limpezas automáticas (por worker)
+GC_INTERVAL = 600
+
+TOKEN_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+class UploadNotFound(Exception):
+    """Envio inexistente, expirado ou de outro usuário."""
+
+
+class UploadIncomplete(Exception):
+    """Envio usado no registro do setup antes de receber todos os bytes."""
+
+
+class UploadOffsetMismatch(Exception):
+    """A parte não começa no byte seguinte ao último recebido.
+
+    Attributes:
+        offset: Bytes já recebidos (de onde o cliente deve continuar)
+    """
+
+    def __init__(self, offset):
+        super().__init__(f"O envio está no byte {offset}")
+        self.offset = offset
+
+
+class UploadStaging:
+    """Envios das fotos em partes, identificados por token.
+
+    Args:
+        data_dir: Diretório raiz dos dados (dados_setup)
+        ttl: (Opcional) Segundos sem atividade até um envio ser apagado
+            (padrão: UPLOAD_TTL_HOURS ou 24 horas)
+        max_size: (Opcional) Tamanho máximo de uma foto, em bytes
+    """
+
+    def __init__(self, data_dir, ttl=None, max_size=None):
+        self.upload_dir = os.path.join(data_dir, UPLOAD_DIR)
+        self.ttl = ttl if ttl is not None else float(os.environ.get("UPLOAD_TTL_HOURS", 24)) * 3600
+        self.max_size = max_size
+        self._last_collect = 0
+        self._lock = threading.Lock()
+
+    def _dir(self, token):
+        if not isinstance(token, str) or not TOKEN_PATTERN.match(token):
+            raise UploadNotFound(token)
+        return os.path.join(self.upload_dir, token)
+
+    def _meta(self, token, owner):
+        upload_dir = self._dir(token)
+        try:
+            with open(os.path.join(upload_dir, META_FILE), encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            raise UploadNotFound(token)
+        if meta.get("owner") != owner:
+            raise UploadNotFound(token)
+        return upload_dir, meta
+
+    def _status(self, token, meta, offset):
+        return {
+            "token": token,
+            "size": meta["size"],
+            "offset": offset,
+            "complete": offset == meta["size"],
+            "chunk_size": CHUNK_SIZE,
+        }
+
+    def create(self, owner, size, filename=""):
+        """Abre um envio.
+
+        Args:
+            owner: Usuário que envia a foto (só ele pode continuar e usar o envio)
+            size: Tamanho da foto em bytes
+            filename: (Opcional) Nome original do arquivo
+
+        Returns:
+            dict: Situação do envio (token, size, offset, complete, chunk_size)
+        """
+        if not isinstance(size, int) or isinstance(size, bool) or size <= 0:
+            raise ValueError("Tamanho da foto inválido")
+        if self.max_size is not None and size > self.max_size:
+            raise ValueError(f"Foto maior que o limite de {self.max_size // (1024 * 1024)} MB")
+        self.maybe_collect()
+
+        token = uuid.uuid4().hex
+        upload_dir = self._dir(token)
+        os.makedirs(upload_dir)
+        meta = {
+            "owner": owner,
+            "size": size,
+            "filename": str(filename or "")[:255],
+            "created_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        open(os.path.join(upload_dir, DATA_FILE), 'wb').close()
+        # meta.json por último: um envio sem ele é tratado como inexistente
+        temp_path = os.path.join(upload_dir, META_FILE + ".tmp")
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(temp_path, os.path.join(upload_dir, META_FILE))
+        return self._status(token, meta, 0)
+
+    def status(self, token, owner):
+        """Situação de um envio (para retomar de onde parou)."""
+        upload_dir, meta = self._meta(token, owner)
+        return self._status(token, meta, os.path.getsize(os.path.join(upload_dir, DATA_FILE)))
+
+    def append(self, token, owner, offset, stream, length):
+        """Grava uma parte da foto.
+
+        Se a conexão cair no meio da parte, o que chegou fica gravado e o
+        cliente continua do novo offset (consultado em status).
+
+        Args:
+            token: Token do envio
+            owner: Usuário que envia a foto
+            offset: Byte em que a parte começa (deve ser o total já recebido)
+            stream: Corpo da requisição
+            length: Tamanho da parte em bytes
+
+        Returns:
+            dict: Situação do envio depois da gravação
+        """
+        upload_dir, meta = self._meta(token, owner)
+        if length < 0 or offset + length > meta["size"]:
+            raise ValueError("A parte ultrapassa o tamanho declarado da foto")
+
+        with open(os.path.join(upload_dir, DATA_FILE), 'ab') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                received = os.fstat(f.fileno()).st_size
+                if offset != received:
+                    raise UploadOffsetMismatch(received)
+                remaining = length
+                while remaining > 0:
+                    block = stream.read(min(COPY_BUFFER, remaining))
+                    if not block:
+                        break
+                    f.write(block)
+                    remaining -= len(block)
+                f.flush()
+                received = os.fstat(f.fileno()).st_size
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return self._status(token, meta, received)
+
+    def claim(self, tokens, owner):
+        """Confere os envios referenciados no registro de um setup.
+
+        Returns:
+            list: Caminhos das fotos recebidas, na ordem dos tokens
+        """
+        paths = []
+        for token in tokens:
+            upload_dir, meta = self._meta(token, owner)
+            path = os.path.join(upload_dir, DATA_FILE)
+            try:
+                received = os.path.getsize(path)
+            except FileNotFoundError:
+                # Já usado no registro de outro setup
+                raise UploadNotFound(token)
+            if received != meta["size"]:
+                raise UploadIncomplete(token)
+            paths.append(path)
+        return paths
+
+    def discard(self, token):
+        """Apaga um envio (usado no registro de um setup ou cancelado)."""
+        shutil.rmtree(self._dir(token), ignore_errors=True)
+
+    # Limpeza
+
+    def collect(self, now=None):
+        """Apaga os envios sem atividade há mais de ttl segundos.
+
+        Returns:
+            int: Quantidade de envios apagados
+        """
+        now = now if now is not None else time.time()
+        removed = 0
+        try:
+            entries = list(os.scandir(self.upload_dir))
+        except FileNotFoundError:
+            return 0
+        for entry in entries:
+            if not entry.is_dir() or not TOKEN_PATTERN.match(entry.name):
+                continue
+            last_activity = 0
+            try:
+                last_activity = entry.stat().st_mtime
+                # Cada parte recebida altera photo.part
+                last_activity = max(last_activity, os.stat(os.path.join(entry.path, DATA_FILE)).st_mtime)
+            except FileNotFoundError:
+                pass
+            if now - last_activity > self.ttl:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+        if removed:
+            logging.info(f"Envios de fotos expirados apagados: {removed}")
+        return removed
+
+    def maybe_collect(self):
+        """Roda collect se a última limpeza deste worker foi há mais de GC_INTERVAL segundos."""
+        now = time.time()
+        if now - self._last_collect < GC_INTERVAL:
+            return
+        with self._lock:
+            if now - self._last_collect < GC_INTERVAL:
+                return
+            self._last_collect = now
+        try:
+            self.collect(now)
+        except OSError as e:
+            logging.error(f"Erro na limpeza dos envios de fotos: {e}")